@@ -1,24 +1,30 @@
 import numpy as np
 from pandas import DataFrame
 
+from utils.context import DataContext
 from utils.log import logger
 
 
-def func(prc_df: DataFrame, cfg: dict):
+def func(prc_df: DataFrame, cfg: dict, ctx: DataContext):
     """
     1. calculate signal
     """
     # calculate signal
-    prc_df["signal"] = abs((prc_df["binance_open_prc"] / prc_df["okx_open_prc"]) - 1)
     # define threshold
     # calculate 90th percentile on a 30 periods rolling window
     # use max(cfg['threshold'], rolling 90th percentile) as threshold
-    prc_df["threshold"] = (
-        prc_df["signal"]
-        .rolling(window=30, closed="left")
-        .apply(func=lambda x: np.percentile(x, q=90))
-        .fillna(value=cfg["threshold"])
+    signal: tuple = ("price_gap", {"num": "binance", "den": "okx"})
+    prc_df = ctx.features.assign(
+        prc_df=prc_df,
+        columns={
+            "signal": signal,
+            "threshold": (
+                "rolling_quantile",
+                {"source": signal, "window": 30, "q": 0.9},
+            ),
+        },
     )
+    prc_df["threshold"] = prc_df["threshold"].fillna(value=cfg["threshold"])
     prc_df["threshold"] = np.where(
         prc_df["threshold"] < cfg["threshold"],
         cfg["threshold"],
@@ -1,77 +1,48 @@
 import numpy as np
-from pandas import DataFrame, merge
+from pandas import DataFrame
 
-from utils.loader import load_price
+from utils.context import DataContext
 from utils.log import logger
-from utils.valid import check_cols
 
 
-def func(prc_df: DataFrame, cfg: dict):
+def func(prc_df: DataFrame, cfg: dict, ctx: DataContext):
     # load params from config
     lookback: int = cfg["lookback"]
     halflife: int = cfg["halflife"]
     z_lb: int = cfg["z_lb"]
 
     """
-    1. load bybit price to help decide the mid price
+    1. features, shared with the other strategies run on the same data
     """
-    bybit_prc: DataFrame = load_price(
-        stime=min(prc_df["ts"]),
-        etime=max(prc_df["ts"]),
-        exchange="bybit",
-        symbols=[cfg["ccxt_sym"]],
-        timeframe=cfg["timeframe"],
+    # bybit is loaded by main, see 'venues' in config
+    venues: list[str] = ["binance", "okx", "bybit"]
+    # the spread between binance and okx, distances to the mid price of the venues
+    score: tuple = ("score", {"legs": ["binance", "okx"], "venues": venues})
+    prc_df = ctx.features.assign(
+        prc_df=prc_df,
+        columns={
+            "bybit_open_prc": ("venue", {"exchange": "bybit"}),
+            "mid_prc": ("mid_prc", {"venues": venues}),
+            "okx_dis": ("venue_dis", {"exchange": "okx", "venues": venues}),
+            "binance_dis": ("venue_dis", {"exchange": "binance", "venues": venues}),
+            "score": score,
+            # exponentially moving average and standard deviation of the score
+            "rolling_mean": (
+                "rolling_ewm",
+                {"source": score, "lookback": lookback, "halflife": halflife},
+            ),
+            "rolling_std": ("rolling_std", {"source": score, "lookback": lookback}),
+            # z score to dynamically define if the score is an extreme value that gives us signal
+            "signal": (
+                "zscore",
+                {"source": score, "lookback": lookback, "halflife": halflife},
+            ),
+        },
     )
-    check_cols(
-        df=bybit_prc,
-        cols=["sym", "ts", "open", "high", "low", "close", "volume"],
-    )
-    bybit_prc["ret"] = bybit_prc["close"] / bybit_prc["open"] - 1
 
-    # merge bybit information to prc_df
-    prc_df = merge(
-        left=prc_df,
-        right=bybit_prc[["sym", "ts", "open", "ret", "volume"]].rename(
-            columns={
-                "open": "bybit_open_prc",
-                "ret": "bybit_ret",
-                "volume": "bybit_vol",
-            }
-        ),
-        how="left",
-        on=["sym", "ts"],
-    )
     """
     2. calculate signal
     """
-    # define mid price
-    prc_df["mid_prc"] = (
-        prc_df["binance_open_prc"] + prc_df["okx_open_prc"] + prc_df["bybit_open_prc"]
-    ) / 3
-    # calculate the distance between okx open price and the mid price
-    prc_df["okx_dis"] = (prc_df["okx_open_prc"] - prc_df["mid_prc"]) / prc_df["mid_prc"]
-    # calculate the distance between binance open price and the mid price
-    prc_df["binance_dis"] = (prc_df["binance_open_prc"] - prc_df["mid_prc"]) / prc_df[
-        "mid_prc"
-    ]
-
-    # define the spread between binance and okx
-    prc_df["score"] = prc_df["binance_dis"].abs() + prc_df["okx_dis"].abs()
-    # calculate exponentially moving average of the score
-    prc_df["rolling_mean"] = prc_df["score"].transform(
-        lambda y: y.rolling(window=lookback, closed="left").apply(
-            func=lambda x: x.ewm(halflife=halflife).mean().iloc[-1]
-        )
-    )
-    # calculate rolling standard deviation of the score
-    prc_df["rolling_std"] = (
-        prc_df["score"].rolling(window=lookback, closed="left").std()
-    )
-    # calculate z score to dynamically define if the score is an extreme value that gives us signal
-    prc_df["signal"] = (prc_df["score"] - prc_df["rolling_mean"]) / prc_df[
-        "rolling_std"
-    ]
-
     # Make sure binance open price and okx open price are distributed at 2 sides of the mid
     # Make sure z score is higher than the lower bound to define 'abnormal'
     prc_df["trade"] = np.where(
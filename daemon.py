@@ -0,0 +1,75 @@
+import json
+import os
+import socket
+import sys
+from argparse import ArgumentParser, Namespace
+
+import yaml
+
+from utils.var import DAEMON_SOCKET_FP
+
+# the client only talks to the socket, the backtest stack is imported by the server
+
+
+def send(request: dict, socket_fp: str = DAEMON_SOCKET_FP) -> dict:
+    """send a request to the daemon
+
+    Args:
+        request (dict): see BacktestDaemon.handle
+        socket_fp (str, optional): unix socket path. Defaults to DAEMON_SOCKET_FP.
+
+    Returns:
+        dict: response of the daemon
+    """
+    with socket.socket(family=socket.AF_UNIX, type=socket.SOCK_STREAM) as sock:
+        sock.connect(socket_fp)
+        sock.sendall(json.dumps(request, default=str).encode() + b"\n")
+        with sock.makefile(mode="r") as f:
+            return json.loads(f.readline())
+
+
+if __name__ == "__main__":
+    """
+    1. parse arguments
+    """
+    parser: ArgumentParser = ArgumentParser(
+        description="Backtest daemon keeping data and strategies warm"
+    )
+    parser.add_argument(
+        "cmd",
+        choices=["serve", "run", "status", "stop"],
+        help="serve starts the daemon, the other commands are sent to it",
+    )
+    parser.add_argument(
+        "args",
+        nargs="*",
+        default=[],
+        help="run: config file names, paths or glob patterns, then key=value config"
+        " overrides in yaml, e.g. strat_v3.yml report=false bootstrap=0",
+    )
+    args: Namespace = parser.parse_args()
+
+    """
+    2. serve or send the command
+    """
+    if args.cmd == "serve":
+        from utils.daemon import serve
+
+        serve()
+        sys.exit(0)
+    message: dict = {"cmd": args.cmd}
+    if args.cmd == "run":
+        # the daemon may run from another directory, paths are made absolute
+        message["configs"] = [
+            os.path.abspath(k) if os.path.exists(k) else k
+            for k in args.args
+            if "=" not in k
+        ] or ["strat_v3.yml"]
+        message["overrides"] = {
+            k.split("=", 1)[0]: yaml.safe_load(k.split("=", 1)[1])
+            for k in args.args
+            if "=" in k
+        }
+    response: dict = send(request=message)
+    print(json.dumps(response, indent=2))
+    sys.exit(1 if "error" in response else 0)
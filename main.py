@@ -1,21 +1,43 @@
+import glob
+import hashlib
 import importlib
 import os
+from argparse import ArgumentParser, Namespace
+from concurrent.futures import Future, ProcessPoolExecutor
 from datetime import date, timezone
+from time import perf_counter
 from typing import Any, Callable
 
 import numpy as np
-from pandas import DataFrame, Timedelta, Timestamp, merge
+from pandas import DataFrame, Timedelta, Timestamp, concat, isna, merge
 
+from utils.cache import cached_callback, fingerprint_source
 from utils.config import load_cfg
-from utils.dd import top_drawdown
-from utils.loader import load_price
-from utils.log import logger
-from utils.report import gen_report
+from utils.context import DataContext, cfg_repair, cfg_venues
+from utils.dd import top_drawdown, update_drawdown
+from utils.execution import execution_cost
+from utils.funding import FUNDING_LEGS, funding_cost
+from utils.ledger import (
+    find_run,
+    load_returns,
+    load_run_series,
+    query_runs,
+    record_run,
+    save_returns,
+)
+from utils.log import init_worker, logger, worker_log_queue
+from utils.metrics import batch_metrics, series_metrics, sums_metrics
+from utils.portfolio import PORTFOLIO_METHODS, combine_runs
+from utils.report import gen_portfolio_report, gen_report
+from utils.rolling import rolling_report
+from utils.state import load_state, new_state, save_state, update_sums
+from utils.stats import bootstrap_metrics
+from utils.trades import build_trades, load_trades, save_trades, trade_stats
 from utils.valid import check_cols
-from utils.var import ANNUAL_MS, CFG_DIR, DEBUG_DIR, INTERVAL_MS_MAP
+from utils.var import ANNUAL_MS, CFG_DIR, DEBUG_DIR, INTERVAL_MS_MAP, ensure_dir
 
 
-def main(cfg: dict):
+def load_data(cfg: dict, venues: list[str] | None = None) -> DataContext:
     """
     1. get sdate, edate
     """
@@ -49,59 +71,30 @@ def main(cfg: dict):
     logger.info(msg=f"Backtesting symbol: {ccxt_sym}")
 
     """
-    4. load historical price
+    4. load historical price of all the venues, concurrently
     """
-    # load price for okx
-    logger.info(msg="Loading price for okx")
-    okx_prc: DataFrame = load_price(
-        stime=s_ts,
-        etime=e_ts,
-        exchange="okx",
-        symbols=[ccxt_sym],
-        timeframe=timeframe,
-    )
-    check_cols(
-        df=okx_prc,
-        cols=["sym", "ts", "open", "high", "low", "close", "volume"],
-    )
+    ctx: DataContext = DataContext.from_cfg(cfg=cfg)
+    ctx.load(venues=cfg_venues(cfg=cfg) if venues is None else venues)
+    # loaded here so the runs sharing ctx don't each load them
+    if cfg.get("funding", False):
+        for exchange in FUNDING_LEGS:
+            ctx.funding(exchange=exchange)
+    return ctx
 
-    # load price for binance
-    logger.info(msg="Loading price for binance")
-    binance_prc: DataFrame = load_price(
-        stime=s_ts,
-        etime=e_ts,
-        exchange="binance",
-        symbols=[ccxt_sym],
-        timeframe=timeframe,
-    )
-    check_cols(
-        df=binance_prc,
-        cols=["sym", "ts", "open", "high", "low", "close", "volume"],
-    )
 
+def merge_price(ctx: DataContext) -> DataFrame:
+    """inner join okx and binance price
+
+    Args:
+        ctx (DataContext): loaded market data
+
+    Returns:
+        DataFrame: ['sym', 'ts', 'okx_open_prc', 'okx_ret', 'okx_vol',
+        'binance_open_prc', 'binance_ret', 'binance_vol']
     """
-    5. merge dataframe
-    """
-    # Data process
-    # calculate return
-    okx_prc["ret"] = okx_prc["close"] / okx_prc["open"] - 1
-    binance_prc["ret"] = binance_prc["close"] / binance_prc["open"] - 1
-    # merge data
     prc_df: DataFrame = merge(
-        left=okx_prc[["sym", "ts", "open", "ret", "volume"]].rename(
-            columns={
-                "open": "okx_open_prc",
-                "ret": "okx_ret",
-                "volume": "okx_vol",
-            }
-        ),
-        right=binance_prc[["sym", "ts", "open", "ret", "volume"]].rename(
-            columns={
-                "open": "binance_open_prc",
-                "ret": "binance_ret",
-                "volume": "binance_vol",
-            }
-        ),
+        left=ctx.venue(exchange="okx"),
+        right=ctx.venue(exchange="binance"),
         how="inner",
         on=["sym", "ts"],
     )
@@ -118,18 +111,53 @@ def main(cfg: dict):
             "binance_vol",
         ],
     )
+    return prc_df
+
+
+def load_callback(cfg: dict) -> Callable:
+    """custom function of the config, 'func' in 'file' under the custom folder
 
+    Args:
+        cfg (dict): config dict
+
+    Returns:
+        Callable: callback
     """
-    6. call custom function to calculate signal and decide trade direction
+    module_name: str = "custom." + cfg["file"].replace(".py", "")
+    module = importlib.import_module(name=module_name)
+    return getattr(module, cfg["func"])
+
+
+def run_callback(
+    prc_df: DataFrame,
+    cfg: dict,
+    ctx: DataContext,
+    data_fp: str,
+) -> DataFrame:
+    """call the custom function of the config to decide the sides
+
+    Args:
+        prc_df (DataFrame): merged price from merge_price
+        cfg (dict): config dict
+        ctx (DataContext): loaded market data
+        data_fp (str): fingerprint of the loaded data, key of the callback cache
+
+    Returns:
+        DataFrame: prc_df with 'binance_side' and 'okx_side'
     """
-    logger.info(msg="Calculating signal")
     # call callback function to define binance side and okx side
-    fn: str = cfg["file"]
-    func: str = cfg["func"]
-    module_name: str = "custom." + fn.replace(".py", "")
-    module = importlib.import_module(name=module_name)
-    callback: Callable = getattr(module, func)
-    prc_df: DataFrame = callback(prc_df=prc_df.copy(), cfg=cfg)
+    callback: Callable = load_callback(cfg=cfg)
+    # skip the callback if its output for the same data, code and config is cached
+    if cfg.get("callback_cache", True):
+        prc_df = cached_callback(
+            callback=callback,
+            prc_df=prc_df,
+            cfg=cfg,
+            data_fp=data_fp,
+            ctx=ctx,
+        )
+    else:
+        prc_df = callback(prc_df=prc_df.copy(), cfg=cfg, ctx=ctx)
     check_cols(
         df=prc_df,
         cols=[
@@ -146,10 +174,25 @@ def main(cfg: dict):
         ],
         checkRedundancy=False,
     )
+    return prc_df
 
+
+def calc_return(prc_df: DataFrame, cfg: dict, ctx: DataContext) -> DataFrame:
+    """strategy return of the sides, without and with fees
+
+    Args:
+        prc_df (DataFrame): output of run_callback
+        cfg (dict): config dict
+        ctx (DataContext): loaded market data
+
+    Returns:
+        DataFrame: prc_df with 'ret', 'action', fee tiers and 'adj_ret'
     """
-    7. calculate return, fees
-    """
+    # positions can't change on bars repaired from long gaps, hold the previous side
+    tradeable: np.ndarray = ctx.tradeable(prc_df=prc_df, venues=["okx", "binance"])
+    if not tradeable.all():
+        for col in ["binance_side", "okx_side"]:
+            prc_df[col] = prc_df[col].where(cond=tradeable).ffill().fillna(value=0)
     # from the custom function we have defined binance_side and okx_side
     # calculate strategy return at each timepoint
     prc_df["ret"] = (
@@ -212,9 +255,150 @@ def main(cfg: dict):
         ],
         default=prc_df["ret"],
     )
+    # replace the flat fee by the execution model if configured
+    if cfg.get("execution") is not None:
+        cost_df: DataFrame = execution_cost(
+            prc_df=prc_df,
+            ctx=ctx,
+            exec_cfg=cfg["execution"],
+            fee=cfg["fee"],
+        )
+        prc_df[cost_df.columns] = cost_df
+        prc_df["adj_ret"] = prc_df["ret"] - prc_df["exec_cost"]
+    # funding paid by the perpetual positions held across funding events
+    if cfg.get("funding", False):
+        funding_df: DataFrame = funding_cost(prc_df=prc_df, ctx=ctx)
+        prc_df[funding_df.columns] = funding_df
+        prc_df["adj_ret"] -= prc_df["funding"]
+    return prc_df
+
+
+# series saved with the returns of a run, an append run computes its metrics on them
+SERIES_COLS: list[str] = ["ret", "binance_side", "exec_cost", "funding"]
 
+
+def series_cols(prc_df: DataFrame) -> list[str]:
+    """columns of SERIES_COLS in prc_df, exec_cost and funding only exist with the
+    execution model and funding"""
+    return [k for k in SERIES_COLS if k in prc_df.columns]
+
+
+def calc_metrics(
+    prc_df: DataFrame, scalar: float, max_dd: float
+) -> tuple[dict[str, float], dict, DataFrame, dict[str, float]]:
+    """performance metrics and trades of a run
+
+    Args:
+        prc_df (DataFrame): ['ts', 'ret', 'adj_ret', 'binance_side'] plus 'exec_cost'
+        and 'funding' if computed
+        scalar (float): number of bars in a year
+        max_dd (float): max drawdown of the nav
+
+    Returns:
+        tuple[dict[str, float], dict, DataFrame, dict[str, float]]: metrics for the
+        ledger, rows of the performance table, trades from build_trades and their
+        trade_stats
     """
-    8. added debug information to be used to improve the performance
+    metrics: dict[str, float] = {
+        k: float(v[0])
+        for k, v in batch_metrics(
+            adj_ret=np.array(prc_df["adj_ret"]),
+            scalar=scalar,
+            ret=np.array(prc_df["ret"]),
+            side=np.array(prc_df["binance_side"], dtype=np.float64),
+        ).items()
+    }
+    metrics["max_dd"] = max_dd
+    performance_data: dict = {
+        "Annual Return": str(round(metrics["annual_ret"] * 100, 2)) + "%",
+        "Annual Std": str(round(metrics["annual_std"] * 100, 2)) + "%",
+        "Annual Sharpe": round(metrics["annual_sr"], 2),
+        "Max Drawdown": str(round(max_dd * 100, 2)) + "%",
+        "Sortino": round(metrics["sortino"], 2),
+        "Calmar": round(metrics["calmar"], 2),
+        "Hit Rate": str(round(metrics["hit_rate"] * 100, 2)) + "%",
+        "Avg Holding [bars]": round(metrics["avg_holding"], 2),
+        "Annual Turnover": round(metrics["turnover"], 2),
+        "Annual Fee Drag": str(round(metrics["fee_drag"] * 100, 2)) + "%",
+    }
+    if "exec_cost" in prc_df.columns:
+        annual_cost: float = float(np.mean(a=prc_df["exec_cost"])) * scalar
+        metrics["annual_exec_cost"] = annual_cost
+        performance_data["Annual Execution Cost"] = (
+            str(round(annual_cost * 100, 2)) + "%"
+        )
+    if "funding" in prc_df.columns:
+        annual_funding: float = float(np.mean(a=prc_df["funding"])) * scalar
+        metrics["annual_funding"] = annual_funding
+        performance_data["Annual Funding"] = str(round(annual_funding * 100, 2)) + "%"
+
+    # round trips of the binance side, saved with the run and summarised in the report
+    trades_df: DataFrame = build_trades(
+        ts=prc_df["ts"],
+        side=np.array(prc_df["binance_side"]),
+        ret=np.array(prc_df["ret"]),
+        adj_ret=np.array(prc_df["adj_ret"]),
+    )
+    stats: dict[str, float] = trade_stats(trades_df=trades_df)
+    metrics.update(
+        {
+            k: stats[k]
+            for k in ["n_trades", "win_rate", "avg_trade_ret", "profit_factor"]
+        }
+    )
+    return metrics, performance_data, trades_df, stats
+
+
+def main(cfg: dict, ctx: DataContext | None = None) -> int:
+    # runs and append states are only reused with the same strategy code
+    src_fp: str = fingerprint_source(func=load_callback(cfg=cfg))
+    # only process the bars after the previous run of the same backtest
+    if cfg.get("append", False):
+        state: dict | None = load_state(cfg=cfg, src_fp=src_fp)
+        if state is not None:
+            appended: int | None = append_run(cfg=cfg, state=state, src_fp=src_fp)
+            if appended is not None:
+                return appended
+
+    """
+    1. load and merge historical price, unless already loaded by the caller
+    """
+    # seconds spent in each step, saved to the ledger
+    timings: dict[str, float] = {}
+    t0: float = perf_counter()
+    venues: list[str] = cfg_venues(cfg=cfg)
+    if ctx is None:
+        ctx = load_data(cfg=cfg, venues=venues)
+    prc_df: DataFrame = merge_price(ctx=ctx)
+    timeframe_ts: Timedelta = Timedelta(
+        value=INTERVAL_MS_MAP[cfg["timeframe"]],
+        unit="millisecond",
+    )
+    # skip the run if exactly the same inputs already have a result in the ledger
+    data_fp: str = ctx.fingerprint(venues=venues)
+    if cfg.get("skip_if_computed", False):
+        run_id: int | None = find_run(cfg=cfg, data_fp=data_fp, src_fp=src_fp)
+        if run_id is not None:
+            logger.info(msg=f"Same inputs already computed in run {run_id}, skipped")
+            return run_id
+    timings["load"] = perf_counter() - t0
+
+    """
+    2. call custom function to calculate signal and decide trade direction
+    """
+    logger.info(msg="Calculating signal")
+    t0 = perf_counter()
+    prc_df = run_callback(prc_df=prc_df, cfg=cfg, ctx=ctx, data_fp=data_fp)
+    timings["callback"] = perf_counter() - t0
+
+    """
+    3. calculate return, fees
+    """
+    t0 = perf_counter()
+    prc_df = calc_return(prc_df=prc_df, cfg=cfg, ctx=ctx)
+
+    """
+    4. added debug information to be used to improve the performance
     """
     # debug columns
     prc_df["ret_diff"] = prc_df["binance_ret"] - prc_df["okx_ret"]
@@ -227,12 +411,14 @@ def main(cfg: dict):
         default=0,
     )
     prc_df["ideal_ret"] = prc_df["ret_diff"].abs()
-    prc_df.to_csv(os.path.join(DEBUG_DIR, "debug.csv"), index=False)
+    prc_df.to_csv(os.path.join(ensure_dir(fdir=DEBUG_DIR), "debug.csv"), index=False)
+    timings["return"] = perf_counter() - t0
 
     """
-    9. calculate max drawdown and other risk metrics
+    5. calculate max drawdown and other risk metrics
     """
     # caculate max drawdown
+    t0 = perf_counter()
     prc_df["nav"] = (prc_df["adj_ret"] + 1).cumprod()
     top_dd: DataFrame = top_drawdown(
         x=np.array(prc_df["nav"]),
@@ -243,25 +429,60 @@ def main(cfg: dict):
         df=top_dd,
         cols=["peak_time", "trough_time", "recovery_time", "max_dd"],
     )
+    max_dd: float = float(top_dd["max_dd"][0])
     top_dd["max_dd"] *= 100
     top_dd["max_dd"] = top_dd["max_dd"].round(2).astype(str) + "%"
 
-    # calculate performance metrics
+    # calculate performance metrics and the round trips of the binance side
     scalar: float = Timedelta(value=ANNUAL_MS, unit="millisecond") / timeframe_ts
-    annual_ret: float = float(np.mean(a=prc_df["adj_ret"])) * scalar
-    annual_std: float = float(np.std(a=prc_df["adj_ret"], ddof=1) * np.sqrt(scalar))
-    annual_sr: float = annual_ret / annual_std
-    performance_data: dict = {
-        "Annual Return": str(round(annual_ret * 100, 2)) + "%",
-        "Annual Std": str(round(annual_std * 100, 2)) + "%",
-        "Annual Sharpe": round(annual_sr, 2),
-        "Max Drawdown": top_dd["max_dd"][0],
-    }
+    metrics, performance_data, trades_df, stats = calc_metrics(
+        prc_df=prc_df, scalar=scalar, max_dd=max_dd
+    )
+
+    # block bootstrap confidence intervals and sign randomised p-value of sharpe
+    n_resamples: int = cfg.get("bootstrap", 10000)
+    if n_resamples:
+        boot: dict[str, float] = bootstrap_metrics(
+            ret=np.array(prc_df["ret"]),
+            adj_ret=np.array(prc_df["adj_ret"]),
+            scalar=scalar,
+            n_resamples=n_resamples,
+            block_size=cfg.get("block_size"),
+        )
+        metrics.update(boot)
+        performance_data.update(
+            {
+                "Annual Return 95% CI": (
+                    f"[{round(boot['annual_ret_lo'] * 100, 2)}%,"
+                    f" {round(boot['annual_ret_hi'] * 100, 2)}%]"
+                ),
+                "Annual Sharpe 95% CI": (
+                    f"[{round(boot['annual_sr_lo'], 2)},"
+                    f" {round(boot['annual_sr_hi'], 2)}]"
+                ),
+                "Max Drawdown 95% CI": (
+                    f"[{round(boot['max_dd_lo'] * 100, 2)}%,"
+                    f" {round(boot['max_dd_hi'] * 100, 2)}%]"
+                ),
+                "Sharpe p-value": round(boot["sr_pvalue"], 4),
+            }
+        )
+
+    # rolling metrics over windows in days, to show how the performance evolves
+    rolling_df: DataFrame = rolling_report(
+        ts=np.array(prc_df["ts"]),
+        adj_ret=np.array(prc_df["adj_ret"]),
+        timeframe=cfg["timeframe"],
+        scalar=scalar,
+        windows=cfg.get("rolling_windows", [7, 30]),
+    )
+    timings["metrics"] = perf_counter() - t0
 
     """
-    10. generate report
+    6. generate report
     """
-    # generate report
+    # generate report, can be skipped for quick iterations on a signal
+    t0 = perf_counter()
     report_data: dict[str, DataFrame] = {
         "config": DataFrame(data=cfg.items(), columns=["param", "value"]),
         "performance": DataFrame(
@@ -271,22 +492,462 @@ def main(cfg: dict):
         "ret": prc_df[["ts", "ret", "adj_ret"]],
         "fee": prc_df[["ts", "1bps", "2bps", "3bps"]],
     }
+    if len(trades_df):
+        trade_stats_data: dict = {
+            "Trades": int(stats["n_trades"]),
+            "Long / Short": f"{int(stats['n_long'])} / {int(stats['n_short'])}",
+            "Win Rate": str(round(stats["win_rate"] * 100, 2)) + "%",
+            "Avg Trade Return": str(round(stats["avg_trade_ret"] * 100, 4)) + "%",
+            "Avg Win": str(round(stats["avg_win"] * 100, 4)) + "%",
+            "Avg Loss": str(round(stats["avg_loss"] * 100, 4)) + "%",
+            "Profit Factor": round(stats["profit_factor"], 2),
+            "Avg Bars Held": round(stats["avg_bars"], 2),
+            "Max Bars Held": int(stats["max_bars"]),
+            "Avg Trade Fee": str(round(stats["avg_trade_fee"] * 100, 4)) + "%",
+        }
+        report_data["trade_stats"] = DataFrame(
+            data=trade_stats_data.items(), columns=["metrics", "value"]
+        )
+        report_data["trades"] = trades_df
     if "signal" in prc_df.columns:
         report_data["signal"] = prc_df[["ts", "signal"]]
-    gen_report(report_data=report_data)
-    return
+    if len(ctx.repair_summary):
+        report_data["repair"] = ctx.repair_summary
+    if len(rolling_df.columns) > 1:
+        report_data["rolling"] = rolling_df
+    if cfg.get("report", True):
+        gen_report(report_data=report_data)
+    timings["report"] = perf_counter() - t0
+
+    """
+    7. save the run to the ledger
+    """
+    run_id = record_run(
+        cfg=cfg,
+        data_fp=data_fp,
+        src_fp=src_fp,
+        metrics=metrics,
+        drawdown=top_dd,
+        timings=timings,
+    )
+    logger.info(msg=f"Run saved to ledger, run_id: {run_id}")
+    save_returns(
+        run_id=run_id,
+        ts=np.array(prc_df["ts"]),
+        adj_ret=np.array(prc_df["adj_ret"]),
+        series={k: np.array(prc_df[k]) for k in series_cols(prc_df=prc_df)},
+    )
+    save_trades(run_id=run_id, trades_df=trades_df)
+    if cfg.get("append", False):
+        save_state(
+            cfg=cfg,
+            src_fp=src_fp,
+            state=new_state(
+                last_ts=prc_df["ts"].iloc[-1],
+                adj_ret=np.array(prc_df["adj_ret"]),
+                ret=np.array(prc_df["ret"]),
+                side=np.array(prc_df["binance_side"]),
+                exec_cost=(
+                    np.array(prc_df["exec_cost"])
+                    if "exec_cost" in prc_df.columns
+                    else None
+                ),
+                funding=(
+                    np.array(prc_df["funding"]) if "funding" in prc_df.columns else None
+                ),
+                nav=float(prc_df["nav"].iloc[-1]),
+                drawdown=update_drawdown(
+                    x=np.array(prc_df["nav"]),
+                    time=np.array(prc_df["ts"]),
+                    topN=3,
+                )[1],
+                data_fp=data_fp,
+                run_id=run_id,
+            ),
+        )
+    return run_id
+
+
+def append_run(cfg: dict, state: dict, src_fp: str) -> int | None:
+    """continue a backtest from the end state of its previous run, only the bars
+    after the last processed one are computed
+
+    the custom function runs on the new bars plus 'append_warmup' bars before them,
+    which must cover the lookback of its rolling windows
+
+    Args:
+        cfg (dict): config dict, same as the previous run but a later edate
+        state (dict): end state of the previous run
+        src_fp (str): fingerprint of the strategy code
+
+    Returns:
+        int | None: run_id in the ledger, None if the previous run didn't save the
+        running sums, trades and series the run continues and the backtest must be
+        run in full
+    """
+
+    """
+    1. load the new bars and the warmup bars before them
+    """
+    timings: dict[str, float] = {}
+    t0: float = perf_counter()
+    last_ts: Timestamp = state["last_ts"]
+    e_ts: Timestamp = Timestamp(ts_input=cfg["edate"], tz=timezone.utc)
+    if e_ts <= last_ts:
+        logger.info(msg=f"No new bar after {last_ts}, run {state['run_id']} is current")
+        return state["run_id"]
+    # the metrics of the run extend the running sums of the previous run and its
+    # trades, its series are the series of the previous run plus the new bars
+    prev_trades: DataFrame | None = load_trades(run_id=state["run_id"])
+    if "n_entries" not in state or prev_trades is None:
+        logger.warning(
+            msg=f"Run {state['run_id']} saved no running sums or trades, running in full"
+        )
+        return None
+    prev_df: DataFrame = load_run_series(run_id=state["run_id"])
+    if not {"ret", "binance_side"} <= set(prev_df.columns):
+        logger.warning(
+            msg=f"Run {state['run_id']} saved no ret and side series, running in full"
+        )
+        return None
+    timeframe_ts: Timedelta = Timedelta(
+        value=INTERVAL_MS_MAP[cfg["timeframe"]],
+        unit="millisecond",
+    )
+    s_ts: Timestamp = max(
+        Timestamp(ts_input=cfg["sdate"], tz=timezone.utc),
+        last_ts - cfg.get("append_warmup", 1000) * timeframe_ts,
+    )
+    logger.info(msg=f"Appending bars after {last_ts} up to {e_ts}")
+    venues: list[str] = cfg_venues(cfg=cfg)
+    ctx: DataContext = DataContext.from_cfg(cfg=cfg, s_ts=s_ts)
+    ctx.load(venues=venues)
+    prc_df: DataFrame = merge_price(ctx=ctx)
+    window_fp: str = ctx.fingerprint(venues=venues)
+    timings["load"] = perf_counter() - t0
+
+    """
+    2. sides and return of the window, only the new bars are kept
+    """
+    t0 = perf_counter()
+    prc_df = run_callback(prc_df=prc_df, cfg=cfg, ctx=ctx, data_fp=window_fp)
+    timings["callback"] = perf_counter() - t0
+    t0 = perf_counter()
+    prc_df = calc_return(prc_df=prc_df, cfg=cfg, ctx=ctx)
+    prc_df = prc_df[prc_df["ts"] > last_ts].reset_index(drop=True)
+    if not len(prc_df):
+        logger.info(msg=f"No new bar after {last_ts}, run {state['run_id']} is current")
+        return state["run_id"]
+    timings["return"] = perf_counter() - t0
+
+    """
+    3. extend the nav, drawdowns, running sums and trades of the previous run
+    """
+    t0 = perf_counter()
+    adj_ret: np.ndarray = np.array(prc_df["adj_ret"])
+    exec_cost: np.ndarray | None = (
+        np.array(prc_df["exec_cost"]) if "exec_cost" in prc_df.columns else None
+    )
+    nav: np.ndarray = state["nav"] * np.cumprod(1 + adj_ret)
+    top_dd, dd_state = update_drawdown(
+        x=nav,
+        time=np.array(prc_df["ts"]),
+        state=state["drawdown"],
+        topN=3,
+    )
+    sums: dict = update_sums(
+        state=state,
+        adj_ret=adj_ret,
+        ret=np.array(prc_df["ret"]),
+        side=np.array(prc_df["binance_side"]),
+        exec_cost=exec_cost,
+        funding=np.array(prc_df["funding"]) if "funding" in prc_df.columns else None,
+    )
+    max_dd: float = float(top_dd["max_dd"][0])
+    top_dd["max_dd"] *= 100
+    top_dd["max_dd"] = top_dd["max_dd"].round(2).astype(str) + "%"
+    scalar: float = Timedelta(value=ANNUAL_MS, unit="millisecond") / timeframe_ts
+    metrics: dict[str, float] = sums_metrics(sums=sums, scalar=scalar, max_dd=max_dd)
+    # the trades closed before the new bars are kept, the trade still open at the
+    # last bar is rebuilt from the bar before its entry, whose fee it shares
+    new_df: DataFrame = prc_df[["ts", "adj_ret"] + series_cols(prc_df=prc_df)]
+    trades_df: DataFrame = prev_trades
+    start_ts: Timestamp = prc_df["ts"].iloc[0]
+    i0: int = len(prev_df)
+    if len(prev_trades) and isna(prev_trades["exit_ts"].iloc[-1]):
+        trades_df = prev_trades.iloc[:-1]
+        start_ts = prev_trades["entry_ts"].iloc[-1]
+        i0 = max(int(prev_df["ts"].searchsorted(start_ts)) - 1, 0)
+    tail_df: DataFrame = concat(objs=[prev_df.iloc[i0:], new_df], ignore_index=True)
+    tail_trades: DataFrame = build_trades(
+        ts=tail_df["ts"],
+        side=np.array(tail_df["binance_side"]),
+        ret=np.array(tail_df["ret"]),
+        adj_ret=np.array(tail_df["adj_ret"]),
+    )
+    tail_trades = tail_trades[tail_trades["entry_ts"] >= start_ts]
+    trades_df = concat(objs=[trades_df, tail_trades], ignore_index=True)
+    stats: dict[str, float] = trade_stats(trades_df=trades_df)
+    metrics.update(
+        {
+            k: stats[k]
+            for k in ["n_trades", "win_rate", "avg_trade_ret", "profit_factor"]
+        }
+    )
+    timings["metrics"] = perf_counter() - t0
+
+    """
+    4. save the run to the ledger and the new end state
+    """
+    # the data of the run is the data of the previous run plus the window
+    data_fp: str = hashlib.sha1(f"{state['data_fp']}:{window_fp}".encode()).hexdigest()
+    run_id: int = record_run(
+        cfg=cfg,
+        data_fp=data_fp,
+        src_fp=src_fp,
+        metrics=metrics,
+        drawdown=top_dd,
+        timings=timings,
+    )
+    logger.info(
+        msg=f"{len(prc_df)} bars appended to run {state['run_id']}, run_id: {run_id}"
+    )
+    # every run keeps its whole series for compare_runs and run_portfolio
+    full_df: DataFrame = concat(objs=[prev_df, new_df], ignore_index=True)
+    save_returns(
+        run_id=run_id,
+        ts=np.array(full_df["ts"]),
+        adj_ret=np.array(full_df["adj_ret"]),
+        series={k: np.array(full_df[k]) for k in series_cols(prc_df=full_df)},
+    )
+    save_trades(run_id=run_id, trades_df=trades_df)
+    save_state(
+        cfg=cfg,
+        src_fp=src_fp,
+        state={
+            **state,
+            **sums,
+            "last_ts": prc_df["ts"].iloc[-1],
+            "nav": float(nav[-1]),
+            "drawdown": dd_state,
+            "data_fp": data_fp,
+            "run_id": run_id,
+        },
+    )
+    return run_id
+
+
+def resolve_cfg_fps(patterns: list[str]) -> list[str]:
+    """expand config file names, paths and glob patterns
+
+    Args:
+        patterns (list[str]): file names or glob patterns, looked up as is first and
+        then under CFG_DIR, e.g. ["strat_v*.yml"]
+
+    Returns:
+        list[str]: config file paths, without duplicates
+    """
+    cfg_fps: list[str] = []
+    for pattern in patterns:
+        matched: list[str] = sorted(glob.glob(pattern)) or sorted(
+            glob.glob(os.path.join(CFG_DIR, pattern))
+        )
+        assert len(matched), f"No config file matches {pattern}"
+        cfg_fps.extend([fp for fp in matched if fp not in cfg_fps])
+    return cfg_fps
+
+
+def dataset_key(cfg: dict) -> tuple:
+    """configs with the same key can share one loaded DataContext
+
+    Args:
+        cfg (dict): config dict
+
+    Returns:
+        tuple: (sdate, edate, timeframe, ccxt_sym, base_timeframe, repair)
+    """
+    return (
+        cfg["sdate"],
+        cfg["edate"],
+        cfg["timeframe"],
+        cfg["ccxt_sym"],
+        cfg.get("base_timeframe"),
+        str(cfg_repair(cfg=cfg)),
+    )
+
+
+def run_batch(cfg_fps: list[str], max_workers: int = 1) -> dict[str, int | None]:
+    """backtest many config files, loading each distinct dataset only once
+
+    configs are grouped by (sdate, edate, timeframe, ccxt_sym), the venues needed by
+    the configs of a group are loaded once and then shared by all of them
+
+    Args:
+        cfg_fps (list[str]): config file paths
+        max_workers (int, optional): number of processes running the configs of a
+        group in parallel, 1 runs them in the current process. Defaults to 1.
+
+    Returns:
+        dict[str, int | None]: {config file path: run_id}, None if the run failed
+    """
+
+    """
+    1. group configs by dataset
+    """
+    groups: dict[tuple, list[tuple[str, dict]]] = {}
+    for cfg_fp in cfg_fps:
+        cfg: dict[str, Any] = load_cfg(cfg_fp=cfg_fp)
+        groups.setdefault(dataset_key(cfg=cfg), []).append((cfg_fp, cfg))
+    logger.info(msg=f"{len(cfg_fps)} configs grouped into {len(groups)} datasets")
+
+    """
+    2. load each dataset once and run its configs
+    """
+    run_ids: dict[str, int | None] = {}
+    for key, members in groups.items():
+        logger.info(msg=f"Loading dataset {key} for {len(members)} configs")
+        venues: list[str] = []
+        for _, cfg in members:
+            venues.extend([k for k in cfg_venues(cfg=cfg) if k not in venues])
+        ctx: DataContext = load_data(cfg=members[0][1], venues=venues)
+        if max_workers == 1:
+            for cfg_fp, cfg in members:
+                try:
+                    run_ids[cfg_fp] = main(cfg=cfg, ctx=ctx)
+                except Exception:
+                    logger.exception(msg=f"Backtest failed: {cfg_fp}")
+                    run_ids[cfg_fp] = None
+            continue
+        # workers send their log records to this process through a queue
+        with ProcessPoolExecutor(
+            max_workers=max_workers,
+            initializer=init_worker,
+            initargs=(worker_log_queue(),),
+        ) as executor:
+            futures: dict[str, Future] = {
+                cfg_fp: executor.submit(main, cfg=cfg, ctx=ctx)
+                for cfg_fp, cfg in members
+            }
+            for cfg_fp, future in futures.items():
+                try:
+                    run_ids[cfg_fp] = future.result()
+                except Exception:
+                    logger.exception(msg=f"Backtest failed: {cfg_fp}")
+                    run_ids[cfg_fp] = None
+    return run_ids
+
+
+def compare_runs(run_ids: list[int]) -> DataFrame:
+    """metrics of many runs computed together from their saved series, the runs on
+    the same bars in one batch_metrics call
+
+    Args:
+        run_ids (list[int]): run_ids in the ledger
+
+    Returns:
+        DataFrame: index run_id, one column per metric, best annual sharpe first
+    """
+    if not len(run_ids):
+        return DataFrame()
+    runs: DataFrame = query_runs(
+        where=f"run_id IN ({', '.join('?' * len(run_ids))})", params=tuple(run_ids)
+    )
+    metrics_df: DataFrame = series_metrics(
+        series={k: load_run_series(run_id=k) for k in run_ids},
+        scalars={
+            row.run_id: ANNUAL_MS / INTERVAL_MS_MAP[row.timeframe]
+            for row in runs.itertuples(index=False)
+        },
+    )
+    metrics_df.index.name = "run_id"
+    return metrics_df.sort_values(by="annual_sr", ascending=False)
+
+
+def run_portfolio(
+    run_ids: list[int],
+    methods: list[str] = PORTFOLIO_METHODS,
+    shrinkage: float = 0.0,
+    report: bool = True,
+) -> dict[str, DataFrame]:
+    """blend the return series of runs into portfolios, see utils.portfolio
+
+    Args:
+        run_ids (list[int]): run_ids in the ledger, of the same timeframe
+        methods (list[str], optional): weight methods. Defaults to PORTFOLIO_METHODS.
+        shrinkage (float, optional): shrinkage of the covariance. Defaults to 0.0.
+        report (bool, optional): write the pdf report. Defaults to True.
+
+    Returns:
+        dict[str, DataFrame]: weights, performance, nav and drawdown, empty without
+        any run
+    """
+    if not len(run_ids):
+        logger.warning(msg="No run to blend into a portfolio")
+        return {}
+    runs: DataFrame = query_runs(
+        where=f"run_id IN ({', '.join('?' * len(run_ids))})", params=tuple(run_ids)
+    )
+    timeframes: list[str] = list(runs["timeframe"].unique())
+    assert len(timeframes) == 1, f"Runs of different timeframes: {timeframes}"
+    scalar: float = ANNUAL_MS / INTERVAL_MS_MAP[timeframes[0]]
+    portfolio: dict[str, DataFrame] = combine_runs(
+        returns=load_returns(run_ids=run_ids),
+        scalar=scalar,
+        methods=methods,
+        shrinkage=shrinkage,
+    )
+    for row in portfolio["performance"].itertuples(index=False):
+        logger.info(
+            msg=(
+                f"Portfolio {row.method} of {len(run_ids)} runs: annual sharpe"
+                f" {row.annual_sr:.2f}, max drawdown {row.max_dd * 100:.2f}%"
+            )
+        )
+    if report:
+        gen_portfolio_report(report_data=portfolio)
+    return portfolio
 
 
 if __name__ == "__main__":
     """
-    1. load config
+    1. parse arguments
     """
-    # update the cfg_fn only
-    cfg_fn = "strat_v3.yml"
-    cfg_fp: str = os.path.join(CFG_DIR, cfg_fn)
-    cfg: dict[str, Any] = load_cfg(cfg_fp=cfg_fp)
+    parser: ArgumentParser = ArgumentParser(description="Backtest config files")
+    parser.add_argument(
+        "configs",
+        nargs="*",
+        default=["strat_v3.yml"],
+        help="config file names, paths or glob patterns, e.g. 'strat_v*.yml'",
+    )
+    parser.add_argument(
+        "-j",
+        "--workers",
+        type=int,
+        default=1,
+        help="number of processes running the configs sharing one dataset",
+    )
+    parser.add_argument(
+        "--portfolio",
+        action="store_true",
+        help="blend the runs into equal, equal risk, min variance and max sharpe portfolios",
+    )
+    args: Namespace = parser.parse_args()
 
     """
     2. backtest
     """
-    main(cfg=cfg)
+    run_ids: dict[str, int | None] = run_batch(
+        cfg_fps=resolve_cfg_fps(patterns=args.configs), max_workers=args.workers
+    )
+
+    """
+    3. compare and combine the runs
+    """
+    done_ids: list[int] = [k for k in run_ids.values() if k is not None]
+    if len(done_ids) > 1:
+        names: dict[int, str] = {v: k for k, v in run_ids.items() if v is not None}
+        compare_df: DataFrame = compare_runs(run_ids=done_ids)
+        compare_df.insert(loc=0, column="config", value=compare_df.index.map(names))
+        logger.info(msg=f"Runs compared:\n{compare_df.to_string()}")
+    if args.portfolio:
+        run_portfolio(run_ids=done_ids)
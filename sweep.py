@@ -0,0 +1,167 @@
+import json
+import sys
+from argparse import ArgumentParser, Namespace
+from concurrent.futures import Future, ProcessPoolExecutor
+
+import yaml
+from pandas import DataFrame
+
+from utils.config import load_cfg
+from utils.log import init_worker, logger, worker_log_queue
+from utils.metrics import series_metrics
+from utils.var import ANNUAL_MS, INTERVAL_MS_MAP, QUEUE_DIR
+from utils.workqueue import LEASE_SECONDS, MAX_ATTEMPTS, WorkQueue, run_worker
+
+if __name__ == "__main__":
+    """
+    1. parse arguments
+    """
+    parser: ArgumentParser = ArgumentParser(
+        description="Backtest sweeps through a work queue shared by any number of workers"
+    )
+    parser.add_argument(
+        "cmd",
+        choices=["submit", "work", "status", "results"],
+        help="submit queues configs, work runs workers until the queue is drained",
+    )
+    parser.add_argument(
+        "args",
+        nargs="*",
+        default=[],
+        help="submit: config file names, paths or glob patterns, then key=value config"
+        " overrides in yaml, a list value is swept, e.g. strat_v3.yml z_lb=[1,2,3]",
+    )
+    parser.add_argument(
+        "--queue",
+        default=QUEUE_DIR,
+        help="queue directory, shared by the hosts running workers",
+    )
+    parser.add_argument(
+        "-j", "--workers", type=int, default=1, help="number of worker processes"
+    )
+    parser.add_argument(
+        "--lease",
+        type=float,
+        default=LEASE_SECONDS,
+        help="seconds without heartbeat before a claimed unit is given to another worker",
+    )
+    parser.add_argument(
+        "--max-attempts",
+        type=int,
+        default=MAX_ATTEMPTS,
+        help="runs of a unit before it's moved to failed",
+    )
+    parser.add_argument(
+        "--retry-failed",
+        action="store_true",
+        help="submit: queue again the units that failed",
+    )
+    parser.add_argument(
+        "--wait",
+        action="store_true",
+        help="work: keep waiting for new units once the queue is drained",
+    )
+    args: Namespace = parser.parse_args()
+    queue: WorkQueue = WorkQueue(
+        queue_dir=args.queue, lease=args.lease, max_attempts=args.max_attempts
+    )
+
+    """
+    2. run the command
+    """
+    if args.cmd == "submit":
+        # main imports the whole backtest stack, only needed to submit and work
+        from main import resolve_cfg_fps
+
+        overrides: dict = {
+            k.split("=", 1)[0]: yaml.safe_load(k.split("=", 1)[1])
+            for k in args.args
+            if "=" in k
+        }
+        # one config per combination of the swept values
+        grid: list[dict] = [{}]
+        for key, value in overrides.items():
+            grid = [
+                {**point, key: v}
+                for point in grid
+                for v in (value if isinstance(value, list) else [value])
+            ]
+        cfgs: dict[str, dict] = {}
+        for cfg_fp in resolve_cfg_fps(
+            patterns=[k for k in args.args if "=" not in k] or ["strat_v3.yml"]
+        ):
+            for point in grid:
+                name: str = " ".join([cfg_fp] + [f"{k}={v}" for k, v in point.items()])
+                cfgs[name] = {**load_cfg(cfg_fp=cfg_fp), **point}
+        added: list[str] = queue.submit(cfgs=cfgs, retry_failed=args.retry_failed)
+        logger.info(
+            msg=f"{len(added)} units queued,"
+            f" {len(cfgs) - len(added)} already queued or done"
+        )
+    elif args.cmd == "work":
+        if args.workers == 1:
+            n_done, n_failed = run_worker(
+                queue_dir=args.queue,
+                lease=args.lease,
+                max_attempts=args.max_attempts,
+                exit_when_empty=not args.wait,
+            )
+        else:
+            # workers send their log records to this process through a queue
+            with ProcessPoolExecutor(
+                max_workers=args.workers,
+                initializer=init_worker,
+                initargs=(worker_log_queue(),),
+            ) as executor:
+                futures: list[Future] = [
+                    executor.submit(
+                        run_worker,
+                        queue_dir=args.queue,
+                        lease=args.lease,
+                        max_attempts=args.max_attempts,
+                        exit_when_empty=not args.wait,
+                    )
+                    for _ in range(args.workers)
+                ]
+                counts: list[tuple[int, int]] = [future.result() for future in futures]
+                n_done = sum(k[0] for k in counts)
+                n_failed = sum(k[1] for k in counts)
+        logger.info(msg=f"{n_done} units done, {n_failed} failed")
+    # status and results are the output of the command, json on stdout to be piped
+    # into other tools, progress goes to the logger
+    elif args.cmd == "status":
+        sys.stdout.write(json.dumps(queue.status(), indent=2) + "\n")
+    else:
+        units: list[dict] = queue.results()
+        # every unit with saved series in one matrix, per group of units on the same bars
+        series: dict[str, DataFrame] = {}
+        for unit in units:
+            series_df: DataFrame | None = queue.load_series(uid=unit["id"])
+            if series_df is not None:
+                series[unit["id"]] = series_df
+        metrics_df: DataFrame = series_metrics(
+            series=series,
+            scalars={
+                unit["id"]: ANNUAL_MS / INTERVAL_MS_MAP[unit["cfg"]["timeframe"]]
+                for unit in units
+            },
+        )
+        for unit in units:
+            result: dict = unit["result"]
+            sys.stdout.write(
+                json.dumps(
+                    {
+                        "name": unit["name"],
+                        "run_id": result["run_id"],
+                        "host": result["host"],
+                        # metrics recorded by the worker if its series weren't saved
+                        **(
+                            metrics_df.loc[unit["id"]].to_dict()
+                            if unit["id"] in metrics_df.index
+                            else {"annual_sr": result["metrics"].get("annual_sr")}
+                        ),
+                    }
+                )
+                + "\n"
+            )
+    sys.exit(0)
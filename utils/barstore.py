@@ -0,0 +1,475 @@
+import fcntl
+import json
+import os
+import re
+import shutil
+from typing import Callable, Iterator
+
+import numpy as np
+from pandas import DataFrame, Timestamp, to_datetime
+
+from utils.var import BAR_STORE_DIR, ensure_dir
+
+
+def _ts_ms(ts: Timestamp) -> int:
+    return int(ts.value // 10**6)
+
+
+class BarStore:
+    """memory mapped columnar store of bars, with the time ranges it covers
+
+    each (exchange, symbol, timeframe) is a directory with one raw file per column,
+    int64 millisecond timestamps in ts.bin and float64 values in {col}.bin, rows in
+    strictly increasing ts order. Range queries are two binary searches on the
+    memory mapped ts column and return zero copy views of every column.
+
+    meta.json keeps the covered ranges, [start, end] in ms, every row of the source
+    inside them is stored, a range without rows is known to have none. Ranges can be
+    written in any order, a range before or inside the stored rows rewrites the
+    dataset, a range after them is appended.
+    """
+
+    def __init__(self, root: str = BAR_STORE_DIR):
+        self.root: str = root
+        # {dataset dir: (number of rows, {column: memmap})}
+        self._maps: dict[str, tuple[int, dict[str, np.ndarray]]] = {}
+
+    def _dir(self, exchange: str, symbol: str, timeframe: str) -> str:
+        return os.path.join(
+            self.root, exchange, re.sub(r"[^0-9A-Za-z]", "_", symbol), timeframe
+        )
+
+    @staticmethod
+    def _meta(fdir: str) -> dict:
+        meta_fp: str = os.path.join(fdir, "meta.json")
+        if not os.path.exists(path=meta_fp):
+            return {"columns": []}
+        with open(file=meta_fp, mode="r") as fp:
+            return json.load(fp=fp)
+
+    @staticmethod
+    def _write_meta(fdir: str, meta: dict) -> None:
+        tmp_fp: str = os.path.join(fdir, f"meta.json.{os.getpid()}.tmp")
+        with open(file=tmp_fp, mode="w") as fp:
+            json.dump(obj=meta, fp=fp)
+        os.replace(src=tmp_fp, dst=os.path.join(fdir, "meta.json"))
+
+    @staticmethod
+    def _n_rows(fdir: str) -> int:
+        ts_fp: str = os.path.join(fdir, "ts.bin")
+        return os.path.getsize(ts_fp) // 8 if os.path.exists(path=ts_fp) else 0
+
+    @staticmethod
+    def _read_ts(fdir: str, n: int) -> np.ndarray:
+        if not n:
+            return np.empty(0, dtype=np.int64)
+        return np.fromfile(file=os.path.join(fdir, "ts.bin"), dtype=np.int64, count=n)
+
+    @staticmethod
+    def _map_ts(fdir: str, n: int) -> np.ndarray:
+        if not n:
+            return np.empty(0, dtype=np.int64)
+        return np.memmap(
+            filename=os.path.join(fdir, "ts.bin"), dtype=np.int64, mode="r", shape=(n,)
+        )
+
+    def _open(
+        self, exchange: str, symbol: str, timeframe: str
+    ) -> dict[str, np.ndarray]:
+        fdir: str = self._dir(exchange=exchange, symbol=symbol, timeframe=timeframe)
+        n: int = self._n_rows(fdir=fdir)
+        cached: tuple[int, dict[str, np.ndarray]] | None = self._maps.get(fdir)
+        if cached is not None and cached[0] == n:
+            return cached[1]
+        maps: dict[str, np.ndarray] = {}
+        if n:
+            maps["ts"] = np.memmap(
+                filename=os.path.join(fdir, "ts.bin"),
+                dtype=np.int64,
+                mode="r",
+                shape=(n,),
+            )
+            # value files may be longer than ts.bin after an interrupted append
+            for col in self._meta(fdir=fdir)["columns"]:
+                maps[col] = np.memmap(
+                    filename=os.path.join(fdir, f"{col}.bin"),
+                    dtype=np.float64,
+                    mode="r",
+                    shape=(n,),
+                )
+        self._maps[fdir] = (n, maps)
+        return maps
+
+    def time_range(
+        self, exchange: str, symbol: str, timeframe: str
+    ) -> tuple[Timestamp, Timestamp] | None:
+        """first and last ts stored
+
+        Args:
+            exchange (str): cex
+            symbol (str): ccxt symbol
+            timeframe (str): timeframe
+
+        Returns:
+            tuple[Timestamp, Timestamp] | None: (first ts, last ts), None if empty
+        """
+        maps: dict[str, np.ndarray] = self._open(
+            exchange=exchange, symbol=symbol, timeframe=timeframe
+        )
+        if not len(maps):
+            return None
+        return (
+            to_datetime(int(maps["ts"][0]), unit="ms", utc=True),
+            to_datetime(int(maps["ts"][-1]), unit="ms", utc=True),
+        )
+
+    def coverage(
+        self, exchange: str, symbol: str, timeframe: str
+    ) -> list[tuple[int, int]]:
+        """time ranges covered by the store
+
+        Args:
+            exchange (str): cex
+            symbol (str): ccxt symbol
+            timeframe (str): timeframe
+
+        Returns:
+            list[tuple[int, int]]: [(start ms, end ms)], both included, sorted and
+            disjoint
+        """
+        fdir: str = self._dir(exchange=exchange, symbol=symbol, timeframe=timeframe)
+        meta: dict = self._meta(fdir=fdir)
+        if "coverage" in meta:
+            return [(int(a), int(b)) for a, b in meta["coverage"]]
+        # stores written before the ranges were kept cover their first to last row
+        ts: np.ndarray = self._map_ts(fdir=fdir, n=self._n_rows(fdir=fdir))
+        return [(int(ts[0]), int(ts[-1]))] if len(ts) else []
+
+    def missing(
+        self,
+        exchange: str,
+        symbol: str,
+        timeframe: str,
+        start_ms: int,
+        end_ms: int,
+        step_ms: int = 1,
+    ) -> list[tuple[int, int]]:
+        """ranges of [start_ms, end_ms] not covered by the store
+
+        Args:
+            exchange (str): cex
+            symbol (str): ccxt symbol
+            timeframe (str): timeframe
+            start_ms (int): start ms, included
+            end_ms (int): end ms, included
+            step_ms (int, optional): spacing of the rows, e.g. the bar length, the
+            ranges are on its grid. Defaults to 1.
+
+        Returns:
+            list[tuple[int, int]]: [(start ms, end ms)], both included
+        """
+        gaps: list[tuple[int, int]] = []
+        cursor: int = start_ms
+        for a, b in self.coverage(
+            exchange=exchange, symbol=symbol, timeframe=timeframe
+        ):
+            if b < cursor:
+                continue
+            if a > end_ms:
+                break
+            if a > cursor:
+                gaps.append((cursor, a - step_ms))
+            cursor = b + step_ms
+        if cursor <= end_ms:
+            gaps.append((cursor, end_ms))
+        return gaps
+
+    def write(
+        self,
+        exchange: str,
+        symbol: str,
+        timeframe: str,
+        df: DataFrame,
+        start_ms: int,
+        end_ms: int,
+        step_ms: int = 1,
+    ) -> int:
+        """store the rows of df and mark [start_ms, end_ms] covered
+
+        rows whose ts is already stored are kept as stored
+
+        Args:
+            exchange (str): cex
+            symbol (str): ccxt symbol
+            timeframe (str): timeframe
+            df (DataFrame): ['ts', value columns], every row of the source with ts in
+            [start_ms, end_ms], in increasing ts order
+            start_ms (int): start of the covered range, included
+            end_ms (int): end of the covered range, included
+            step_ms (int, optional): spacing of the rows, ranges closer than it are
+            merged. Defaults to 1.
+
+        Returns:
+            int: number of rows added
+        """
+        fdir: str = self._dir(exchange=exchange, symbol=symbol, timeframe=timeframe)
+        ensure_dir(fdir=os.path.dirname(fdir))
+        cols: list[str] = [k for k in df.columns if k not in ("ts", "sym")]
+        # one writer per dataset at a time, across processes, the lock is next to the
+        # directory since a rewrite replaces it
+        with open(file=f"{fdir}.lock", mode="w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            ensure_dir(fdir=fdir)
+            meta: dict = self._meta(fdir=fdir)
+            stored_cols: list[str] = meta["columns"] or cols
+            assert not len(df) or set(cols) == set(
+                stored_cols
+            ), f"columns {cols} don't match the stored columns {stored_cols}"
+            coverage: list[tuple[int, int]] = self.coverage(
+                exchange=exchange, symbol=symbol, timeframe=timeframe
+            )
+
+            n: int = self._n_rows(fdir=fdir)
+            stored_ts: np.ndarray = self._map_ts(fdir=fdir, n=n)
+            ts: np.ndarray = df["ts"].values.astype("datetime64[ms]").astype(np.int64)
+            assert np.all(np.diff(ts) > 0), "ts must be strictly increasing"
+            keep: np.ndarray = np.ones(len(ts), dtype=bool)
+            if n and len(ts):
+                # only the stored rows inside the range of the new ones can match
+                i0: int = int(np.searchsorted(stored_ts, ts[0], side="left"))
+                i1: int = int(np.searchsorted(stored_ts, ts[-1], side="right"))
+                keep = ~np.isin(element=ts, test_elements=stored_ts[i0:i1])
+            if keep.any() and (not n or ts[keep][0] > stored_ts[-1]):
+                # values first and ts last, rows only exist once their ts is written
+                for col in stored_cols:
+                    with open(file=os.path.join(fdir, f"{col}.bin"), mode="ab") as fp:
+                        # drop the tail of an interrupted append
+                        fp.truncate(n * 8)
+                        fp.write(np.asarray(df[col], dtype=np.float64)[keep].tobytes())
+                with open(file=os.path.join(fdir, "ts.bin"), mode="ab") as fp:
+                    fp.write(ts[keep].tobytes())
+            elif keep.any():
+                self._rewrite(
+                    fdir=fdir,
+                    n=n,
+                    stored_ts=self._read_ts(fdir=fdir, n=n),
+                    stored_cols=stored_cols,
+                    ts=ts[keep],
+                    values={
+                        col: np.asarray(df[col], dtype=np.float64)[keep]
+                        for col in stored_cols
+                    },
+                )
+
+            # the range is covered only once its rows are written
+            merged: list[tuple[int, int]] = []
+            for a, b in sorted(coverage + [(start_ms, end_ms)]):
+                if len(merged) and a <= merged[-1][1] + step_ms:
+                    merged[-1] = (merged[-1][0], max(merged[-1][1], b))
+                else:
+                    merged.append((a, b))
+            self._write_meta(
+                fdir=fdir,
+                meta={"columns": stored_cols, "coverage": [list(k) for k in merged]},
+            )
+        return int(keep.sum())
+
+    @staticmethod
+    def _rewrite(
+        fdir: str,
+        n: int,
+        stored_ts: np.ndarray,
+        stored_cols: list[str],
+        ts: np.ndarray,
+        values: dict[str, np.ndarray],
+    ) -> None:
+        """merge rows into the dataset, written to a new directory which then
+        replaces the old one, readers keep their maps of the old files"""
+        order: np.ndarray = np.argsort(np.concatenate([stored_ts, ts]), kind="stable")
+        tmp_dir: str = ensure_dir(fdir=f"{fdir}.{os.getpid()}.tmp")
+        for col in stored_cols:
+            stored: np.ndarray = np.fromfile(
+                file=os.path.join(fdir, f"{col}.bin"), dtype=np.float64, count=n
+            )
+            np.concatenate([stored, values[col]])[order].tofile(
+                os.path.join(tmp_dir, f"{col}.bin")
+            )
+        np.concatenate([stored_ts, ts])[order].tofile(os.path.join(tmp_dir, "ts.bin"))
+        shutil.copy(src=os.path.join(fdir, "meta.json"), dst=tmp_dir)
+        old_dir: str = f"{fdir}.{os.getpid()}.old"
+        os.rename(src=fdir, dst=old_dir)
+        os.rename(src=tmp_dir, dst=fdir)
+        shutil.rmtree(path=old_dir)
+
+    def read(
+        self,
+        exchange: str,
+        symbol: str,
+        timeframe: str,
+        stime: Timestamp,
+        etime: Timestamp,
+    ) -> dict[str, np.ndarray]:
+        """rows with stime <= ts <= etime as zero copy views
+
+        Args:
+            exchange (str): cex
+            symbol (str): ccxt symbol
+            timeframe (str): timeframe
+            stime (Timestamp): start time
+            etime (Timestamp): end time
+
+        Returns:
+            dict[str, np.ndarray]: {'ts': int64 ms, value column: float64}
+        """
+        maps: dict[str, np.ndarray] = self._open(
+            exchange=exchange, symbol=symbol, timeframe=timeframe
+        )
+        if not len(maps):
+            return {"ts": np.empty(0, dtype=np.int64)}
+        i0: int = int(np.searchsorted(maps["ts"], _ts_ms(ts=stime), side="left"))
+        i1: int = int(np.searchsorted(maps["ts"], _ts_ms(ts=etime), side="right"))
+        return {col: mm[i0:i1] for col, mm in maps.items()}
+
+    def iter_frames(
+        self,
+        exchange: str,
+        symbol: str,
+        timeframe: str,
+        stime: Timestamp,
+        etime: Timestamp,
+        chunk_size: int = 1 << 20,
+    ) -> Iterator[DataFrame]:
+        """rows with stime <= ts <= etime as dataframes of at most chunk_size rows
+
+        Args:
+            exchange (str): cex
+            symbol (str): ccxt symbol
+            timeframe (str): timeframe
+            stime (Timestamp): start time
+            etime (Timestamp): end time
+            chunk_size (int, optional): max rows per dataframe. Defaults to 1 << 20.
+
+        Yields:
+            Iterator[DataFrame]: ['sym', 'ts', value columns]
+        """
+        arrays: dict[str, np.ndarray] = self.read(
+            exchange=exchange,
+            symbol=symbol,
+            timeframe=timeframe,
+            stime=stime,
+            etime=etime,
+        )
+        for i in range(0, len(arrays["ts"]), chunk_size):
+            df: DataFrame = DataFrame(
+                data={
+                    col: arr[i : i + chunk_size]
+                    for col, arr in arrays.items()
+                    if col != "ts"
+                }
+            )
+            df.insert(
+                loc=0,
+                column="ts",
+                value=to_datetime(
+                    arrays["ts"][i : i + chunk_size], unit="ms", utc=True
+                ),
+            )
+            df.insert(loc=0, column="sym", value=symbol)
+            yield df
+
+    def iter_through(
+        self,
+        exchange: str,
+        symbol: str,
+        timeframe: str,
+        stime: Timestamp,
+        etime: Timestamp,
+        fetch: Callable[[Timestamp, Timestamp], Iterator[DataFrame]],
+        complete: Timestamp,
+        step_ms: int = 1,
+    ) -> Iterator[DataFrame]:
+        """rows with stime <= ts <= etime, read from the store where it covers them
+        and fetched where it doesn't
+
+        the ranges missing before, inside and after the stored ones are fetched, their
+        rows up to complete are stored and the ranges marked covered, page by page, so
+        an interrupted fetch keeps what it got. Rows are yielded in ts order.
+
+        Args:
+            exchange (str): cex
+            symbol (str): ccxt symbol
+            timeframe (str): timeframe
+            stime (Timestamp): start time
+            etime (Timestamp): end time
+            fetch (Callable[[Timestamp, Timestamp], Iterator[DataFrame]]): source of a
+            range, func(stime, etime) yielding ['sym', 'ts', value columns] in ts order
+            complete (Timestamp): ts of the last row that can't change anymore, later
+            rows are yielded but not stored, e.g. the current bar
+            step_ms (int, optional): spacing of the rows, e.g. the bar length, the
+            ranges are aligned on its grid. Defaults to 1.
+
+        Yields:
+            Iterator[DataFrame]: ['sym', 'ts', value columns]
+        """
+        start_ms: int = -(-_ts_ms(ts=stime) // step_ms) * step_ms
+        end_ms: int = _ts_ms(ts=etime) // step_ms * step_ms
+        complete_ms: int = _ts_ms(ts=complete)
+        gaps: list[tuple[int, int]] = self.missing(
+            exchange=exchange,
+            symbol=symbol,
+            timeframe=timeframe,
+            start_ms=start_ms,
+            end_ms=end_ms,
+            step_ms=step_ms,
+        )
+        cursor: int = start_ms
+        # an empty gap past end_ms serves the stored rows after the last gap
+        for gap_start, gap_end in gaps + [(end_ms + step_ms, end_ms)]:
+            # stored rows before the gap
+            if gap_start > cursor:
+                yield from self.iter_frames(
+                    exchange=exchange,
+                    symbol=symbol,
+                    timeframe=timeframe,
+                    stime=to_datetime(cursor, unit="ms", utc=True),
+                    etime=to_datetime(gap_start - step_ms, unit="ms", utc=True),
+                )
+            if gap_start > gap_end:
+                break
+            # start of the part of the gap not covered yet
+            covered_ms: int = gap_start
+            for page_df in fetch(
+                to_datetime(gap_start, unit="ms", utc=True),
+                to_datetime(gap_end, unit="ms", utc=True),
+            ):
+                page_ms: np.ndarray = (
+                    page_df["ts"].values.astype("datetime64[ms]").astype(np.int64)
+                )
+                page_df = page_df[(page_ms >= gap_start) & (page_ms <= gap_end)]
+                page_ms = page_ms[(page_ms >= gap_start) & (page_ms <= gap_end)]
+                stored_df: DataFrame = page_df[page_ms <= complete_ms]
+                if len(stored_df):
+                    last_ms: int = int(page_ms[page_ms <= complete_ms][-1])
+                    self.write(
+                        exchange=exchange,
+                        symbol=symbol,
+                        timeframe=timeframe,
+                        df=stored_df.drop(columns=["sym"]),
+                        start_ms=covered_ms,
+                        end_ms=last_ms,
+                        step_ms=step_ms,
+                    )
+                    covered_ms = last_ms + step_ms
+                yield page_df
+            # the source has no row in the rest of the gap
+            if covered_ms <= min(gap_end, complete_ms):
+                self.write(
+                    exchange=exchange,
+                    symbol=symbol,
+                    timeframe=timeframe,
+                    df=DataFrame(columns=["ts"]),
+                    start_ms=covered_ms,
+                    end_ms=min(gap_end, complete_ms),
+                    step_ms=step_ms,
+                )
+            cursor = gap_end + step_ms
@@ -0,0 +1,227 @@
+import glob
+import hashlib
+import inspect
+import json
+import os
+from types import ModuleType
+from typing import Any, Callable
+
+import pandas as pd
+from pandas import DataFrame
+
+from utils.log import logger
+from utils.var import CALLBACK_CACHE_DIR, CALLBACK_CACHE_MB, REPO_DIR, ensure_dir
+
+# placeholder for config keys the callback asked for but were not set
+MISSING_KEY: str = "<missing>"
+
+
+class TrackedCfg(dict):
+    """config dict that records every key read by the callback"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.read_keys: set[str] = set()
+
+    def __getitem__(self, key):
+        self.read_keys.add(key)
+        return super().__getitem__(key)
+
+    def __contains__(self, key):
+        self.read_keys.add(key)
+        return super().__contains__(key)
+
+    def get(self, key, default=None):
+        self.read_keys.add(key)
+        return super().get(key, default)
+
+
+def _dump(value: Any) -> str:
+    return json.dumps(value, default=str, sort_keys=True)
+
+
+def _sha1(data: bytes) -> str:
+    return hashlib.sha1(data).hexdigest()
+
+
+def fingerprint_frame(df: DataFrame) -> str:
+    """content hash of a dataframe, including column names and dtypes
+
+    Args:
+        df (DataFrame): dataframe to be hashed
+
+    Returns:
+        str: hex digest
+    """
+    h = hashlib.sha1()
+    h.update(_dump([[c, str(t)] for c, t in df.dtypes.items()]).encode())
+    h.update(pd.util.hash_pandas_object(obj=df, index=False).values.tobytes())
+    return h.hexdigest()
+
+
+def _repo_modules(module: ModuleType) -> dict[str, ModuleType]:
+    """modules of the repo used by module, directly or through other repo modules
+
+    Args:
+        module (ModuleType): module
+
+    Returns:
+        dict[str, ModuleType]: {module name: module}, module included
+    """
+    repo_dir: str = os.path.join(os.path.abspath(REPO_DIR), "")
+    found: dict[str, ModuleType] = {}
+    todo: list[ModuleType] = [module]
+    while len(todo):
+        mod: ModuleType = todo.pop()
+        if mod.__name__ in found:
+            continue
+        found[mod.__name__] = mod
+        for value in vars(mod).values():
+            used = inspect.getmodule(value)
+            fp: str | None = getattr(used, "__file__", None)
+            if fp is None:
+                continue
+            fp = os.path.abspath(fp)
+            # a venv inside the repo holds installed packages, not repo code
+            if fp.startswith(repo_dir) and "site-packages" not in fp.split(os.sep):
+                todo.append(used)
+    return found
+
+
+def fingerprint_source(func: Callable) -> str:
+    """hash of the source code of the module defining func and of the repo modules
+    it uses
+
+    the whole module is hashed so helpers called by func are covered as well, the
+    repo modules cover the shared features and utils computing part of its output
+
+    Args:
+        func (Callable): callback function
+
+    Returns:
+        str: hex digest
+    """
+    module = inspect.getmodule(func)
+    if module is None:
+        return _sha1(data=inspect.getsource(func).encode())
+    h = hashlib.sha1()
+    for name, mod in sorted(_repo_modules(module=module).items()):
+        h.update(f"{name}:{inspect.getsource(mod)}".encode())
+    return h.hexdigest()
+
+
+def evict_lru(cache_dir: str, max_mb: float, ext: str = ".parquet") -> None:
+    """delete least recently used entries until cache_dir is under max_mb
+
+    an entry is all the files sharing one stem, its last use is the mtime of the
+    main file (ext), which is touched on every cache hit
+
+    Args:
+        cache_dir (str): cache directory
+        max_mb (float): size cap in megabytes
+        ext (str, optional): extension of the main file of each entry. Defaults to ".parquet".
+    """
+    entries: dict[str, list[str]] = {}
+    for fp in glob.glob(os.path.join(cache_dir, "*")):
+        # skip entries that are still being written
+        if fp.endswith(".tmp"):
+            continue
+        stem: str = os.path.splitext(os.path.basename(fp))[0]
+        entries.setdefault(stem, []).append(fp)
+
+    sizes: dict[str, int] = {}
+    last_used: dict[str, float] = {}
+    for stem, fps in entries.items():
+        sizes[stem] = sum(os.path.getsize(fp) for fp in fps)
+        main_fp: str = os.path.join(cache_dir, stem + ext)
+        last_used[stem] = os.path.getmtime(main_fp) if os.path.exists(main_fp) else 0
+
+    total: int = sum(sizes.values())
+    max_bytes: float = max_mb * 1024 * 1024
+    for stem in sorted(entries.keys(), key=lambda k: last_used[k]):
+        if total <= max_bytes:
+            break
+        for fp in entries[stem]:
+            os.remove(fp)
+        total -= sizes[stem]
+        logger.info(msg=f"Evicted cache entry: {stem}")
+
+
+def cached_callback(
+    callback: Callable,
+    prc_df: DataFrame,
+    cfg: dict,
+    data_fp: str | None = None,
+    cache_dir: str = CALLBACK_CACHE_DIR,
+    max_mb: float = CALLBACK_CACHE_MB,
+    **kwargs,
+) -> DataFrame | None:
+    """call callback(prc_df, cfg, **kwargs) and memoize its output on disk
+
+    the cache key is made of the fingerprint of the input data, the source code of
+    the callback module and the values of the config keys read by the callback
+
+    Args:
+        callback (Callable): custom function, func(prc_df, cfg, **kwargs) -> DataFrame
+        prc_df (DataFrame): aligned price dataframe
+        cfg (dict): config dict
+        data_fp (str | None, optional): fingerprint of all the data the callback can
+        read, fingerprint of prc_df if None. Defaults to None.
+        cache_dir (str, optional): cache directory. Defaults to CALLBACK_CACHE_DIR.
+        max_mb (float, optional): size cap of the cache in megabytes. Defaults to CALLBACK_CACHE_MB.
+        kwargs: passed to the callback as is
+
+    Returns:
+        DataFrame | None: output of the callback
+    """
+
+    """
+    1. look up the entries sharing the same data and source
+    """
+    prefix: str = "_".join(
+        [
+            (fingerprint_frame(df=prc_df) if data_fp is None else data_fp)[:16],
+            fingerprint_source(func=callback)[:16],
+        ]
+    )
+    for meta_fp in glob.glob(os.path.join(cache_dir, f"{prefix}_*.json")):
+        with open(file=meta_fp, mode="r") as fp:
+            read_cfg: dict[str, str] = json.load(fp=fp)
+        if any(_dump(cfg.get(k, MISSING_KEY)) != v for k, v in read_cfg.items()):
+            continue
+        out_fp: str = meta_fp.replace(".json", ".parquet")
+        if not os.path.exists(path=out_fp):
+            continue
+        # touch the entry so it is the most recently used one
+        os.utime(path=out_fp)
+        logger.info(
+            msg=f"Callback output loaded from cache: {os.path.basename(out_fp)}"
+        )
+        return pd.read_parquet(path=out_fp)
+
+    """
+    2. cache miss, call the callback and store its output
+    """
+    tracked_cfg: TrackedCfg = TrackedCfg(cfg)
+    out: DataFrame | None = callback(prc_df=prc_df.copy(), cfg=tracked_cfg, **kwargs)
+    if out is None:
+        return out
+    read_cfg = {
+        k: _dump(cfg.get(k, MISSING_KEY)) for k in sorted(tracked_cfg.read_keys)
+    }
+    stem: str = f"{prefix}_{_sha1(data=_dump(read_cfg).encode())[:16]}"
+    out_fp = os.path.join(ensure_dir(fdir=cache_dir), f"{stem}.parquet")
+    # write to a temp file first so a half written entry is never picked up,
+    # the pid keeps parallel runs of the same entry from sharing the temp file
+    tmp_fp: str = f"{out_fp}.{os.getpid()}.tmp"
+    out.to_parquet(path=tmp_fp, index=False)
+    os.replace(src=tmp_fp, dst=out_fp)
+    with open(file=os.path.join(cache_dir, f"{stem}.json"), mode="w") as fp:
+        json.dump(obj=read_cfg, fp=fp)
+    logger.info(msg=f"Callback output saved to cache: {stem}.parquet")
+
+    """
+    3. keep the cache under its size cap
+    """
+    evict_lru(cache_dir=cache_dir, max_mb=max_mb)
+    return out
@@ -0,0 +1,311 @@
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timezone
+
+import numpy as np
+from pandas import DataFrame, Timedelta, Timestamp, concat, merge
+
+from utils.cache import fingerprint_frame
+from utils.feature import FeatureGraph
+from utils.funding import load_funding
+from utils.loader import load_price, load_price_resampled
+from utils.log import logger
+from utils.repair import repair_prices
+from utils.valid import check_cols
+from utils.var import INTERVAL_MS_MAP
+
+# venues always needed by main, okx and binance are the two legs of the trade
+BASE_VENUES: list[str] = ["okx", "binance"]
+
+
+def cfg_venues(cfg: dict) -> list[str]:
+    """venues needed by a strategy, BASE_VENUES plus the optional 'venues' in config
+
+    Args:
+        cfg (dict): config dict
+
+    Returns:
+        list[str]: exchanges
+    """
+    venues: list[str] = list(BASE_VENUES)
+    for exchange in cfg.get("venues", []):
+        if exchange not in venues:
+            venues.append(exchange)
+    return venues
+
+
+def cfg_repair(cfg: dict) -> dict | None:
+    """options of the price repair, the optional 'repair' section in config
+
+    Args:
+        cfg (dict): config dict
+
+    Returns:
+        dict | None: keyword arguments of repair_prices, None if 'repair' is missing
+        or false, {} for the defaults if 'repair' is true
+    """
+    repair: dict | bool | None = cfg.get("repair")
+    if repair is None or repair is False:
+        return None
+    return {} if repair is True else dict(repair)
+
+
+class DataContext:
+    """market data of one (sdate, edate, timeframe, ccxt_sym) dataset
+
+    venues are loaded once, concurrently, and served to main and the custom
+    strategies as frames with exchange prefixed columns on the same time grid
+    """
+
+    def __init__(
+        self,
+        s_ts: Timestamp,
+        e_ts: Timestamp,
+        timeframe: str,
+        ccxt_sym: str,
+        base_timeframe: str | None = None,
+        repair: dict | None = None,
+        feature_cache: bool = True,
+    ):
+        self.s_ts: Timestamp = s_ts
+        self.e_ts: Timestamp = e_ts
+        self.timeframe: str = timeframe
+        self.ccxt_sym: str = ccxt_sym
+        # fetch bars at base_timeframe and resample them to timeframe if set
+        self.base_timeframe: str | None = base_timeframe
+        # raw prices, {exchange: ['sym', 'ts', 'open', 'high', 'low', 'close', 'volume']}
+        self.prices: dict[str, DataFrame] = {}
+        # keyword arguments of repair_prices, prices are used as loaded if None
+        self.repair: dict | None = repair
+        # {exchange: tradeable flag per row of its price}
+        self.tradeable_flags: dict[str, np.ndarray] = {}
+        # one row per repaired exchange
+        self.repair_summary: DataFrame = DataFrame()
+        self._fingerprints: dict[str, str] = {}
+        # keep computed features in the feature store across runs
+        self.feature_cache: bool = feature_cache
+        self._features: FeatureGraph | None = None
+        # funding events, {exchange: ['sym', 'ts', 'funding_rate']}, loaded on first use
+        self.funding_rates: dict[str, DataFrame] = {}
+
+    @classmethod
+    def from_cfg(cls, cfg: dict, s_ts: Timestamp | None = None) -> "DataContext":
+        """data context of the dataset of a config, nothing loaded yet
+
+        Args:
+            cfg (dict): config dict
+            s_ts (Timestamp | None, optional): start time replacing sdate, e.g. the
+            warmup start of an append run. Defaults to None.
+
+        Returns:
+            DataContext: context
+        """
+        return cls(
+            s_ts=(
+                Timestamp(ts_input=cfg["sdate"], tz=timezone.utc)
+                if s_ts is None
+                else s_ts
+            ),
+            e_ts=Timestamp(ts_input=cfg["edate"], tz=timezone.utc),
+            timeframe=cfg["timeframe"],
+            ccxt_sym=cfg["ccxt_sym"],
+            base_timeframe=cfg.get("base_timeframe"),
+            repair=cfg_repair(cfg=cfg),
+            feature_cache=cfg.get("feature_cache", True),
+        )
+
+    def load(self, venues: list[str]) -> None:
+        """load the venues not loaded yet, one thread per venue
+
+        Args:
+            venues (list[str]): exchanges
+        """
+        missing: list[str] = [k for k in venues if k not in self.prices]
+        if not len(missing):
+            return
+        logger.info(msg=f"Loading price for {missing}")
+        with ThreadPoolExecutor(max_workers=len(missing)) as executor:
+            results: dict[str, DataFrame] = dict(
+                zip(missing, executor.map(self._load_venue, missing))
+            )
+        for exchange, prc in results.items():
+            check_cols(
+                df=prc,
+                cols=["sym", "ts", "open", "high", "low", "close", "volume"],
+            )
+            self.prices[exchange] = prc
+        if self.repair is not None:
+            self._repair(venues=missing)
+
+    def _repair(self, venues: list[str]) -> None:
+        """repair the price of the venues, the other loaded venues are only used as
+        reference for the outliers
+
+        Args:
+            venues (list[str]): exchanges
+        """
+        repaired, tradeable, summary = repair_prices(prices=self.prices, **self.repair)
+        for exchange in venues:
+            self.prices[exchange] = repaired[exchange]
+            self.tradeable_flags[exchange] = tradeable[exchange]
+        summary = summary[summary["exchange"].isin(venues)]
+        self.repair_summary = concat(
+            objs=[self.repair_summary, summary], ignore_index=True
+        )
+        for row in summary.itertuples(index=False):
+            logger.info(
+                msg=(
+                    f"Repaired {row.exchange} price: {row.outliers} outliers,"
+                    f" {row.filled} bars filled, {row.untradeable} bars untradeable"
+                    f" out of {row.bars}"
+                )
+            )
+
+    def _load_venue(self, exchange: str) -> DataFrame:
+        if self.base_timeframe is None or self.base_timeframe == self.timeframe:
+            return load_price(
+                stime=self.s_ts,
+                etime=self.e_ts,
+                exchange=exchange,  # type: ignore
+                symbols=[self.ccxt_sym],
+                timeframe=self.timeframe,
+            )
+        return load_price_resampled(
+            stime=self.s_ts,
+            etime=self.e_ts,
+            exchange=exchange,  # type: ignore
+            symbols=[self.ccxt_sym],
+            timeframes=[self.timeframe],
+            base_timeframe=self.base_timeframe,
+        )[self.timeframe]
+
+    def funding(self, exchange: str) -> DataFrame:
+        """funding events of a venue during the bars, loaded on first use
+
+        Args:
+            exchange (str): exchange
+
+        Returns:
+            DataFrame: ['sym', 'ts', 'funding_rate']
+        """
+        if exchange not in self.funding_rates:
+            self.funding_rates[exchange] = load_funding(
+                stime=self.s_ts,
+                # events during the last bar are paid by it
+                etime=self.e_ts
+                + Timedelta(milliseconds=INTERVAL_MS_MAP[self.timeframe] - 1),
+                exchange=exchange,  # type: ignore
+                symbols=[self.ccxt_sym],
+            )
+        return self.funding_rates[exchange]
+
+    def price(self, exchange: str) -> DataFrame:
+        """raw price of a loaded venue
+
+        Args:
+            exchange (str): exchange
+
+        Returns:
+            DataFrame: ['sym', 'ts', 'open', 'high', 'low', 'close', 'volume']
+        """
+        assert (
+            exchange in self.prices
+        ), f"{exchange} price not loaded, please add it to 'venues' in config."
+        return self.prices[exchange]
+
+    def venue(self, exchange: str) -> DataFrame:
+        """open price, return and volume of a venue with exchange prefixed columns
+
+        Args:
+            exchange (str): exchange
+
+        Returns:
+            DataFrame: ['sym', 'ts', '{exchange}_open_prc', '{exchange}_ret', '{exchange}_vol']
+        """
+        prc: DataFrame = self.price(exchange=exchange)
+        return DataFrame(
+            data={
+                "sym": prc["sym"],
+                "ts": prc["ts"],
+                f"{exchange}_open_prc": prc["open"],
+                f"{exchange}_ret": prc["close"] / prc["open"] - 1,
+                f"{exchange}_vol": prc["volume"],
+            }
+        ).reset_index(drop=True)
+
+    def join(self, prc_df: DataFrame, exchange: str) -> DataFrame:
+        """left join the venue columns on prc_df
+
+        Args:
+            prc_df (DataFrame): ['sym', 'ts', others]
+            exchange (str): exchange
+
+        Returns:
+            DataFrame: ['sym', 'ts', others, '{exchange}_open_prc', '{exchange}_ret', '{exchange}_vol']
+        """
+        return merge(
+            left=prc_df,
+            right=self.venue(exchange=exchange),
+            how="left",
+            on=["sym", "ts"],
+        )
+
+    @property
+    def features(self) -> FeatureGraph:
+        """features of the dataset, computed once and shared by every strategy run on
+        this context"""
+        if self._features is None:
+            self._features = (
+                FeatureGraph(ctx=self)
+                if self.feature_cache
+                else FeatureGraph(ctx=self, cache_dir=None)
+            )
+        return self._features
+
+    def tradeable(self, prc_df: DataFrame, venues: list[str]) -> np.ndarray:
+        """whether every venue can be traded at each row of prc_df
+
+        Args:
+            prc_df (DataFrame): ['sym', 'ts', others]
+            venues (list[str]): exchanges
+
+        Returns:
+            np.ndarray: tradeable flag per row, all True if prices are not repaired
+        """
+        flags: np.ndarray = np.ones(len(prc_df), dtype=bool)
+        for exchange in venues:
+            if exchange not in self.tradeable_flags:
+                continue
+            prc: DataFrame = self.price(exchange=exchange)
+            flag_df: DataFrame = merge(
+                left=prc_df[["sym", "ts"]],
+                right=DataFrame(
+                    data={
+                        "sym": prc["sym"],
+                        "ts": prc["ts"],
+                        "tradeable": self.tradeable_flags[exchange],
+                    }
+                ),
+                how="left",
+                on=["sym", "ts"],
+            )
+            flags &= np.array(flag_df["tradeable"].fillna(value=True), dtype=bool)
+        return flags
+
+    def fingerprint(self, venues: list[str]) -> str:
+        """content hash of the price of the venues
+
+        Args:
+            venues (list[str]): exchanges
+
+        Returns:
+            str: hex digest
+        """
+        h = hashlib.sha1()
+        for exchange in sorted(venues):
+            if exchange not in self._fingerprints:
+                self._fingerprints[exchange] = fingerprint_frame(
+                    df=self.price(exchange=exchange)
+                )
+            h.update(f"{exchange}:{self._fingerprints[exchange]}".encode())
+        return h.hexdigest()
@@ -0,0 +1,189 @@
+import glob
+import importlib
+import json
+import os
+import socketserver
+import sys
+import threading
+import traceback
+from collections import OrderedDict
+from time import perf_counter
+from types import ModuleType
+from typing import Any
+
+from main import dataset_key, load_data, main, resolve_cfg_fps
+from utils.config import load_cfg
+from utils.context import DataContext, cfg_venues
+from utils.log import logger
+from utils.var import CFG_DIR, DAEMON_SOCKET_FP, REPO_DIR, ensure_dir
+
+CUSTOM_DIR: str = os.path.join(REPO_DIR, "custom")
+
+# datasets kept in memory, the least recently used one is dropped beyond
+MAX_DATASETS: int = 4
+
+# seconds between two scans of custom/ and config/
+WATCH_INTERVAL: float = 0.5
+
+
+class BacktestDaemon:
+    """long lived process keeping loaded data and imported strategies warm
+
+    datasets are loaded once and kept by dataset_key, so a run only pays for the
+    callback onward. custom/ and config/ are watched: an edited strategy module is
+    re-imported, an edited config gets its dataset loaded before it's asked for.
+    """
+
+    def __init__(self, max_datasets: int = MAX_DATASETS):
+        self.max_datasets: int = max_datasets
+        # {dataset_key: loaded data}, least recently used first
+        self.contexts: OrderedDict[tuple, DataContext] = OrderedDict()
+        # {file path: mtime} of the watched files
+        self.mtimes: dict[str, float] = self._scan()
+        # runs, reloads and loads share the same data, one at a time
+        self.lock: threading.Lock = threading.Lock()
+        self.stopped: threading.Event = threading.Event()
+
+    @staticmethod
+    def _scan() -> dict[str, float]:
+        fps: list[str] = glob.glob(os.path.join(CUSTOM_DIR, "*.py")) + glob.glob(
+            os.path.join(CFG_DIR, "*.yml")
+        )
+        return {fp: os.path.getmtime(fp) for fp in fps if os.path.exists(fp)}
+
+    def context(self, cfg: dict) -> DataContext:
+        """loaded data of a config, loaded on first use
+
+        Args:
+            cfg (dict): config dict
+
+        Returns:
+            DataContext: data with the venues of the config loaded
+        """
+        key: tuple = dataset_key(cfg=cfg)
+        if key not in self.contexts:
+            self.contexts[key] = load_data(cfg=cfg, venues=cfg_venues(cfg=cfg))
+            if len(self.contexts) > self.max_datasets:
+                dropped, _ = self.contexts.popitem(last=False)
+                logger.info(msg=f"Dropped dataset {dropped}")
+        self.contexts.move_to_end(key=key)
+        ctx: DataContext = self.contexts[key]
+        # venues added to the config since the dataset was loaded
+        ctx.load(venues=cfg_venues(cfg=cfg))
+        return ctx
+
+    def reload(self, fp: str) -> None:
+        """re-import an edited strategy, or warm the dataset of an edited config
+
+        Args:
+            fp (str): changed file path
+        """
+        if fp.endswith(".py"):
+            name: str = "custom." + os.path.basename(fp).replace(".py", "")
+            module: ModuleType | None = sys.modules.get(name)
+            # strategies never run yet are imported by main on their first run
+            if module is not None:
+                importlib.reload(module)
+                logger.info(msg=f"Reloaded {name}")
+            return
+        try:
+            self.context(cfg=load_cfg(cfg_fp=fp))
+        except Exception:
+            logger.exception(msg=f"Failed to load the dataset of {fp}")
+
+    def watch(self) -> None:
+        """reload the files changed since the last scan, until stopped"""
+        while not self.stopped.wait(timeout=WATCH_INTERVAL):
+            mtimes: dict[str, float] = self._scan()
+            changed: list[str] = [
+                fp for fp, mtime in mtimes.items() if self.mtimes.get(fp) != mtime
+            ]
+            self.mtimes = mtimes
+            for fp in changed:
+                with self.lock:
+                    self.reload(fp=fp)
+
+    def run(self, cfg_fp: str, overrides: dict[str, Any]) -> dict[str, Any]:
+        """backtest a config on the warm data
+
+        Args:
+            cfg_fp (str): config file path
+            overrides (dict[str, Any]): config keys replacing the ones of the file
+
+        Returns:
+            dict[str, Any]: {'cfg_fp', 'run_id', 'seconds'}
+        """
+        t0: float = perf_counter()
+        with self.lock:
+            # pick up edits the watcher hasn't seen yet
+            for fp, mtime in self._scan().items():
+                if fp.endswith(".py") and self.mtimes.get(fp) != mtime:
+                    self.mtimes[fp] = mtime
+                    self.reload(fp=fp)
+            cfg: dict = {**load_cfg(cfg_fp=cfg_fp), **overrides}
+            run_id: int = main(cfg=cfg, ctx=self.context(cfg=cfg))
+        return {"cfg_fp": cfg_fp, "run_id": run_id, "seconds": perf_counter() - t0}
+
+    def handle(self, request: dict) -> dict:
+        """answer one request of the client
+
+        Args:
+            request (dict): {'cmd': 'run', 'configs': [...], 'overrides': {...}},
+            {'cmd': 'status'} or {'cmd': 'stop'}
+
+        Returns:
+            dict: response, {'error': traceback} if the request failed
+        """
+        try:
+            if request["cmd"] == "run":
+                return {
+                    "runs": [
+                        self.run(cfg_fp=fp, overrides=request.get("overrides", {}))
+                        for fp in resolve_cfg_fps(patterns=request["configs"])
+                    ]
+                }
+            if request["cmd"] == "status":
+                return {
+                    "datasets": [
+                        {"key": str(k), "venues": sorted(v.prices.keys())}
+                        for k, v in self.contexts.items()
+                    ],
+                    "strategies": sorted(
+                        k for k in sys.modules if k.startswith("custom.")
+                    ),
+                }
+            if request["cmd"] == "stop":
+                self.stopped.set()
+                return {"stopped": True}
+            raise ValueError(f"Unknown command {request['cmd']}")
+        except Exception:
+            logger.exception(msg=f"Request failed: {request}")
+            return {"error": traceback.format_exc()}
+
+
+def serve(socket_fp: str = DAEMON_SOCKET_FP) -> None:
+    """run the daemon until it's asked to stop
+
+    Args:
+        socket_fp (str, optional): unix socket path. Defaults to DAEMON_SOCKET_FP.
+    """
+    daemon: BacktestDaemon = BacktestDaemon()
+
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            request: dict = json.loads(self.rfile.readline())
+            self.wfile.write(
+                json.dumps(daemon.handle(request=request)).encode() + b"\n"
+            )
+
+    ensure_dir(fdir=os.path.dirname(p=socket_fp))
+    if os.path.exists(path=socket_fp):
+        os.remove(path=socket_fp)
+    with socketserver.ThreadingUnixStreamServer(socket_fp, Handler) as server:
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        threading.Thread(target=daemon.watch, daemon=True).start()
+        logger.info(msg=f"Daemon listening on {socket_fp}")
+        daemon.stopped.wait()
+        server.shutdown()
+    os.remove(path=socket_fp)
+    logger.info(msg="Daemon stopped")
@@ -1,5 +1,5 @@
 import numpy as np
-from pandas import DataFrame
+from pandas import DataFrame, Timestamp, concat, to_datetime
 
 
 def top_drawdown(x: np.ndarray, time: np.ndarray, topN: int = 5) -> DataFrame:
@@ -66,3 +66,105 @@ def top_drawdown(x: np.ndarray, time: np.ndarray, topN: int = 5) -> DataFrame:
     )
 
     return top_dd
+
+
+def update_drawdown(
+    x: np.ndarray,
+    time: np.ndarray,
+    state: dict | None = None,
+    topN: int = 5,
+) -> tuple[DataFrame, dict]:
+    """topN drawdowns of a series extended by x, without revisiting the past
+
+    the state keeps the running peak, the drawdown episode still open and the topN
+    closed episodes, which is all the past that can still matter
+
+    Args:
+        x (np.ndarray): target price data continuing the series of the state, cannot
+        be return
+        time (np.ndarray): corresponding time of each data point in x
+        state (dict | None, optional): state returned by the previous call, None to
+        start a new series. Defaults to None.
+        topN (int, optional): topN. Defaults to 5.
+
+    Returns:
+        tuple[DataFrame, dict]: [peak_time, trough_time, recovery_time, max_dd] as
+        top_drawdown of the whole series, and the state to continue it
+    """
+    assert not np.isnan(x).any()
+    assert len(x) == len(time) and len(x)
+    time = np.array(to_datetime(time, utc=True))
+
+    """
+    1. running peak and drawdown, episodes start at every new peak
+    """
+    prev_peak: float = -np.inf if state is None else state["peak"]
+    cum_max: np.ndarray = np.maximum(prev_peak, np.maximum.accumulate(x))
+    new_peak: np.ndarray = cum_max > np.concatenate([[prev_peak], cum_max[:-1]])
+    df = DataFrame(
+        data={
+            "episode": np.cumsum(new_peak),
+            "time": time,
+            "peak_time": np.where(new_peak, time, np.datetime64("NaT")),
+            "drawdown": x / cum_max - 1,
+        }
+    )
+
+    """
+    2. peak, trough and recovery of each episode, episode 0 continues the open one
+    """
+    grouped = df.groupby(by="episode")
+    trough_idx: np.ndarray = np.array(grouped["drawdown"].idxmin())
+    episodes = DataFrame(
+        data={
+            "peak_time": np.array(grouped["peak_time"].first()),
+            "trough_time": np.array(df["time"][trough_idx]),
+            "recovery_time": np.array(grouped["time"].last()),
+            "max_dd": np.array(grouped["drawdown"].min()),
+        },
+        index=grouped.size().index,
+    )
+    closed: list[DataFrame] = []
+    if state is not None:
+        open_dd: DataFrame = DataFrame(data=[state["open"]], index=[0])
+        if 0 in episodes.index:
+            # the trough may be before or after the new data
+            if episodes.loc[0, "max_dd"] < open_dd.loc[0, "max_dd"]:
+                open_dd.loc[0, ["trough_time", "max_dd"]] = episodes.loc[
+                    0, ["trough_time", "max_dd"]
+                ].values
+            open_dd.loc[0, "recovery_time"] = episodes.loc[0, "recovery_time"]
+            episodes = episodes.drop(index=0)
+        closed.append(open_dd)
+        closed.append(DataFrame(data=state["top"]))
+    closed.append(episodes.iloc[:-1])
+    open_ep: DataFrame = (episodes.iloc[-1:] if len(episodes) else closed.pop(0)).copy()
+
+    """
+    3. topN of the closed and open episodes, the open one is not recovered
+    """
+    cols: list[str] = ["peak_time", "trough_time", "recovery_time", "max_dd"]
+    top: DataFrame = (
+        concat(objs=[k[cols] for k in closed if len(k)] or [open_ep[cols].iloc[:0]])
+        .sort_values(by=["max_dd"], ascending=True)
+        .head(n=topN)
+    )
+    for col in ["peak_time", "trough_time", "recovery_time"]:
+        top[col] = to_datetime(top[col], utc=True)
+        open_ep[col] = to_datetime(open_ep[col], utc=True)
+    top_dd: DataFrame = (
+        concat(objs=[top, open_ep[cols]])
+        .sort_values(by=["max_dd"], ascending=True)
+        .head(n=topN)
+        .reset_index(drop=True)
+    )
+    last_time: Timestamp = to_datetime(time[-1], utc=True)
+    top_dd["recovery_time"] = top_dd["recovery_time"].where(
+        top_dd["recovery_time"] != last_time
+    )
+    new_state: dict = {
+        "peak": float(cum_max[-1]),
+        "open": open_ep[cols].iloc[0].to_dict(),
+        "top": top.reset_index(drop=True).to_dict(orient="list"),
+    }
+    return top_dd, new_state
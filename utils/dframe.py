@@ -52,6 +52,7 @@ def padding_id_time(
     e_ts: Timestamp | None = None,
     category: str = "",
     check_missing_data: bool = True,
+    exchange: str = "",
 ) -> DataFrame:
     """merge df with full universe
 
@@ -62,6 +63,7 @@ def padding_id_time(
         e_ts (Timestamp | None, optional): end timestamp. Defaults to None.
         category (str, optional): identifier to be used in log_missing_data function. Defaults to "".
         check_missing_data (bool, optional): check missing data or not. Defaults to True.
+        exchange (str, optional): exchange to be used in log_missing_data function. Defaults to "".
 
     Returns:
         DataFrame: ['sym', 'ts', others]
@@ -85,6 +87,11 @@ def padding_id_time(
     if check_missing_data:
         missing_data: DataFrame = df[df.isnull().any(axis=1)]
         if len(missing_data):
-            log_missing_data(df=missing_data, category=category)
+            log_missing_data(
+                df=missing_data,
+                freq=freq,
+                category=category,
+                exchange=exchange,
+            )
 
     return df
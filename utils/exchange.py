@@ -0,0 +1,114 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterator
+
+from utils.log import logger
+from utils.var import MARKETS_CACHE_DIR, MARKETS_CACHE_TTL, ensure_dir
+
+# {exchange: ccxt client} of this process, see client
+_CLIENTS: dict[str, object] = {}
+# {exchange: lock}, a ccxt client is not thread safe, its calls are serialised
+_LOCKS: dict[str, threading.RLock] = {}
+# exchanges whose client has its markets set, loaded under the lock of the exchange
+_LOADED: set[str] = set()
+# guards the registries above, not the markets loads
+_REGISTRY_LOCK: threading.Lock = threading.Lock()
+# process the registry belongs to, forked workers must not share the http sessions
+_PID: int = os.getpid()
+
+
+def _load_markets(cex, cache_dir: str, ttl: float) -> None:
+    """set the markets of a new client from the disk cache, loaded from the cex and
+    cached if missing or older than ttl
+
+    Args:
+        cex (ccxt.Exchange): client
+        cache_dir (str): markets cache directory
+        ttl (float): max age of the cached markets, in seconds
+    """
+    fp: str = os.path.join(cache_dir, f"{cex.id}.json")
+    if os.path.exists(path=fp) and time.time() - os.path.getmtime(filename=fp) < ttl:
+        try:
+            with open(file=fp, mode="r") as f:
+                cex.set_markets(json.load(fp=f))
+            return
+        except Exception:
+            # corrupt, or written by another ccxt version, replaced by fresh markets
+            logger.warning(msg=f"Markets cache of {cex.id} unreadable, reloading")
+    markets: dict = cex.load_markets()
+    # write to a temp file first so a half written cache is never read
+    tmp_fp: str = f"{fp}.{os.getpid()}.tmp"
+    with open(file=tmp_fp, mode="w") as f:
+        json.dump(obj=markets, fp=f, default=str)
+    os.replace(src=tmp_fp, dst=fp)
+    logger.info(msg=f"Markets of {cex.id} loaded and cached")
+
+
+def _registry_entry(
+    exchange: str, cache_dir: str, ttl: float
+) -> tuple[object, threading.RLock]:
+    """client and lock of an exchange, created on first use
+
+    the registry lock is only held to create the entry, the markets are loaded under
+    the lock of the exchange, so a slow venue doesn't hold up the others
+
+    Args:
+        exchange (str): ccxt exchange id
+        cache_dir (str): markets cache directory
+        ttl (float): max age of the cached markets, in seconds
+
+    Returns:
+        tuple[ccxt.Exchange, threading.RLock]: client, lock
+    """
+    global _PID
+    with _REGISTRY_LOCK:
+        if os.getpid() != _PID:
+            _CLIENTS.clear()
+            _LOCKS.clear()
+            _LOADED.clear()
+            _PID = os.getpid()
+        if exchange not in _CLIENTS:
+            # ccxt loads hundreds of exchange modules, import it only when fetching
+            import ccxt
+
+            assert exchange in ccxt.exchanges, f"Unknown exchange {exchange}"
+            _CLIENTS[exchange] = getattr(ccxt, exchange)({"enableRateLimit": True})
+            _LOCKS[exchange] = threading.RLock()
+        cex, lock = _CLIENTS[exchange], _LOCKS[exchange]
+    with lock:
+        # a failed load is retried by the next caller
+        if exchange not in _LOADED:
+            _load_markets(cex=cex, cache_dir=ensure_dir(fdir=cache_dir), ttl=ttl)
+            _LOADED.add(exchange)
+    return cex, lock
+
+
+@contextmanager
+def client(
+    exchange: str,
+    cache_dir: str = MARKETS_CACHE_DIR,
+    ttl: float = MARKETS_CACHE_TTL,
+) -> Iterator:
+    """shared ccxt client of an exchange, held exclusively inside the with block
+
+    one client per exchange and process keeps its http session alive and its markets
+    loaded across every fetch, and the markets come from the disk cache, so a fetch
+    costs no connection setup or metadata request. Threads calling different
+    exchanges run in parallel, calls to the same exchange wait for each other, so
+    keep the block to one request when paging.
+
+    Args:
+        exchange (str): ccxt exchange id, e.g. okx, binance, bybit
+        cache_dir (str, optional): markets cache directory. Defaults to MARKETS_CACHE_DIR.
+        ttl (float, optional): max age of the cached markets, in seconds. Defaults to
+        MARKETS_CACHE_TTL.
+
+    Yields:
+        Iterator[ccxt.Exchange]: client
+    """
+    cex, lock = _registry_entry(exchange=exchange, cache_dir=cache_dir, ttl=ttl)
+    with lock:
+        yield cex
@@ -0,0 +1,135 @@
+import numpy as np
+from pandas import DataFrame, merge
+
+from utils.context import DataContext
+from utils.valid import check_cols
+
+# legs of the trade, each with its own side, prices and costs
+EXEC_VENUES: list[str] = ["okx", "binance"]
+
+
+def fill_price(
+    open_prc: np.ndarray,
+    high: np.ndarray,
+    low: np.ndarray,
+    close: np.ndarray,
+    trade: np.ndarray,
+    fill: str = "open",
+    latency: float = 0.0,
+) -> np.ndarray:
+    """price at which the trade of each bar is filled
+
+    Args:
+        open_prc (np.ndarray): open price
+        high (np.ndarray): high price
+        low (np.ndarray): low price
+        close (np.ndarray): close price
+        trade (np.ndarray): change of side, positive to buy and negative to sell
+        fill (str, optional): 'open' fills at the open, 'latency' fills latency of the
+        way from open to close, 'worst' buys at the high and sells at the low.
+        Defaults to "open".
+        latency (float, optional): fraction of the bar before the order is filled, in
+        [0, 1]. Defaults to 0.0.
+
+    Returns:
+        np.ndarray: fill price
+    """
+    if fill == "open":
+        return open_prc
+    if fill == "latency":
+        assert 0 <= latency <= 1, "latency must be a fraction of the bar"
+        # without sub-bar data, the path inside the bar is taken as linear
+        return open_prc + latency * (close - open_prc)
+    if fill == "worst":
+        return np.where(trade > 0, high, np.where(trade < 0, low, open_prc))
+    raise ValueError(f"Unknown fill {fill}, must be open, latency or worst")
+
+
+def execution_cost(
+    prc_df: DataFrame,
+    ctx: DataContext,
+    exec_cfg: dict,
+    fee: float,
+) -> DataFrame:
+    """cost of trading the sides of each venue, as return deducted at each bar
+
+    the cost of a venue at a bar is |trade| * (fee + slippage) plus the adverse move
+    from the open to the fill price, trade being the change of side. Slippage follows
+    the square root law, impact * sqrt(participation), participation being the traded
+    quantity over the bar volume. Everything is one numpy pass over the columns.
+
+    Args:
+        prc_df (DataFrame): ['sym', 'ts', '{venue}_open_prc', '{venue}_ret',
+        '{venue}_vol', '{venue}_side'] for the venues in EXEC_VENUES
+        ctx (DataContext): data context serving the high and low price
+        exec_cfg (dict): 'execution' section of the config, optional keys fill,
+        latency, notional, impact and fee, {venue: fee per unit of turnover}
+        fee (float): cost of opening or closing both legs, split evenly between the
+        venues without a fee in exec_cfg
+
+    Returns:
+        DataFrame: ['{venue}_exec_cost' for each venue, 'exec_cost'], aligned with prc_df
+    """
+    fill: str = exec_cfg.get("fill", "open")
+    latency: float = exec_cfg.get("latency", 0.0)
+    # notional of each leg in quote currency, slippage is ignored if not set
+    notional: float = exec_cfg.get("notional", 0.0)
+    impact: float = exec_cfg.get("impact", 0.0)
+    venue_fees: dict[str, float] = exec_cfg.get("fee", {})
+
+    cost_df: DataFrame = DataFrame(index=prc_df.index)
+    cost_df["exec_cost"] = 0.0
+    for venue in EXEC_VENUES:
+        check_cols(
+            df=prc_df,
+            cols=["sym", "ts", f"{venue}_open_prc", f"{venue}_vol", f"{venue}_side"],
+            checkRedundancy=False,
+        )
+        """
+        1. align the high, low and close price of the venue with prc_df
+        """
+        bar_df: DataFrame = merge(
+            left=prc_df[["sym", "ts"]],
+            right=ctx.price(exchange=venue)[["sym", "ts", "high", "low", "close"]],
+            how="left",
+            on=["sym", "ts"],
+        )
+        open_prc: np.ndarray = np.array(prc_df[f"{venue}_open_prc"], dtype=np.float64)
+        side: np.ndarray = np.array(prc_df[f"{venue}_side"], dtype=np.float64)
+        trade: np.ndarray = np.diff(side, prepend=0.0)
+        size: np.ndarray = np.abs(trade)
+
+        """
+        2. adverse move from the open to the fill price
+        """
+        fill_prc: np.ndarray = fill_price(
+            open_prc=open_prc,
+            high=np.array(bar_df["high"], dtype=np.float64),
+            low=np.array(bar_df["low"], dtype=np.float64),
+            close=np.array(bar_df["close"], dtype=np.float64),
+            trade=trade,
+            fill=fill,
+            latency=latency,
+        )
+        move: np.ndarray = trade * (fill_prc / open_prc - 1)
+
+        """
+        3. slippage from the participation in the bar volume
+        """
+        volume: np.ndarray = np.array(prc_df[f"{venue}_vol"], dtype=np.float64)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            participation: np.ndarray = size * notional / open_prc / volume
+        # trading in a bar without volume takes the whole bar
+        participation = np.where(
+            size > 0, np.nan_to_num(participation, nan=1.0, posinf=1.0), 0.0
+        )
+        slippage: np.ndarray = impact * np.sqrt(np.minimum(participation, 1.0))
+
+        """
+        4. fee and total cost
+        """
+        venue_fee: float = venue_fees.get(venue, fee / len(EXEC_VENUES))
+        cost: np.ndarray = np.nan_to_num(move) + size * (venue_fee + slippage)
+        cost_df[f"{venue}_exec_cost"] = cost
+        cost_df["exec_cost"] += cost
+    return cost_df
@@ -0,0 +1,397 @@
+import glob
+import hashlib
+import json
+import os
+from typing import Any, Callable
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from pandas import DataFrame, Series, merge
+
+from utils.cache import evict_lru, fingerprint_source
+from utils.hedge import ewm_ols, hedge_spread, rolling_ols
+from utils.var import FEATURE_CACHE_DIR, FEATURE_CACHE_MB, ensure_dir
+
+# {feature name: func(graph, **params) -> np.ndarray}
+FEATURES: dict[str, Callable[..., np.ndarray]] = {}
+
+
+def feature(name: str) -> Callable:
+    """register a feature, the decorated func(graph, **params) returns one value per
+    row of graph.base and gets the features it depends on through graph.get
+
+    Args:
+        name (str): feature name
+
+    Returns:
+        Callable: decorator
+    """
+
+    def register(func: Callable[..., np.ndarray]) -> Callable[..., np.ndarray]:
+        assert name not in FEATURES, f"feature {name} already registered"
+        FEATURES[name] = func
+        return func
+
+    return register
+
+
+def _freeze(value: Any) -> Any:
+    """hashable version of feature params"""
+    if isinstance(value, dict):
+        return tuple(sorted((k, _freeze(v)) for k, v in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    return value
+
+
+def _sha1(data: str) -> str:
+    return hashlib.sha1(data.encode()).hexdigest()
+
+
+def _node_key(key: tuple) -> str:
+    """hash of a feature node, its params and the source code defining it and the
+    repo modules it uses, so an edited feature never reads values stored by its
+    previous version
+
+    Args:
+        key (tuple): (name, frozen params)
+
+    Returns:
+        str: hex digest
+    """
+    src_fp: str = fingerprint_source(func=FEATURES[key[0]])
+    return _sha1(data=json.dumps([key, src_fp], default=str))
+
+
+class FeatureGraph:
+    """features of one dataset, every (name, params) node is computed once
+
+    features call each other through get, so shared intermediate nodes, e.g. the mid
+    price under the score of several strategies, are computed for the first caller
+    and served from memory to all the others. Values are aligned with base, the okx
+    and binance inner join that main passes to the custom functions.
+
+    computed nodes are also saved to the feature store in cache_dir, one .npy file
+    per node keyed by the node and the fingerprint of the venues it was computed
+    from, so reruns on the same data memory map them instead of computing them.
+    """
+
+    # venues of base, every feature depends on them
+    BASE_VENUES: tuple[str, ...] = ("okx", "binance")
+
+    def __init__(
+        self,
+        ctx,
+        cache_dir: str | None = FEATURE_CACHE_DIR,
+        max_mb: float = FEATURE_CACHE_MB,
+    ):
+        self.ctx = ctx
+        # feature store directory, features are only kept in memory if None
+        self.cache_dir: str | None = cache_dir
+        self.max_mb: float = max_mb
+        self.base: DataFrame = merge(
+            left=ctx.venue(exchange="okx")[["sym", "ts"]],
+            right=ctx.venue(exchange="binance")[["sym", "ts"]],
+            how="inner",
+            on=["sym", "ts"],
+        )
+        self._values: dict[tuple, np.ndarray] = {}
+        # {node: venues its value is computed from}
+        self._venues: dict[tuple, set[str]] = {}
+        # venues used by the nodes being computed, innermost last
+        self._stack: list[set[str]] = []
+        self._computing: set[tuple] = set()
+
+    def get(self, name: str, **params) -> np.ndarray:
+        """value of a feature, computed on first use
+
+        Args:
+            name (str): feature name
+            params: feature params
+
+        Returns:
+            np.ndarray: read only, one value per row of base, memory mapped if read
+            from the feature store
+        """
+        key: tuple = (name, _freeze(value=params))
+        if key not in self._values:
+            assert name in FEATURES, f"Unknown feature {name}"
+            assert key not in self._computing, f"Feature {key} depends on itself"
+            value: np.ndarray | None = self._load(key=key)
+            if value is None:
+                self._computing.add(key)
+                self._stack.append(set(self.BASE_VENUES))
+                try:
+                    value = np.asarray(FEATURES[name](self, **params), dtype=np.float64)
+                finally:
+                    self._computing.discard(key)
+                    self._venues[key] = self._stack.pop()
+                assert len(value) == len(
+                    self.base
+                ), f"Feature {name} not aligned with base"
+                self._save(key=key, value=value)
+            # shared by every strategy, must never be modified in place
+            value.flags.writeable = False
+            self._values[key] = value
+        if len(self._stack):
+            self._stack[-1] |= self._venues[key]
+        return self._values[key]
+
+    def venue_frame(self, exchange: str) -> DataFrame:
+        """venue columns for a feature, recorded as a dependency of the nodes being
+        computed
+
+        Args:
+            exchange (str): exchange
+
+        Returns:
+            DataFrame: ['sym', 'ts', '{exchange}_open_prc', '{exchange}_ret', '{exchange}_vol']
+        """
+        if len(self._stack):
+            self._stack[-1].add(exchange)
+        return self.ctx.venue(exchange=exchange)
+
+    def _load(self, key: tuple) -> np.ndarray | None:
+        """value of a node from the feature store, memory mapped
+
+        Args:
+            key (tuple): (name, frozen params)
+
+        Returns:
+            np.ndarray | None: value, None if not stored for this data
+        """
+        if self.cache_dir is None:
+            return None
+        prefix: str = _node_key(key=key)[:16]
+        for meta_fp in glob.glob(os.path.join(self.cache_dir, f"{prefix}_*.json")):
+            with open(file=meta_fp, mode="r") as fp:
+                venues: list[str] = json.load(fp=fp)
+            # stored from a venue that is not loaded, can't tell if it's the same data
+            if any(k not in self.ctx.prices for k in venues):
+                continue
+            stem: str = f"{prefix}_{self.ctx.fingerprint(venues=venues)[:16]}"
+            data_fp: str = os.path.join(self.cache_dir, f"{stem}.npy")
+            if not os.path.exists(path=data_fp):
+                continue
+            # touch the entry so it is the most recently used one
+            os.utime(path=data_fp)
+            self._venues[key] = set(venues)
+            return np.load(file=data_fp, mmap_mode="r")
+        return None
+
+    def _save(self, key: tuple, value: np.ndarray) -> None:
+        """save a computed node to the feature store
+
+        Args:
+            key (tuple): (name, frozen params)
+            value (np.ndarray): value
+        """
+        if self.cache_dir is None:
+            return
+        venues: list[str] = sorted(self._venues[key])
+        stem: str = "_".join(
+            [
+                _node_key(key=key)[:16],
+                self.ctx.fingerprint(venues=venues)[:16],
+            ]
+        )
+        data_fp: str = os.path.join(ensure_dir(fdir=self.cache_dir), f"{stem}.npy")
+        # write to a temp file first so a half written entry is never picked up
+        tmp_fp: str = f"{data_fp}.{os.getpid()}.tmp"
+        with open(file=tmp_fp, mode="wb") as fp:
+            np.save(file=fp, arr=value)
+        os.replace(src=tmp_fp, dst=data_fp)
+        with open(file=os.path.join(self.cache_dir, f"{stem}.json"), mode="w") as fp:
+            json.dump(obj=venues, fp=fp)
+        evict_lru(cache_dir=self.cache_dir, max_mb=self.max_mb, ext=".npy")
+
+    def source(self, spec: str | tuple[str, dict] | list) -> np.ndarray:
+        """value of a feature given as name or (name, params), how features refer to
+        their input
+
+        Args:
+            spec (str | tuple[str, dict] | list): feature name or (name, params)
+
+        Returns:
+            np.ndarray: feature value
+        """
+        if isinstance(spec, str):
+            return self.get(name=spec)
+        name, params = spec
+        return self.get(name, **params)
+
+    def assign(self, prc_df: DataFrame, columns: dict[str, Any]) -> DataFrame:
+        """add features as columns of prc_df
+
+        Args:
+            prc_df (DataFrame): ['sym', 'ts', others], same rows as base
+            columns (dict[str, Any]): {column: feature name or (name, params)}
+
+        Returns:
+            DataFrame: prc_df with the columns
+        """
+        assert len(prc_df) == len(self.base) and np.array_equal(
+            prc_df["ts"].values, self.base["ts"].values
+        ), "prc_df rows are not the rows of the feature graph"
+        for col, spec in columns.items():
+            prc_df[col] = np.array(self.source(spec=spec))
+        return prc_df
+
+
+"""
+price features
+"""
+
+
+@feature(name="venue")
+def venue(graph: FeatureGraph, exchange: str, field: str = "open_prc") -> np.ndarray:
+    """column of a venue, open_prc, ret or vol, NA where the venue has no bar"""
+    col: str = f"{exchange}_{field}"
+    return np.array(
+        merge(
+            left=graph.base,
+            right=graph.venue_frame(exchange=exchange)[["sym", "ts", col]],
+            how="left",
+            on=["sym", "ts"],
+        )[col]
+    )
+
+
+@feature(name="mid_prc")
+def mid_prc(graph: FeatureGraph, venues: list[str]) -> np.ndarray:
+    """mean open price of the venues"""
+    return sum(graph.get("venue", exchange=k) for k in venues) / len(venues)
+
+
+@feature(name="venue_dis")
+def venue_dis(graph: FeatureGraph, exchange: str, venues: list[str]) -> np.ndarray:
+    """relative distance between the open price of a venue and the mid price"""
+    mid: np.ndarray = graph.get("mid_prc", venues=venues)
+    return (graph.get("venue", exchange=exchange) - mid) / mid
+
+
+@feature(name="score")
+def score(graph: FeatureGraph, legs: list[str], venues: list[str]) -> np.ndarray:
+    """sum of the absolute distances of the legs to the mid price"""
+    return sum(np.abs(graph.get("venue_dis", exchange=k, venues=venues)) for k in legs)
+
+
+@feature(name="price_gap")
+def price_gap(graph: FeatureGraph, num: str, den: str) -> np.ndarray:
+    """absolute relative gap between the open prices of two venues"""
+    return np.abs(
+        graph.get("venue", exchange=num) / graph.get("venue", exchange=den) - 1
+    )
+
+
+"""
+rolling features, the window ends at the previous row, as rolling(closed="left")
+"""
+
+
+@feature(name="rolling_ewm")
+def rolling_ewm(
+    graph: FeatureGraph, source: Any, lookback: int, halflife: float
+) -> np.ndarray:
+    """ewm mean of the last value of each window, same as
+    rolling(lookback, closed="left").apply(lambda x: x.ewm(halflife).mean().iloc[-1])
+    but one matrix product instead of one python call per row"""
+    x: np.ndarray = graph.source(spec=source)
+    decay: float = 0.5 ** (1 / halflife)
+    # weight of each position of the window, the latest one has weight 1
+    weights: np.ndarray = decay ** np.arange(lookback - 1, -1, -1)
+    out: np.ndarray = np.full(len(x), np.nan)
+    if len(x) > lookback:
+        out[lookback:] = (
+            sliding_window_view(x=x[:-1], window_shape=lookback) @ weights
+        ) / weights.sum()
+    return out
+
+
+@feature(name="rolling_std")
+def rolling_std(graph: FeatureGraph, source: Any, lookback: int) -> np.ndarray:
+    """standard deviation of each window"""
+    return np.array(
+        Series(data=graph.source(spec=source))
+        .rolling(window=lookback, closed="left")
+        .std()
+    )
+
+
+@feature(name="rolling_quantile")
+def rolling_quantile(
+    graph: FeatureGraph, source: Any, window: int, q: float
+) -> np.ndarray:
+    """quantile of each window, linear interpolation as np.percentile"""
+    return np.array(
+        Series(data=graph.source(spec=source))
+        .rolling(window=window, closed="left")
+        .quantile(quantile=q)
+    )
+
+
+@feature(name="zscore")
+def zscore(
+    graph: FeatureGraph, source: Any, lookback: int, halflife: float
+) -> np.ndarray:
+    """distance of the value from the ewm mean of the previous window, in std"""
+    return (
+        graph.source(spec=source)
+        - graph.get("rolling_ewm", source=source, lookback=lookback, halflife=halflife)
+    ) / graph.get("rolling_std", source=source, lookback=lookback)
+
+
+"""
+hedge features, the regression of one series on another, e.g. venue open prices
+"""
+
+
+def _hedge_fit(
+    graph: FeatureGraph,
+    y: Any,
+    x: Any,
+    window: int | None,
+    halflife: float | None,
+) -> dict[str, np.ndarray]:
+    """rolling_ols over window or ewm_ols with halflife of the sources y and x"""
+    assert (window is None) != (halflife is None), "set one of window or halflife"
+    y_value: np.ndarray = graph.source(spec=y)
+    x_value: np.ndarray = graph.source(spec=x)
+    if window is not None:
+        return rolling_ols(y=y_value, x=x_value, window=window)
+    return ewm_ols(y=y_value, x=x_value, halflife=halflife)
+
+
+@feature(name="hedge_ratio")
+def hedge_ratio(
+    graph: FeatureGraph,
+    y: Any,
+    x: Any,
+    window: int | None = None,
+    halflife: float | None = None,
+) -> np.ndarray:
+    """units of x hedging one unit of y, estimated up to the previous row"""
+    beta: np.ndarray = _hedge_fit(
+        graph=graph, y=y, x=x, window=window, halflife=halflife
+    )["beta"]
+    return np.concatenate([[np.nan], beta[:-1]])
+
+
+@feature(name="hedge_residual")
+def hedge_residual(
+    graph: FeatureGraph,
+    y: Any,
+    x: Any,
+    window: int | None = None,
+    halflife: float | None = None,
+) -> np.ndarray:
+    """spread of y over its hedge by x estimated up to the previous row"""
+    fit: dict[str, np.ndarray] = _hedge_fit(
+        graph=graph, y=y, x=x, window=window, halflife=halflife
+    )
+    return hedge_spread(
+        y=graph.source(spec=y),
+        x=graph.source(spec=x),
+        alpha=fit["alpha"],
+        beta=fit["beta"],
+    )
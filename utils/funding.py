@@ -0,0 +1,229 @@
+from datetime import timezone
+from typing import Iterator, Literal
+
+import numpy as np
+import pandas as pd
+from pandas import DataFrame, Timedelta, Timestamp, to_datetime
+
+from utils.barstore import BarStore
+from utils.exchange import client
+from utils.loader import BAR_STORE
+from utils.log import logger
+from utils.valid import check_cols
+from utils.var import INTERVAL_MS_MAP
+
+# funding events are kept in the bar store under this timeframe, column funding_rate
+FUNDING_TIMEFRAME: str = "funding"
+
+# events per api request, the largest one each exchange allows
+FUNDING_LIMIT: dict[str, int] = {"okx": 100, "binance": 1000, "bybit": 200}
+
+# longer than any funding interval, bars this long without an event are warned about
+# since they are charged no funding
+FUNDING_MAX_GAP: Timedelta = Timedelta(days=1)
+
+# legs of the trade, {venue: side column}
+FUNDING_LEGS: dict[str, str] = {"binance": "binance_side", "okx": "okx_side"}
+
+
+def _ms(ts: Timestamp) -> int:
+    return int(ts.value // 10**6)
+
+
+def iter_funding(
+    stime: Timestamp,
+    etime: Timestamp,
+    exchange: Literal["okx", "binance", "bybit"],
+    symbol: str = "BTC/USDT:USDT",
+) -> Iterator[DataFrame]:
+    """fetch the funding rate history of a perpetual page by page
+
+    Args:
+        stime (Timestamp): start time
+        etime (Timestamp): end time, included
+        exchange (Literal[okx, binance, bybit]): cex
+        symbol (str, optional): ccxt symbol. Defaults to "BTC/USDT:USDT".
+
+    Yields:
+        Iterator[DataFrame]: ['sym', 'ts', 'funding_rate'], one dataframe per api
+        request
+    """
+    since: int = _ms(ts=stime)
+    end: int = _ms(ts=etime)
+    while since <= end:
+        with client(exchange=exchange) as cex:
+            response: list[dict] = cex.fetch_funding_rate_history(
+                symbol=symbol, since=since, limit=FUNDING_LIMIT.get(exchange, 100)
+            )
+        ts_ms: np.ndarray = np.array([k["timestamp"] for k in response], dtype=np.int64)
+        rate: np.ndarray = np.array(
+            [k["fundingRate"] for k in response], dtype=np.float64
+        )
+        keep: np.ndarray = (ts_ms >= since) & (ts_ms <= end)
+        if not keep.any():
+            break
+        yield DataFrame(
+            data={
+                "sym": symbol,
+                "ts": to_datetime(ts_ms[keep], unit="ms", utc=True),
+                "funding_rate": rate[keep],
+            }
+        )
+        if ts_ms.max() > end:
+            break
+        since = int(ts_ms[keep].max()) + 1
+
+
+def iter_stored_funding(
+    stime: Timestamp,
+    etime: Timestamp,
+    exchange: Literal["okx", "binance", "bybit"],
+    symbol: str = "BTC/USDT:USDT",
+    store: BarStore = BAR_STORE,
+) -> Iterator[DataFrame]:
+    """iter_funding through the bar store
+
+    events in the ranges the store covers are read from it, the ranges it doesn't
+    cover, before, between or after the stored ones, are fetched and written to the
+    store, so no funding event of the range is ever missed
+
+    Args:
+        stime (Timestamp): start time
+        etime (Timestamp): end time, included
+        exchange (Literal[okx, binance, bybit]): cex
+        symbol (str, optional): ccxt symbol. Defaults to "BTC/USDT:USDT".
+        store (BarStore, optional): bar store. Defaults to BAR_STORE.
+
+    Yields:
+        Iterator[DataFrame]: ['sym', 'ts', 'funding_rate']
+    """
+    yield from store.iter_through(
+        exchange=exchange,
+        symbol=symbol,
+        timeframe=FUNDING_TIMEFRAME,
+        stime=stime,
+        etime=etime,
+        fetch=lambda s, e: iter_funding(
+            stime=s, etime=e, exchange=exchange, symbol=symbol
+        ),
+        # events are settled once published, every one up to now can be stored
+        complete=Timestamp.now(tz=timezone.utc),
+    )
+
+
+def load_funding(
+    stime: Timestamp,
+    etime: Timestamp,
+    exchange: Literal["okx", "binance", "bybit"],
+    symbols: list[str] = ["BTC/USDT:USDT"],
+    use_store: bool = True,
+) -> DataFrame:
+    """get the funding rate history of perpetuals
+
+    Args:
+        stime (Timestamp): start time
+        etime (Timestamp): end time, included
+        exchange (Literal[okx, binance, bybit]): cex
+        symbols (list[str], optional): ccxt symbols. Defaults to ["BTC/USDT:USDT"].
+        use_store (bool, optional): read and save events in BAR_STORE. Defaults to True.
+
+    Returns:
+        DataFrame: ['sym', 'ts', 'funding_rate'], one row per funding event
+    """
+    funding_list: list[DataFrame] = [DataFrame(columns=["sym", "ts", "funding_rate"])]
+    for symbol in symbols:
+        funding_list.extend(
+            (iter_stored_funding if use_store else iter_funding)(
+                stime=stime, etime=etime, exchange=exchange, symbol=symbol
+            )
+        )
+    funding_df: DataFrame = pd.concat(objs=funding_list, ignore_index=True)
+    funding_df = funding_df.drop_duplicates(subset=["sym", "ts"])
+    return funding_df.sort_values(by=["sym", "ts"], ignore_index=True)
+
+
+def accrue_funding(
+    ts_ms: np.ndarray,
+    side: np.ndarray,
+    event_ms: np.ndarray,
+    rate: np.ndarray,
+    interval_ms: int,
+) -> np.ndarray:
+    """funding paid by a position at each bar, as return
+
+    as of join of the events on the bars, an event at time t is paid by the side of
+    the bar with ts <= t < ts + interval, a long pays a positive rate and a short
+    receives it. One binary search for all the events and one bincount, no loop.
+
+    Args:
+        ts_ms (np.ndarray): int64 ms open time of each bar, increasing
+        side (np.ndarray): position of each bar
+        event_ms (np.ndarray): int64 ms time of each funding event
+        rate (np.ndarray): funding rate of each event
+        interval_ms (int): bar length in ms
+
+    Returns:
+        np.ndarray: funding paid at each bar, negative when received
+    """
+    bar: np.ndarray = np.searchsorted(ts_ms, event_ms, side="right") - 1
+    inside: np.ndarray = bar >= 0
+    inside[inside] = event_ms[inside] < ts_ms[bar[inside]] + interval_ms
+    rate_sum: np.ndarray = np.bincount(
+        bar[inside], weights=rate[inside], minlength=len(ts_ms)
+    )
+    return np.asarray(side, dtype=np.float64) * rate_sum
+
+
+def funding_cost(
+    prc_df: DataFrame,
+    ctx,
+    legs: dict[str, str] = FUNDING_LEGS,
+) -> DataFrame:
+    """funding paid by the sides of each venue, as return deducted at each bar
+
+    Args:
+        prc_df (DataFrame): ['sym', 'ts', side columns of legs]
+        ctx (DataContext): data context serving the funding rates
+        legs (dict[str, str], optional): {venue: side column}. Defaults to FUNDING_LEGS.
+
+    Returns:
+        DataFrame: ['{venue}_funding' for each venue, 'funding'], aligned with prc_df
+    """
+    check_cols(
+        df=prc_df, cols=["sym", "ts"] + list(legs.values()), checkRedundancy=False
+    )
+    interval_ms: int = INTERVAL_MS_MAP[ctx.timeframe]
+    ts_ms: np.ndarray = prc_df["ts"].values.astype("datetime64[ms]").astype(np.int64)
+    cost_df: DataFrame = DataFrame(index=prc_df.index)
+    cost_df["funding"] = 0.0
+    for venue, side_col in legs.items():
+        funding_df: DataFrame = ctx.funding(exchange=venue)
+        cost: np.ndarray = np.zeros(len(prc_df))
+        # bars and events of each symbol, rows of prc_df are in ts order per symbol
+        for sym, rows in prc_df.groupby(by="sym", sort=False).indices.items():
+            events: DataFrame = funding_df[funding_df["sym"] == sym]
+            event_ms: np.ndarray = (
+                events["ts"].values.astype("datetime64[ms]").astype(np.int64)
+            )
+            gap_ms: int = int(
+                np.diff(
+                    np.concatenate(
+                        [ts_ms[rows[:1]], event_ms, ts_ms[rows[-1:]] + interval_ms]
+                    )
+                ).max()
+            )
+            if gap_ms > FUNDING_MAX_GAP / Timedelta(milliseconds=1):
+                logger.warning(
+                    msg=f"No {venue} funding event of {sym} for"
+                    f" {Timedelta(milliseconds=gap_ms)}, no funding is charged then"
+                )
+            cost[rows] = accrue_funding(
+                ts_ms=ts_ms[rows],
+                side=np.array(prc_df[side_col])[rows],
+                event_ms=event_ms,
+                rate=np.array(events["funding_rate"], dtype=np.float64),
+                interval_ms=interval_ms,
+            )
+        cost_df[f"{venue}_funding"] = cost
+        cost_df["funding"] += cost
+    return cost_df
@@ -0,0 +1,149 @@
+import numpy as np
+from pandas import DataFrame
+
+
+def _window_sum(x: np.ndarray, window: int) -> np.ndarray:
+    """sum of x over the trailing window along the last axis, NaN before the first
+    full window"""
+    cs: np.ndarray = np.concatenate(
+        [np.zeros(x.shape[:-1] + (1,)), np.cumsum(x, axis=-1)], axis=-1
+    )
+    out: np.ndarray = np.full(x.shape, np.nan)
+    out[..., window - 1 :] = cs[..., window:] - cs[..., : x.shape[-1] - window + 1]
+    return out
+
+
+def _centre(y: np.ndarray, x: np.ndarray) -> tuple[np.ndarray, ...]:
+    """y and x centred on their mean, 0 where either is NaN
+
+    Returns:
+        tuple[np.ndarray, ...]: centred y, centred x, valid pairs, mean of y, mean of x
+    """
+    y = np.asarray(y, dtype=np.float64)
+    x = np.asarray(x, dtype=np.float64)
+    assert y.shape == x.shape, "y and x must have the same shape"
+    valid: np.ndarray = ~np.isnan(y) & ~np.isnan(x)
+    with np.errstate(invalid="ignore"):
+        y_mean: np.ndarray = np.nanmean(np.where(valid, y, np.nan), -1, keepdims=True)
+        x_mean: np.ndarray = np.nanmean(np.where(valid, x, np.nan), -1, keepdims=True)
+    return (
+        np.where(valid, y - y_mean, 0.0),
+        np.where(valid, x - x_mean, 0.0),
+        valid,
+        y_mean,
+        x_mean,
+    )
+
+
+def _solve(
+    n: np.ndarray,
+    sx: np.ndarray,
+    sy: np.ndarray,
+    sxx: np.ndarray,
+    sxy: np.ndarray,
+    y_mean: np.ndarray,
+    x_mean: np.ndarray,
+) -> dict[str, np.ndarray]:
+    """alpha and beta of y = alpha + beta * x from the window sums of the centred
+    data, NaN with less than 2 points or without any variance of x"""
+    with np.errstate(divide="ignore", invalid="ignore"):
+        var: np.ndarray = sxx - sx**2 / n
+        beta: np.ndarray = np.where(
+            (n >= 2) & (var > 0), (sxy - sx * sy / n) / var, np.nan
+        )
+        alpha: np.ndarray = (sy - beta * sx) / n + y_mean - beta * x_mean
+    return {"alpha": alpha, "beta": beta}
+
+
+def rolling_ols(y: np.ndarray, x: np.ndarray, window: int) -> dict[str, np.ndarray]:
+    """ols of y on x over the trailing window of every bar, O(1) per bar
+
+    the sums of x, y, x^2 and x*y over a window are differences of cumulative sums,
+    no window is visited element by element. Leading axes are batched, e.g. one row
+    per venue pair. Bars where y or x is NaN are left out of the windows.
+
+    Args:
+        y (np.ndarray): (..., n) hedged series, e.g. binance open price
+        x (np.ndarray): (..., n) hedging series, e.g. okx open price
+        window (int): window length in bars, the bar itself included
+
+    Returns:
+        dict[str, np.ndarray]: {alpha, beta}, (..., n) each, NaN before the first
+        full window
+    """
+    assert window >= 2, "window must have at least 2 bars"
+    yc, xc, valid, y_mean, x_mean = _centre(y=y, x=x)
+    return _solve(
+        n=_window_sum(x=valid.astype(np.float64), window=window),
+        sx=_window_sum(x=xc, window=window),
+        sy=_window_sum(x=yc, window=window),
+        sxx=_window_sum(x=xc**2, window=window),
+        sxy=_window_sum(x=xc * yc, window=window),
+        y_mean=y_mean,
+        x_mean=x_mean,
+    )
+
+
+def ewm_ols(
+    y: np.ndarray, x: np.ndarray, halflife: float, min_periods: int = 2
+) -> dict[str, np.ndarray]:
+    """exponentially weighted least squares of y on x, the adaptive hedge ratio a
+    kalman filter with a random walk beta settles to
+
+    the weighted sums are updated once per bar by the ewm of pandas, every series of
+    the batch in one call. Bars where y or x is NaN are skipped.
+
+    Args:
+        y (np.ndarray): (..., n) hedged series
+        x (np.ndarray): (..., n) hedging series
+        halflife (float): halflife of the weights in bars
+        min_periods (int, optional): bars needed before a first estimate. Defaults to 2.
+
+    Returns:
+        dict[str, np.ndarray]: {alpha, beta}, (..., n) each
+    """
+    yc, xc, valid, y_mean, x_mean = _centre(y=y, x=x)
+    shape: tuple = yc.shape
+    # weighted means of x, y, x^2 and x*y, one column per series
+    means: dict[str, np.ndarray] = {}
+    for name, value in {"x": xc, "y": yc, "xx": xc**2, "xy": xc * yc}.items():
+        frame: DataFrame = DataFrame(
+            data=np.where(valid, value, np.nan).reshape(-1, shape[-1]).T
+        )
+        means[name] = (
+            frame.ewm(halflife=halflife, min_periods=min_periods, ignore_na=True)
+            .mean()
+            .to_numpy()
+            .T.reshape(shape)
+        )
+    with np.errstate(divide="ignore", invalid="ignore"):
+        var: np.ndarray = means["xx"] - means["x"] ** 2
+        beta: np.ndarray = np.where(
+            var > 0, (means["xy"] - means["x"] * means["y"]) / var, np.nan
+        )
+    return {
+        "alpha": means["y"] - beta * means["x"] + y_mean - beta * x_mean,
+        "beta": beta,
+    }
+
+
+def hedge_spread(
+    y: np.ndarray, x: np.ndarray, alpha: np.ndarray, beta: np.ndarray
+) -> np.ndarray:
+    """residual of y against the hedge estimated up to the previous bar,
+    y - alpha - beta * x with the alpha and beta of one bar before, so the spread of a
+    bar never uses the bar itself
+
+    Args:
+        y (np.ndarray): (..., n) hedged series
+        x (np.ndarray): (..., n) hedging series
+        alpha (np.ndarray): (..., n) from rolling_ols or ewm_ols
+        beta (np.ndarray): (..., n) from rolling_ols or ewm_ols
+
+    Returns:
+        np.ndarray: (..., n) residual spread, NaN on the first bar
+    """
+    nan: np.ndarray = np.full(alpha.shape[:-1] + (1,), np.nan)
+    prev_alpha: np.ndarray = np.concatenate([nan, alpha[..., :-1]], axis=-1)
+    prev_beta: np.ndarray = np.concatenate([nan, beta[..., :-1]], axis=-1)
+    return np.asarray(y) - prev_alpha - prev_beta * np.asarray(x)
@@ -0,0 +1,197 @@
+from itertools import combinations
+
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+from pandas import DataFrame
+
+
+def _xcorr_sum(a: np.ndarray, b: np.ndarray, max_lag: int) -> np.ndarray:
+    """sum over t of a[..., t] * b[..., t + lag] for lag in [-max_lag, max_lag], by fft
+
+    Args:
+        a (np.ndarray): (..., n)
+        b (np.ndarray): (..., n)
+        max_lag (int): max lag
+
+    Returns:
+        np.ndarray: (..., 2 * max_lag + 1), lag -max_lag first
+    """
+    n: int = a.shape[-1]
+    # zero padding past n + max_lag keeps the circular correlation from wrapping
+    nfft: int = 1 << int(np.ceil(np.log2(n + max_lag)))
+    full: np.ndarray = np.fft.irfft(
+        np.conj(np.fft.rfft(a, n=nfft)) * np.fft.rfft(b, n=nfft), n=nfft
+    )
+    # positive lags at the start of the circular result, negative ones at the end
+    return np.concatenate([full[..., nfft - max_lag :], full[..., : max_lag + 1]], -1)
+
+
+def cross_correlation(x: np.ndarray, y: np.ndarray, max_lag: int) -> np.ndarray:
+    """correlation of x[t] and y[t + lag] for every lag at once, O(n log n)
+
+    a peak at a positive lag means x leads y. NaN are left out, the covariance at each
+    lag is averaged over the pairs where both are present, and scaled by the std of
+    x and y over the whole series. Leading axes are batched, e.g. one row per
+    symbol, pair or window, all in one fft.
+
+    Args:
+        x (np.ndarray): (..., n) returns
+        y (np.ndarray): (..., n) returns
+        max_lag (int): max lag in bars, both directions
+
+    Returns:
+        np.ndarray: (..., 2 * max_lag + 1) correlation, lag -max_lag first, NaN
+        without any overlapping pair
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    assert x.shape == y.shape, "x and y must have the same shape"
+    assert 0 <= max_lag < x.shape[-1], "max_lag must be shorter than the series"
+    x_valid: np.ndarray = ~np.isnan(x)
+    y_valid: np.ndarray = ~np.isnan(y)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        x_demeaned: np.ndarray = np.where(
+            x_valid, x - np.nanmean(x, axis=-1, keepdims=True), 0.0
+        )
+        y_demeaned: np.ndarray = np.where(
+            y_valid, y - np.nanmean(y, axis=-1, keepdims=True), 0.0
+        )
+        x_std: np.ndarray = np.sqrt(
+            (x_demeaned**2).sum(axis=-1, keepdims=True)
+            / x_valid.sum(-1, keepdims=True)
+        )
+        y_std: np.ndarray = np.sqrt(
+            (y_demeaned**2).sum(axis=-1, keepdims=True)
+            / y_valid.sum(-1, keepdims=True)
+        )
+        # number of pairs present at each lag, the same correlation on the masks
+        count: np.ndarray = np.round(
+            _xcorr_sum(
+                a=x_valid.astype(np.float64),
+                b=y_valid.astype(np.float64),
+                max_lag=max_lag,
+            )
+        )
+        cov: np.ndarray = (
+            _xcorr_sum(a=x_demeaned, b=y_demeaned, max_lag=max_lag) / count
+        )
+        return np.where(count > 0, cov / (x_std * y_std), np.nan)
+
+
+def rolling_cross_correlation(
+    x: np.ndarray,
+    y: np.ndarray,
+    max_lag: int,
+    window: int,
+    step: int | None = None,
+) -> np.ndarray:
+    """cross_correlation of the trailing windows, every window in one batched fft
+
+    Args:
+        x (np.ndarray): (..., n) returns
+        y (np.ndarray): (..., n) returns
+        max_lag (int): max lag in bars
+        window (int): window length in bars
+        step (int | None, optional): bars between the ends of two windows. Defaults
+        to window, windows not overlapping.
+
+    Returns:
+        np.ndarray: (..., windows, 2 * max_lag + 1), the window i ends at bar
+        window - 1 + i * step
+    """
+    step = step or window
+    assert window > max_lag, "window must be longer than max_lag"
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    if x.shape[-1] < window:
+        return np.empty(x.shape[:-1] + (0, 2 * max_lag + 1))
+    # views, the windows are only copied by the fft
+    x_windows: np.ndarray = sliding_window_view(x=x, window_shape=window, axis=-1)
+    y_windows: np.ndarray = sliding_window_view(x=y, window_shape=window, axis=-1)
+    return cross_correlation(
+        x=x_windows[..., ::step, :], y=y_windows[..., ::step, :], max_lag=max_lag
+    )
+
+
+def lag_profile(
+    ctx,
+    venues: list[str],
+    max_lag: int,
+    window: int | None = None,
+    step: int | None = None,
+) -> DataFrame:
+    """lead lag profile between the returns of every pair of venues and symbol
+
+    the returns are the venue columns of the feature graph, aligned on the rows main
+    passes to the custom functions, so a strategy can read the profile of its own
+    data, e.g. best_lag(lag_profile(ctx=ctx, venues=..., max_lag=...)). All the pairs
+    of a symbol, and all their windows if rolling, go through one batched fft.
+
+    Args:
+        ctx (DataContext): data of the backtest, every venue loaded
+        venues (list[str]): venues, e.g. ['okx', 'binance', 'bybit']
+        max_lag (int): max lag in bars
+        window (int | None, optional): window length in bars, whole sample if None.
+        Defaults to None.
+        step (int | None, optional): see rolling_cross_correlation. Defaults to None.
+
+    Returns:
+        DataFrame: ['sym', 'x', 'y', 'lag', 'corr'] plus 'ts', the last bar of the
+        window, if rolling. corr of x[t] and y[t + lag], a positive lag means x leads
+    """
+    graph = ctx.features
+    ret: dict[str, np.ndarray] = {
+        k: np.array(graph.get("venue", exchange=k, field="ret")) for k in venues
+    }
+    pairs: list[tuple[str, str]] = list(combinations(venues, 2))
+    lags: np.ndarray = np.arange(-max_lag, max_lag + 1)
+    profiles: list[DataFrame] = []
+    for sym, rows in graph.base.groupby(by="sym", sort=False).indices.items():
+        x: np.ndarray = np.stack([ret[a][rows] for a, _ in pairs])
+        y: np.ndarray = np.stack([ret[b][rows] for _, b in pairs])
+        if window is None:
+            # (pairs, windows, lags), the whole sample is one window
+            corr: np.ndarray = cross_correlation(x=x, y=y, max_lag=max_lag)[:, None]
+            ts: np.ndarray = np.array(graph.base["ts"].iloc[rows[-1:]])
+        else:
+            step = step or window
+            corr = rolling_cross_correlation(
+                x=x, y=y, max_lag=max_lag, window=window, step=step
+            )
+            ts = np.array(graph.base["ts"].iloc[rows[window - 1 :: step]])
+        n_pairs, n_windows, n_lags = corr.shape
+        profile_df: DataFrame = DataFrame(
+            data={
+                "sym": sym,
+                "x": np.repeat([a for a, _ in pairs], n_windows * n_lags),
+                "y": np.repeat([b for _, b in pairs], n_windows * n_lags),
+                "ts": np.tile(np.repeat(ts, n_lags), n_pairs),
+                "lag": np.tile(lags, n_pairs * n_windows),
+                "corr": corr.ravel(),
+            }
+        )
+        profiles.append(profile_df)
+    profile_df = pd.concat(objs=profiles, ignore_index=True)
+    return profile_df if window else profile_df.drop(columns=["ts"])
+
+
+def best_lag(profile_df: DataFrame) -> DataFrame:
+    """lag of the strongest correlation of each pair, from a lag profile
+
+    Args:
+        profile_df (DataFrame): from lag_profile
+
+    Returns:
+        DataFrame: ['sym', 'x', 'y', ('ts'), 'lag', 'corr', 'corr_0'], corr at the
+        lag with the largest absolute correlation, corr_0 at lag 0
+    """
+    keys: list[str] = [k for k in ["sym", "x", "y", "ts"] if k in profile_df.columns]
+    valid_df: DataFrame = profile_df.dropna(subset=["corr"])
+    best_df: DataFrame = valid_df.loc[
+        valid_df["corr"].abs().groupby([valid_df[k] for k in keys]).idxmax()
+    ]
+    corr_0: DataFrame = profile_df.loc[profile_df["lag"] == 0, keys + ["corr"]]
+    return best_df.merge(
+        right=corr_0.rename(columns={"corr": "corr_0"}), how="left", on=keys
+    ).reset_index(drop=True)
@@ -0,0 +1,258 @@
+import hashlib
+import json
+import os
+import sqlite3
+from datetime import datetime, timezone
+from typing import Any
+
+import numpy as np
+import pandas as pd
+from pandas import DataFrame
+
+from utils.var import LEDGER_FP, RETURNS_DIR, ensure_dir
+
+# config keys that only control how a run is executed, not its result
+IGNORED_CFG_KEYS: tuple[str, ...] = (
+    "callback_cache",
+    "feature_cache",
+    "report",
+    "skip_if_computed",
+    "append",
+    "append_warmup",
+)
+
+SCHEMA: str = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    run_key TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    file TEXT,
+    ccxt_sym TEXT,
+    timeframe TEXT,
+    sdate TEXT,
+    edate TEXT,
+    data_fp TEXT,
+    cfg TEXT,
+    drawdown TEXT,
+    timings TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_runs_key ON runs (run_key);
+CREATE INDEX IF NOT EXISTS idx_runs_sym ON runs (ccxt_sym, timeframe);
+CREATE TABLE IF NOT EXISTS metrics (
+    run_id INTEGER NOT NULL REFERENCES runs (run_id),
+    name TEXT NOT NULL,
+    value REAL,
+    PRIMARY KEY (run_id, name)
+);
+CREATE INDEX IF NOT EXISTS idx_metrics_name ON metrics (name, value);
+"""
+
+
+def _connect(db_fp: str) -> sqlite3.Connection:
+    ensure_dir(fdir=os.path.dirname(p=db_fp))
+    # batch runs write from several processes, wait for the lock instead of failing
+    conn: sqlite3.Connection = sqlite3.connect(database=db_fp, timeout=60)
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def _dump(value: Any) -> str:
+    return json.dumps(value, default=str, sort_keys=True)
+
+
+def calc_run_key(cfg: dict, data_fp: str, src_fp: str) -> str:
+    """identify a run by its config, the fingerprint of its input data and the
+    source code of its strategy
+
+    Args:
+        cfg (dict): config dict
+        data_fp (str): fingerprint of the input data
+        src_fp (str): fingerprint of the strategy code, from
+        utils.cache.fingerprint_source
+
+    Returns:
+        str: hex digest
+    """
+    inputs: dict = {k: v for k, v in cfg.items() if k not in IGNORED_CFG_KEYS}
+    return hashlib.sha1(_dump([inputs, data_fp, src_fp]).encode()).hexdigest()
+
+
+def record_run(
+    cfg: dict,
+    data_fp: str,
+    src_fp: str,
+    metrics: dict[str, float],
+    drawdown: DataFrame,
+    timings: dict[str, float],
+    db_fp: str = LEDGER_FP,
+) -> int:
+    """append a run to the ledger
+
+    Args:
+        cfg (dict): config dict
+        data_fp (str): fingerprint of the input data
+        src_fp (str): fingerprint of the strategy code
+        metrics (dict[str, float]): performance metrics, {name: value}
+        drawdown (DataFrame): top drawdowns
+        timings (dict[str, float]): seconds spent in each step, {step: seconds}
+        db_fp (str, optional): ledger file path. Defaults to LEDGER_FP.
+
+    Returns:
+        int: run_id
+    """
+    with _connect(db_fp=db_fp) as conn:
+        cur: sqlite3.Cursor = conn.execute(
+            """
+            INSERT INTO runs (run_key, created_at, file, ccxt_sym, timeframe, sdate,
+                edate, data_fp, cfg, drawdown, timings)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            (
+                calc_run_key(cfg=cfg, data_fp=data_fp, src_fp=src_fp),
+                datetime.now(tz=timezone.utc).isoformat(),
+                cfg.get("file"),
+                cfg.get("ccxt_sym"),
+                cfg.get("timeframe"),
+                str(cfg.get("sdate")),
+                str(cfg.get("edate")),
+                data_fp,
+                _dump(cfg),
+                drawdown.to_json(orient="records", date_format="iso"),
+                _dump(timings),
+            ),
+        )
+        run_id: int = int(cur.lastrowid)  # type: ignore
+        conn.executemany(
+            "INSERT INTO metrics (run_id, name, value) VALUES (?, ?, ?)",
+            [(run_id, k, float(v)) for k, v in metrics.items()],
+        )
+    conn.close()
+    return run_id
+
+
+def find_run(
+    cfg: dict, data_fp: str, src_fp: str, db_fp: str = LEDGER_FP
+) -> int | None:
+    """find the latest run with exactly the same inputs
+
+    Args:
+        cfg (dict): config dict
+        data_fp (str): fingerprint of the input data
+        src_fp (str): fingerprint of the strategy code
+        db_fp (str, optional): ledger file path. Defaults to LEDGER_FP.
+
+    Returns:
+        int | None: run_id, None if the inputs have never been run
+    """
+    with _connect(db_fp=db_fp) as conn:
+        row: tuple | None = conn.execute(
+            "SELECT MAX(run_id) FROM runs WHERE run_key = ?",
+            (calc_run_key(cfg=cfg, data_fp=data_fp, src_fp=src_fp),),
+        ).fetchone()
+    conn.close()
+    return None if row is None or row[0] is None else int(row[0])
+
+
+def query_runs(
+    where: str = "",
+    params: tuple = (),
+    limit: int | None = None,
+    db_fp: str = LEDGER_FP,
+) -> DataFrame:
+    """query runs with their metrics as columns
+
+    Args:
+        where (str, optional): sql condition on the runs table and the metric columns,
+        e.g. "ccxt_sym = ? AND annual_sr > ?". Defaults to "".
+        params (tuple, optional): parameters of the where condition. Defaults to ().
+        limit (int | None, optional): max number of runs, latest first. Defaults to None.
+        db_fp (str, optional): ledger file path. Defaults to LEDGER_FP.
+
+    Returns:
+        DataFrame: [run_id, run_key, created_at, ..., metric names]
+    """
+    with _connect(db_fp=db_fp) as conn:
+        names: list[str] = [
+            row[0]
+            for row in conn.execute("SELECT DISTINCT name FROM metrics ORDER BY name")
+        ]
+        # pivot metrics to columns so they can be used in the where condition
+        pivot: str = ", ".join(
+            [
+                f"MAX(CASE WHEN m.name = '{k}' THEN m.value END) AS \"{k}\""
+                for k in names
+            ]
+        )
+        sql: str = f"""
+            SELECT * FROM (
+                SELECT r.*{', ' + pivot if pivot else ''}
+                FROM runs r LEFT JOIN metrics m ON r.run_id = m.run_id
+                GROUP BY r.run_id
+            )
+            {'WHERE ' + where if where else ''}
+            ORDER BY run_id DESC
+            {'LIMIT ' + str(int(limit)) if limit is not None else ''}
+        """
+        df: DataFrame = pd.read_sql_query(sql=sql, con=conn, params=params)
+    conn.close()
+    return df
+
+
+def save_returns(
+    run_id: int,
+    ts: np.ndarray,
+    adj_ret: np.ndarray,
+    series: dict[str, np.ndarray] | None = None,
+    returns_dir: str = RETURNS_DIR,
+) -> None:
+    """save the fee adjusted return series of a run, read back by load_returns
+
+    Args:
+        run_id (int): run_id in the ledger
+        ts (np.ndarray): time of each bar
+        adj_ret (np.ndarray): fee adjusted return of each bar
+        series (dict[str, np.ndarray] | None, optional): other series of each bar,
+        e.g. ret and binance_side, read back by load_run_series. Defaults to None.
+        returns_dir (str, optional): returns directory. Defaults to RETURNS_DIR.
+    """
+    fp: str = os.path.join(ensure_dir(fdir=returns_dir), f"{run_id}.parquet")
+    tmp_fp: str = f"{fp}.{os.getpid()}.tmp"
+    DataFrame(data={"ts": ts, "adj_ret": adj_ret, **(series or {})}).to_parquet(
+        path=tmp_fp, index=False
+    )
+    os.replace(src=tmp_fp, dst=fp)
+
+
+def load_run_series(run_id: int, returns_dir: str = RETURNS_DIR) -> DataFrame:
+    """every series saved with the returns of a run
+
+    Args:
+        run_id (int): run_id in the ledger
+        returns_dir (str, optional): returns directory. Defaults to RETURNS_DIR.
+
+    Returns:
+        DataFrame: ['ts', 'adj_ret', series saved by save_returns]
+    """
+    fp: str = os.path.join(returns_dir, f"{run_id}.parquet")
+    assert os.path.exists(path=fp), f"No returns saved for run {run_id}"
+    return pd.read_parquet(path=fp)
+
+
+def load_returns(run_ids: list[int], returns_dir: str = RETURNS_DIR) -> DataFrame:
+    """fee adjusted return series of runs aligned on time
+
+    Args:
+        run_ids (list[int]): run_ids in the ledger
+        returns_dir (str, optional): returns directory. Defaults to RETURNS_DIR.
+
+    Returns:
+        DataFrame: index ts, one column per run_id, NA where a run has no bar
+    """
+    series: dict[int, pd.Series] = {}
+    for run_id in run_ids:
+        fp: str = os.path.join(returns_dir, f"{run_id}.parquet")
+        assert os.path.exists(path=fp), f"No returns saved for run {run_id}"
+        series[run_id] = pd.read_parquet(path=fp, columns=["ts", "adj_ret"]).set_index(
+            keys="ts"
+        )["adj_ret"]
+    return pd.concat(objs=series, axis=1).sort_index()
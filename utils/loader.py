@@ -1,32 +1,39 @@
 import math
-from typing import Literal
+from datetime import timezone
+from typing import Iterator, Literal
 
-import ccxt
 import pandas as pd
 from pandas import DataFrame, Timedelta, Timestamp, to_datetime
 
+from utils.barstore import BarStore
 from utils.dframe import padding_id_time
+from utils.exchange import client
+from utils.resample import resample_ohlcv
 from utils.var import INTERVAL_MS_MAP
 
+# bars fetched from the cex are kept here and served again without any request
+BAR_STORE: BarStore = BarStore()
 
-def load_price(
+
+def iter_price(
     stime: Timestamp,
     etime: Timestamp,
     exchange: Literal["okx", "binance", "bybit"],
-    symbols: list[str] = ["BTC/USDT:USDT"],
+    symbol: str = "BTC/USDT:USDT",
     timeframe: str = "15m",
-) -> DataFrame:
-    """get cex price, may have NA
+) -> Iterator[DataFrame]:
+    """fetch cex price page by page, without padding missing data
 
     Args:
         stime (Timestamp): start time
         etime (Timestamp): end time
-        exchange (Literal[bybit, binance]): cex
-        symbols (list[str], optional): ccxt symbols. Defaults to ["BTC/USDT:USDT"].
+        exchange (Literal[okx, binance, bybit]): cex
+        symbol (str, optional): ccxt symbol. Defaults to "BTC/USDT:USDT".
         timeframe (str, optional): timeframe. Defaults to "15m".
 
-    Returns:
-        DataFrame: ['sym', 'ts', 'open', 'high', 'low', 'close', 'volume']
+    Yields:
+        Iterator[DataFrame]: ['sym', 'ts', 'open', 'high', 'low', 'close', 'volume'],
+        one dataframe per api request
     """
 
     """
@@ -43,7 +50,7 @@ def load_price(
     assert etime >= stime
 
     """
-    2. set query limit and exchange object
+    2. set query limit
     """
     data_count: int = math.ceil((etime - stime) / interval_ts) + 1
     # different exchange has different rate limit, try to use the largest available one
@@ -51,51 +58,120 @@ def load_price(
     if data_count < LIMIT:
         LIMIT = data_count
     call_times: int = math.ceil(data_count / LIMIT)
-    cex: ccxt.Exchange = eval(f"ccxt.{exchange}()")
 
     """
-    3. prepare parameters for api requests
+    3. make api requests
     """
-    params: list[tuple[Timestamp, Timestamp]] = [
-        (
-            stime + k * interval_ts * LIMIT,
-            stime + (k + 1) * interval_ts * LIMIT,
+    # s is pandas Timestamp object
+    # Timestamp.value is in nano second
+    # fetch_ohlcv 'since' parameter take integer millisecond
+    for k in range(call_times):
+        s: Timestamp = stime + k * interval_ts * LIMIT
+        with client(exchange=exchange) as cex:
+            response: list[list] = cex.fetch_ohlcv(
+                symbol=symbol,
+                timeframe=timeframe,
+                limit=LIMIT,
+                since=int(s.value / 1e6),
+            )
+        page_df: DataFrame = DataFrame(
+            data=[_[0:6] for _ in response],
+            columns=["ts_ms", "open", "high", "low", "close", "volume"],
         )
-        for k in range(call_times)
-    ]
+        page_df["ts"] = to_datetime(page_df["ts_ms"], unit="ms", utc=True)
+        page_df["sym"] = symbol
+        page_df.drop(columns=["ts_ms"], inplace=True)
+        yield page_df
+
+
+def iter_stored_price(
+    stime: Timestamp,
+    etime: Timestamp,
+    exchange: Literal["okx", "binance", "bybit"],
+    symbol: str = "BTC/USDT:USDT",
+    timeframe: str = "15m",
+    store: BarStore = BAR_STORE,
+) -> Iterator[DataFrame]:
+    """iter_price through the bar store
+
+    bars in the ranges the store covers are read from it, the ranges it doesn't
+    cover, before, between or after the stored ones, are fetched, and the complete
+    fetched bars are written to the store
 
+    Args:
+        stime (Timestamp): start time
+        etime (Timestamp): end time
+        exchange (Literal[okx, binance, bybit]): cex
+        symbol (str, optional): ccxt symbol. Defaults to "BTC/USDT:USDT".
+        timeframe (str, optional): timeframe. Defaults to "15m".
+        store (BarStore, optional): bar store. Defaults to BAR_STORE.
+
+    Yields:
+        Iterator[DataFrame]: ['sym', 'ts', 'open', 'high', 'low', 'close', 'volume']
     """
-    4. make api requests and check
+    interval_ts: Timedelta = Timedelta(
+        value=INTERVAL_MS_MAP[timeframe],
+        unit="millisecond",
+    )
+    yield from store.iter_through(
+        exchange=exchange,
+        symbol=symbol,
+        timeframe=timeframe,
+        stime=stime,
+        etime=etime,
+        fetch=lambda s, e: iter_price(
+            stime=s, etime=e, exchange=exchange, symbol=symbol, timeframe=timeframe
+        ),
+        # the current bar is still changing, don't store it
+        complete=Timestamp.now(tz=timezone.utc) - interval_ts,
+        step_ms=INTERVAL_MS_MAP[timeframe],
+    )
+
+
+def load_price(
+    stime: Timestamp,
+    etime: Timestamp,
+    exchange: Literal["okx", "binance", "bybit"],
+    symbols: list[str] = ["BTC/USDT:USDT"],
+    timeframe: str = "15m",
+    use_store: bool = True,
+) -> DataFrame:
+    """get cex price, may have NA
+
+    Args:
+        stime (Timestamp): start time
+        etime (Timestamp): end time
+        exchange (Literal[bybit, binance]): cex
+        symbols (list[str], optional): ccxt symbols. Defaults to ["BTC/USDT:USDT"].
+        timeframe (str, optional): timeframe. Defaults to "15m".
+        use_store (bool, optional): read and save bars in BAR_STORE. Defaults to True.
+
+    Returns:
+        DataFrame: ['sym', 'ts', 'open', 'high', 'low', 'close', 'volume']
     """
+    interval_ts: Timedelta = Timedelta(
+        value=INTERVAL_MS_MAP[timeframe],
+        unit="millisecond",
+    )
     price_list: list[DataFrame] = []
     for symbol in symbols:
-        tmp: list[list] = []
-        # s is pandas Timestamp object
-        # Timestamp.value is in nano second
-        # fetch_ohlcv 'since' parameter take integer millisecond
-        for s, e in params:
-            response: list[list] = cex.fetch_ohlcv(
+        sym_price_df: DataFrame = pd.concat(
+            objs=(iter_stored_price if use_store else iter_price)(
+                stime=stime,
+                etime=etime,
+                exchange=exchange,
                 symbol=symbol,
                 timeframe=timeframe,
-                limit=LIMIT,
-                since=int(s.value / 1e6),
-            )
-            tmp.extend(response)
-
-        sym_price: list[list] = [_[0:6] for _ in tmp]
-        sym_price_df: DataFrame = DataFrame(
-            data=sym_price,
-            columns=["ts_ms", "open", "high", "low", "close", "volume"],
+            ),
+            ignore_index=True,
         )
-        sym_price_df["ts"] = to_datetime(sym_price_df["ts_ms"], unit="ms", utc=True)
-        sym_price_df["sym"] = symbol
-        sym_price_df.drop(columns=["ts_ms"], inplace=True)
         # check missing data
         sym_price_df = padding_id_time(
             df=sym_price_df,
             freq=interval_ts,
             category="price",
             check_missing_data=True,
+            exchange=exchange,
         )
         price_list.append(sym_price_df)
 
@@ -103,3 +179,72 @@ def load_price(
     price_df.drop_duplicates(inplace=True)
     price_df = price_df[(price_df["ts"] >= stime) & (price_df["ts"] <= etime)]
     return price_df
+
+
+def load_price_resampled(
+    stime: Timestamp,
+    etime: Timestamp,
+    exchange: Literal["okx", "binance", "bybit"],
+    symbols: list[str] = ["BTC/USDT:USDT"],
+    timeframes: list[str] = ["15m"],
+    base_timeframe: str = "1m",
+    use_store: bool = True,
+) -> dict[str, DataFrame]:
+    """get cex price of many timeframes by fetching base_timeframe once
+
+    the fine bars are streamed page by page into the resamplers, so they are never
+    held in memory at once
+
+    Args:
+        stime (Timestamp): start time
+        etime (Timestamp): end time
+        exchange (Literal[okx, binance, bybit]): cex
+        symbols (list[str], optional): ccxt symbols. Defaults to ["BTC/USDT:USDT"].
+        timeframes (list[str], optional): target timeframes. Defaults to ["15m"].
+        base_timeframe (str, optional): timeframe fetched from the cex. Defaults to "1m".
+        use_store (bool, optional): read and save base bars in BAR_STORE. Defaults to True.
+
+    Returns:
+        dict[str, DataFrame]: {timeframe: ['sym', 'ts', 'open', 'high', 'low', 'close', 'volume']}
+    """
+    for timeframe in timeframes:
+        assert (
+            INTERVAL_MS_MAP[timeframe] % INTERVAL_MS_MAP[base_timeframe] == 0
+        ), f"{timeframe} is not a multiple of {base_timeframe}"
+    price_lists: dict[str, list[DataFrame]] = {k: [] for k in timeframes}
+    for symbol in symbols:
+        # the last target bar needs the fine bars up to its end
+        end: Timestamp = etime + Timedelta(
+            value=max(INTERVAL_MS_MAP[k] for k in timeframes)
+            - INTERVAL_MS_MAP[base_timeframe],
+            unit="millisecond",
+        )
+        resampled: dict[str, DataFrame] = resample_ohlcv(
+            chunks=(iter_stored_price if use_store else iter_price)(
+                stime=stime,
+                etime=end,
+                exchange=exchange,
+                symbol=symbol,
+                timeframe=base_timeframe,
+            ),
+            timeframes=timeframes,
+        )
+        for timeframe, sym_price_df in resampled.items():
+            # check missing data
+            sym_price_df = padding_id_time(
+                df=sym_price_df,
+                freq=Timedelta(value=INTERVAL_MS_MAP[timeframe], unit="millisecond"),
+                category="price",
+                check_missing_data=True,
+                exchange=exchange,
+            )
+            price_lists[timeframe].append(sym_price_df)
+
+    price_dfs: dict[str, DataFrame] = {}
+    for timeframe, price_list in price_lists.items():
+        price_df: DataFrame = pd.concat(objs=price_list, ignore_index=True)
+        price_df.drop_duplicates(inplace=True)
+        price_dfs[timeframe] = price_df[
+            (price_df["ts"] >= stime) & (price_df["ts"] <= etime)
+        ]
+    return price_dfs
@@ -1,17 +1,69 @@
+import atexit
 import logging
+import multiprocessing
 import os
-from datetime import datetime
-from logging import DEBUG, INFO, WARNING, FileHandler, Formatter, Logger, StreamHandler
+import queue
+import sqlite3
+from datetime import datetime, timezone
+from logging import (
+    DEBUG,
+    INFO,
+    WARNING,
+    FileHandler,
+    Formatter,
+    Handler,
+    Logger,
+    StreamHandler,
+)
+from logging.handlers import QueueHandler, QueueListener
+from multiprocessing.queues import Queue
 from typing import Literal
 
 import numpy as np
-from pandas import DataFrame
+import pandas as pd
+from pandas import DataFrame, Timedelta
 
 from utils.valid import check_cols
-from utils.var import LOG_DIR, MISSING_DATA_DIR
+from utils.var import LOG_DIR, MISSING_DATA_FP, ensure_dir
 
 LEVEL_MAP: dict[str, int] = {"INFO": INFO, "DEBUG": DEBUG, "WARNING": WARNING}
 
+# identify the records of this run in the missing data registry
+RUN_ID: str = f"{datetime.now().strftime('%Y%m%d.%H%M%S')}.{os.getpid()}"
+
+MISSING_SCHEMA: str = """
+CREATE TABLE IF NOT EXISTS missing (
+    run_id TEXT NOT NULL,
+    category TEXT,
+    exchange TEXT NOT NULL,
+    sym TEXT NOT NULL,
+    gap_start TEXT NOT NULL,
+    gap_end TEXT NOT NULL,
+    n_missing INTEGER,
+    logged_at TEXT,
+    PRIMARY KEY (run_id, exchange, sym, gap_start, gap_end)
+);
+CREATE INDEX IF NOT EXISTS idx_missing_sym ON missing (exchange, sym, gap_start);
+"""
+
+
+class LazyFileHandler(FileHandler):
+    """file handler that creates its directory and opens its file on the first record"""
+
+    def __init__(self, filename: str):
+        super().__init__(filename=filename, delay=True)
+
+    def _open(self):
+        ensure_dir(fdir=os.path.dirname(p=self.baseFilename))
+        return super()._open()
+
+
+# handlers doing the actual I/O, {logger name: handlers}
+_handlers: dict[str, list[Handler]] = {}
+# queue of the worker processes and its listener, created on first use
+_worker_queue: Queue | None = None
+_worker_listener: QueueListener | None = None
+
 
 def create_logger(
     fp: str,
@@ -20,6 +72,9 @@ def create_logger(
 ) -> Logger:
     """create a logger
 
+    the logger only puts records in a queue, a listener thread formats them and
+    writes them to the file and the console, so logging never blocks the caller
+
     Args:
         fp (str): log file filepath
         name (str, optional): name of the logger. Defaults to "logger".
@@ -39,48 +94,161 @@ def create_logger(
     # set logger level
     logger.setLevel(level=LEVEL_MAP[logger_level])
 
-    # file handler
-    file_handler: FileHandler = FileHandler(filename=fp)
+    # file handler, the file is only opened when the first record is emitted
+    file_handler: FileHandler = LazyFileHandler(filename=fp)
     file_handler.setFormatter(fmt=formatter)
-    logger.addHandler(hdlr=file_handler)
 
     # console handler
     console_handler: StreamHandler = StreamHandler()
     console_handler.setFormatter(fmt=formatter)
-    logger.addHandler(hdlr=console_handler)
+
+    # queue handler on the caller side, listener thread on the I/O side
+    log_queue: queue.Queue = queue.Queue()
+    logger.addHandler(hdlr=QueueHandler(queue=log_queue))
+    _handlers[name] = [file_handler, console_handler]
+    listener: QueueListener = QueueListener(log_queue, *_handlers[name])
+    listener.start()
+    # flush the remaining records when the interpreter exits
+    atexit.register(listener.stop)
 
     return logger
 
 
+def worker_log_queue() -> Queue:
+    """queue to pass to init_worker, records put in it by worker processes are
+    written by the handlers of this process
+
+    Returns:
+        Queue: log queue
+    """
+    global _worker_queue, _worker_listener
+    if _worker_queue is None:
+        _worker_queue = multiprocessing.Queue()
+        _worker_listener = QueueListener(
+            _worker_queue, *[k for v in _handlers.values() for k in v]
+        )
+        _worker_listener.start()
+        atexit.register(_worker_listener.stop)
+    return _worker_queue
+
+
+def init_worker(log_queue: Queue) -> None:
+    """initializer of worker processes, send their records to the parent process
+
+    Args:
+        log_queue (Queue): queue from worker_log_queue
+    """
+    for name in _handlers.keys():
+        worker_logger: Logger = logging.getLogger(name=name)
+        # the listener thread of the parent is not forked, drop the inherited handler
+        for handler in list(worker_logger.handlers):
+            worker_logger.removeHandler(hdlr=handler)
+        worker_logger.addHandler(hdlr=QueueHandler(queue=log_queue))
+
+
 # define loggers
 LOGGER_FP: str = os.path.join(LOG_DIR, "time_research.log")
 logger: Logger = create_logger(fp=LOGGER_FP, name="TimeResearch")
 
 
-def log_missing_data(df: DataFrame, category: str = "") -> None:
-    """log missing data in dataframe, warning and write to csv
+def _connect(db_fp: str) -> sqlite3.Connection:
+    ensure_dir(fdir=os.path.dirname(p=db_fp))
+    # venues are loaded by several threads and processes, wait for the lock
+    conn: sqlite3.Connection = sqlite3.connect(database=db_fp, timeout=60)
+    conn.executescript(MISSING_SCHEMA)
+    return conn
+
+
+def missing_gaps(df: DataFrame, freq: Timedelta) -> DataFrame:
+    """collapse missing data points into gaps of consecutive periods
+
+    Args:
+        df (DataFrame): ['sym', 'ts', others], the missing data points
+        freq (Timedelta): interval
+
+    Returns:
+        DataFrame: ['sym', 'gap_start', 'gap_end', 'n_missing']
+    """
+    check_cols(df=df, cols=["sym", "ts"], checkRedundancy=False)
+    df = df[["sym", "ts"]].sort_values(by=["sym", "ts"])
+    sym: np.ndarray = np.array(df["sym"])
+    ts: np.ndarray = np.array(df["ts"].values.astype("datetime64[ns]"))
+    # a gap starts at a new symbol or after a break of more than one period
+    new_gap: np.ndarray = np.ones(len(df), dtype=bool)
+    new_gap[1:] = (sym[1:] != sym[:-1]) | (np.diff(ts) != freq.to_timedelta64())
+    return (
+        df.assign(gap=np.cumsum(new_gap))
+        .groupby(by="gap")
+        .agg(
+            sym=("sym", "first"),
+            gap_start=("ts", "min"),
+            gap_end=("ts", "max"),
+            n_missing=("ts", "size"),
+        )
+        .reset_index(drop=True)
+    )
+
+
+def log_missing_data(
+    df: DataFrame,
+    freq: Timedelta,
+    category: str = "",
+    exchange: str = "",
+    db_fp: str = MISSING_DATA_FP,
+) -> None:
+    """log missing data in dataframe, warning and save the gaps to the registry
 
     Args:
         df (DataFrame): target dataframe to be checked
-        category (str, optional): identifier that will be used in warning message and csv file name. Defaults to "".
+        freq (Timedelta): interval of df, consecutive missing points make one gap
+        category (str, optional): identifier that will be used in warning message and registry. Defaults to "".
+        exchange (str, optional): exchange of the data. Defaults to "".
+        db_fp (str, optional): sqlite registry file path. Defaults to MISSING_DATA_FP.
     """
 
-    if len(df):
-        df = df.copy()
-    else:
+    if not len(df):
         return
-    check_cols(df=df, cols=["sym", "ts"], checkRedundancy=False)
-    nounce: int = np.random.randint(low=1000)
-    fn: str = (
-        f"missing_{category}_{nounce}_{datetime.now().strftime('%Y%m%d.%H%M%S')}.csv"
-    )
-    fp: str = os.path.join(MISSING_DATA_DIR, fn)
-    if not os.path.exists(path=MISSING_DATA_DIR):
-        os.makedirs(name=MISSING_DATA_DIR)
-    df.to_csv(path_or_buf=fp, index=False)
+    gaps: DataFrame = missing_gaps(df=df, freq=freq)
+    logged_at: str = datetime.now(tz=timezone.utc).isoformat()
+    rows: list[tuple] = [
+        (RUN_ID, category, exchange, sym, str(start), str(end), int(n), logged_at)
+        for sym, start, end, n in gaps.itertuples(index=False)
+    ]
+    with _connect(db_fp=db_fp) as conn:
+        conn.executemany(
+            "INSERT OR IGNORE INTO missing VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows
+        )
+    conn.close()
     logger.warning(
         msg=(
-            f"Missing {category} data detected for symbols: {df['sym'].unique()},"
-            f" please check file: {fn}"
+            f"Missing {category} data detected on {exchange or 'unknown exchange'}"
+            f" for symbols: {gaps['sym'].unique()}, {int(gaps['n_missing'].sum())}"
+            f" points in {len(gaps)} gaps, run_id {RUN_ID} in {db_fp}"
         )
     )
+
+
+def query_missing(
+    where: str = "",
+    params: tuple = (),
+    db_fp: str = MISSING_DATA_FP,
+) -> DataFrame:
+    """read the missing data registry
+
+    Args:
+        where (str, optional): sql condition, e.g. "exchange = ?". Defaults to "".
+        params (tuple, optional): parameters of the condition. Defaults to ().
+        db_fp (str, optional): sqlite registry file path. Defaults to MISSING_DATA_FP.
+
+    Returns:
+        DataFrame: ['run_id', 'category', 'exchange', 'sym', 'gap_start', 'gap_end',
+        'n_missing', 'logged_at']
+    """
+    sql: str = "SELECT * FROM missing"
+    if where:
+        sql += f" WHERE {where}"
+    sql += " ORDER BY exchange, sym, gap_start"
+    with _connect(db_fp=db_fp) as conn:
+        missing_df: DataFrame = pd.read_sql_query(sql=sql, con=conn, params=params)
+    conn.close()
+    return missing_df
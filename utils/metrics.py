@@ -0,0 +1,182 @@
+from typing import Any
+
+import numpy as np
+import pandas as pd
+from pandas import DataFrame
+
+# max number of elements materialised at once, rows are processed in chunks of this
+CHUNK_SIZE: int = 1 << 24
+
+
+def _chunk_metrics(
+    adj_ret: np.ndarray,
+    scalar: float,
+    ret: np.ndarray | None,
+    side: np.ndarray | None,
+) -> dict[str, np.ndarray]:
+    """see batch_metrics, for a chunk of rows"""
+    n: int = adj_ret.shape[1]
+    mean: np.ndarray = adj_ret.mean(axis=1)
+    std: np.ndarray = adj_ret.std(axis=1, ddof=1)
+    # root mean square of the losses, the deviation counted by sortino
+    downside: np.ndarray = np.sqrt(np.mean(np.minimum(adj_ret, 0) ** 2, axis=1))
+    nav: np.ndarray = np.cumprod(1 + adj_ret, axis=1)
+    max_dd: np.ndarray = (nav / np.maximum.accumulate(nav, axis=1) - 1).min(axis=1)
+    metrics: dict[str, np.ndarray] = {
+        "annual_ret": mean * scalar,
+        "annual_std": std * np.sqrt(scalar),
+    }
+    with np.errstate(divide="ignore", invalid="ignore"):
+        metrics["annual_sr"] = metrics["annual_ret"] / metrics["annual_std"]
+        metrics["sortino"] = mean / downside * np.sqrt(scalar)
+        metrics["calmar"] = metrics["annual_ret"] / np.abs(max_dd)
+        metrics["max_dd"] = max_dd
+        if side is None:
+            # bars with a return are the bars in position
+            in_position: np.ndarray = adj_ret != 0
+        else:
+            in_position = side != 0
+            prev_side: np.ndarray = np.concatenate(
+                [np.zeros((len(side), 1)), side[:, :-1]], axis=1
+            )
+            # a trade starts when the side changes to a non zero side
+            entries: np.ndarray = (in_position & (side != prev_side)).sum(axis=1)
+            metrics["turnover"] = np.abs(side - prev_side).sum(axis=1) / n * scalar
+            metrics["avg_holding"] = in_position.sum(axis=1) / entries
+        metrics["hit_rate"] = (in_position & (adj_ret > 0)).sum(
+            axis=1
+        ) / in_position.sum(axis=1)
+    if ret is not None:
+        metrics["fee_drag"] = (ret - adj_ret).mean(axis=1) * scalar
+    return metrics
+
+
+def batch_metrics(
+    adj_ret: np.ndarray,
+    scalar: float,
+    ret: np.ndarray | None = None,
+    side: np.ndarray | None = None,
+) -> dict[str, np.ndarray]:
+    """performance metrics of many return series at once
+
+    every metric is a reduction along the time axis of the (series, bars) matrix,
+    so thousands of parameter sets cost a few matrix operations instead of one
+    python loop each
+
+    Args:
+        adj_ret (np.ndarray): (series, bars) or (bars,) fee adjusted return
+        scalar (float): number of bars in a year
+        ret (np.ndarray | None, optional): same shape, return without fee, for the
+        fee drag. Defaults to None.
+        side (np.ndarray | None, optional): same shape, position of each bar, for
+        turnover and holding period. Defaults to None.
+
+    Returns:
+        dict[str, np.ndarray]: {metric: (series,)}, annual_ret, annual_std,
+        annual_sr, sortino, calmar, max_dd, hit_rate, plus turnover (annual sum of
+        absolute side changes) and avg_holding (bars per trade) with side, plus
+        fee_drag (annual fee) with ret
+    """
+    adj_ret = np.atleast_2d(adj_ret)
+    ret = None if ret is None else np.atleast_2d(ret)
+    side = None if side is None else np.atleast_2d(side)
+    assert not np.isnan(adj_ret).any()
+    assert ret is None or ret.shape == adj_ret.shape
+    assert side is None or side.shape == adj_ret.shape
+    step: int = max(1, CHUNK_SIZE // adj_ret.shape[1])
+    chunks: list[dict[str, np.ndarray]] = [
+        _chunk_metrics(
+            adj_ret=adj_ret[i : i + step],
+            scalar=scalar,
+            ret=None if ret is None else ret[i : i + step],
+            side=None if side is None else side[i : i + step],
+        )
+        for i in range(0, len(adj_ret), step)
+    ]
+    return {k: np.concatenate([c[k] for c in chunks]) for k in chunks[0].keys()}
+
+
+def sums_metrics(sums: dict, scalar: float, max_dd: float) -> dict[str, float]:
+    """metrics of batch_metrics from the running sums of a series, e.g. a backtest
+    continued from its saved state without its past bars
+
+    Args:
+        sums (dict): from utils.state.update_sums
+        scalar (float): number of bars in a year
+        max_dd (float): max drawdown of the nav, e.g. from update_drawdown
+
+    Returns:
+        dict[str, float]: {metric: value}, the metrics of batch_metrics with ret and
+        side, plus annual_exec_cost and annual_funding if summed
+    """
+    n: int = sums["n"]
+    mean: float = sums["sum"] / n
+    with np.errstate(divide="ignore", invalid="ignore"):
+        std: float = float(
+            np.sqrt(max(sums["sum_sq"] - n * mean**2, 0.0) / np.float64(n - 1))
+        )
+        downside: float = float(np.sqrt(sums["sum_down_sq"] / n))
+        metrics: dict[str, float] = {
+            "annual_ret": mean * scalar,
+            "annual_std": std * np.sqrt(scalar),
+            "annual_sr": float(np.float64(mean * scalar) / (std * np.sqrt(scalar))),
+            "sortino": float(np.float64(mean) / downside * np.sqrt(scalar)),
+            "calmar": float(np.float64(mean * scalar) / abs(max_dd)),
+            "max_dd": max_dd,
+            "turnover": sums["sum_turnover"] / n * scalar,
+            "avg_holding": float(np.float64(sums["n_held"]) / sums["n_entries"]),
+            "hit_rate": float(np.float64(sums["n_hit"]) / sums["n_held"]),
+            "fee_drag": sums["sum_fee"] / n * scalar,
+        }
+    if sums["sum_cost"] is not None:
+        metrics["annual_exec_cost"] = sums["sum_cost"] / n * scalar
+    if sums["sum_funding"] is not None:
+        metrics["annual_funding"] = sums["sum_funding"] / n * scalar
+    return metrics
+
+
+def series_metrics(
+    series: dict[Any, DataFrame], scalars: dict[Any, float]
+) -> DataFrame:
+    """batch_metrics of many runs, e.g. every parameter set of a sweep, the runs on
+    the same bars stacked into one (runs, bars) matrix and computed in one call
+
+    Args:
+        series (dict[Any, DataFrame]): {key: ['ts', 'adj_ret'] plus 'ret' and
+        'binance_side' if saved}, e.g. from utils.ledger.load_run_series
+        scalars (dict[Any, float]): {key: number of bars in a year}
+
+    Returns:
+        DataFrame: index key, one column per metric, turnover, avg_holding and
+        fee_drag only for the runs with their ret and side
+    """
+    # runs sharing the same bars, number of bars in a year and series saved
+    groups: dict[tuple, list] = {}
+    for key, df in series.items():
+        ts: np.ndarray = np.asarray(df["ts"].values.astype("datetime64[ms]"))
+        full: bool = "ret" in df.columns and "binance_side" in df.columns
+        group: tuple = (scalars[key], full, ts.tobytes())
+        groups.setdefault(group, []).append(key)
+    frames: list[DataFrame] = []
+    for (scalar, full, _), keys in groups.items():
+        metrics: dict[str, np.ndarray] = batch_metrics(
+            adj_ret=np.stack([np.asarray(series[k]["adj_ret"]) for k in keys]),
+            scalar=scalar,
+            ret=(
+                np.stack([np.asarray(series[k]["ret"]) for k in keys]) if full else None
+            ),
+            side=(
+                np.stack(
+                    [
+                        np.asarray(series[k]["binance_side"], dtype=np.float64)
+                        for k in keys
+                    ]
+                )
+                if full
+                else None
+            ),
+        )
+        frames.append(DataFrame(data=metrics, index=keys))
+    if not len(frames):
+        return DataFrame()
+    return pd.concat(objs=frames)
@@ -0,0 +1,202 @@
+import numpy as np
+from pandas import DataFrame
+
+from utils.metrics import batch_metrics
+
+PORTFOLIO_METHODS: list[str] = ["equal", "equal_risk", "min_variance", "max_sharpe"]
+
+
+def covariance(ret: np.ndarray, shrinkage: float = 0.0) -> np.ndarray:
+    """sample covariance of the columns, shrunk towards its diagonal
+
+    Args:
+        ret (np.ndarray): (bars, series) returns
+        shrinkage (float, optional): weight of the diagonal target, 0 keeps the sample
+        covariance. Defaults to 0.0.
+
+    Returns:
+        np.ndarray: (series, series) covariance
+    """
+    demeaned: np.ndarray = ret - ret.mean(axis=0)
+    cov: np.ndarray = demeaned.T @ demeaned / (len(ret) - 1)
+    if shrinkage:
+        cov = (1 - shrinkage) * cov + shrinkage * np.diag(np.diag(cov))
+    return cov
+
+
+def _solve_long_only(cov: np.ndarray, b: np.ndarray, active: np.ndarray) -> np.ndarray:
+    """weights proportional to cov^-1 b, summing to 1, without short positions
+
+    the series getting a negative weight are dropped and the system is solved again
+    on the others, a fast approximation of the long only optimum. The pseudo inverse
+    splits the weight evenly between identical series.
+
+    Args:
+        cov (np.ndarray): (series, series) covariance
+        b (np.ndarray): (series,) right hand side, ones or mean returns
+        active (np.ndarray): (series,) series that can get a weight
+
+    Returns:
+        np.ndarray: (series,) weights, all 0 if no series is left
+    """
+    active = active & (b > 0)
+    w: np.ndarray = np.zeros(len(b))
+    while active.any():
+        w[:] = 0.0
+        idx: np.ndarray = np.flatnonzero(active)
+        w[idx] = np.linalg.pinv(cov[np.ix_(idx, idx)], hermitian=True) @ b[idx]
+        negative: np.ndarray = active & (w <= 0)
+        if not negative.any():
+            return w / w.sum()
+        active &= ~negative
+    return w
+
+
+def equal_risk_weights(
+    cov: np.ndarray,
+    active: np.ndarray,
+    tol: float = 1e-12,
+    max_iter: int = 100,
+) -> np.ndarray:
+    """weights with the same contribution w_i * (cov @ w)_i to the portfolio variance
+
+    minimizes x @ cov @ x / 2 - mean(log(x)), whose optimum has equal contributions,
+    with newton steps solving one linear system for all the series
+
+    Args:
+        cov (np.ndarray): (series, series) covariance
+        active (np.ndarray): (series,) series that can get a weight
+        tol (float, optional): max gradient at the optimum. Defaults to 1e-12.
+        max_iter (int, optional): max newton steps. Defaults to 100.
+
+    Returns:
+        np.ndarray: (series,) weights summing to 1
+    """
+    idx: np.ndarray = np.flatnonzero(active)
+    sub: np.ndarray = cov[np.ix_(idx, idx)]
+    budget: float = 1 / len(idx)
+    # inverse volatility is the solution without correlation
+    x: np.ndarray = 1 / np.sqrt(np.diag(sub))
+    x *= np.sqrt(1 / (x @ sub @ x))
+    for _ in range(max_iter):
+        grad: np.ndarray = sub @ x - budget / x
+        if np.max(np.abs(grad)) < tol:
+            break
+        step: np.ndarray = np.linalg.solve(sub + np.diag(budget / x**2), grad)
+        # halve the step until the weights stay positive
+        t: float = 1.0
+        while np.any(x - t * step <= 0):
+            t /= 2
+        x -= t * step
+    weights: np.ndarray = np.zeros(len(cov))
+    weights[idx] = x / x.sum()
+    return weights
+
+
+def optimize_weights(
+    ret: np.ndarray,
+    methods: list[str] = PORTFOLIO_METHODS,
+    shrinkage: float = 0.0,
+) -> np.ndarray:
+    """portfolio weights of the series for each method
+
+    equal: 1 / n, equal_risk: same contribution to the variance, min_variance:
+    cov^-1 1, max_sharpe: cov^-1 mean. All are long only and sum to 1, series
+    without any variance get no weight. Estimated on the whole sample.
+
+    Args:
+        ret (np.ndarray): (bars, series) returns
+        methods (list[str], optional): methods. Defaults to PORTFOLIO_METHODS.
+        shrinkage (float, optional): see covariance. Defaults to 0.0.
+
+    Returns:
+        np.ndarray: (series, methods) weights
+    """
+    cov: np.ndarray = covariance(ret=ret, shrinkage=shrinkage)
+    active: np.ndarray = np.diag(cov) > 0
+    assert active.any(), "No series with any variance"
+    weights: np.ndarray = np.zeros((ret.shape[1], len(methods)))
+    for j, method in enumerate(methods):
+        if method == "equal":
+            weights[:, j] = active / active.sum()
+        elif method == "equal_risk":
+            weights[:, j] = equal_risk_weights(cov=cov, active=active)
+        elif method == "min_variance":
+            weights[:, j] = _solve_long_only(
+                cov=cov, b=np.ones(len(cov)), active=active
+            )
+        elif method == "max_sharpe":
+            weights[:, j] = _solve_long_only(cov=cov, b=ret.mean(axis=0), active=active)
+        else:
+            raise ValueError(
+                f"Unknown method {method}, must be one of {PORTFOLIO_METHODS}"
+            )
+    return weights
+
+
+def portfolio_performance(
+    ret: np.ndarray,
+    weights: np.ndarray,
+    scalar: float,
+) -> tuple[np.ndarray, np.ndarray, dict[str, np.ndarray]]:
+    """nav, drawdown and metrics of many portfolios at once, rebalanced every bar
+
+    Args:
+        ret (np.ndarray): (bars, series) returns
+        weights (np.ndarray): (series, portfolios) weights
+        scalar (float): number of bars in a year
+
+    Returns:
+        tuple[np.ndarray, np.ndarray, dict[str, np.ndarray]]: (bars, portfolios) nav,
+        (bars, portfolios) drawdown from the running peak, {metric: (portfolios,)}
+        see batch_metrics
+    """
+    port_ret: np.ndarray = ret @ weights
+    nav: np.ndarray = np.cumprod(1 + port_ret, axis=0)
+    drawdown: np.ndarray = nav / np.maximum.accumulate(nav, axis=0) - 1
+    # portfolios as rows of the metrics engine
+    metrics: dict[str, np.ndarray] = batch_metrics(adj_ret=port_ret.T, scalar=scalar)
+    return nav, drawdown, metrics
+
+
+def combine_runs(
+    returns: DataFrame,
+    scalar: float,
+    methods: list[str] = PORTFOLIO_METHODS,
+    shrinkage: float = 0.0,
+) -> dict[str, DataFrame]:
+    """blend the return series of many runs into portfolios
+
+    Args:
+        returns (DataFrame): index ts, one column per run, from load_returns, a run
+        without a bar at a ts is not invested there
+        scalar (float): number of bars in a year
+        methods (list[str], optional): see optimize_weights. Defaults to PORTFOLIO_METHODS.
+        shrinkage (float, optional): see covariance. Defaults to 0.0.
+
+    Returns:
+        dict[str, DataFrame]: 'weights' ['run_id', methods], 'performance'
+        ['method', metrics of batch_metrics], 'nav' and
+        'drawdown' ['ts', methods]
+    """
+    ret: np.ndarray = returns.fillna(value=0.0).to_numpy(dtype=np.float64)
+    weights: np.ndarray = optimize_weights(
+        ret=ret, methods=methods, shrinkage=shrinkage
+    )
+    nav, drawdown, metrics = portfolio_performance(
+        ret=ret, weights=weights, scalar=scalar
+    )
+    weights_df: DataFrame = DataFrame(data=weights, columns=methods)
+    weights_df.insert(loc=0, column="run_id", value=list(returns.columns))
+    performance_df: DataFrame = DataFrame(data=metrics)
+    performance_df.insert(loc=0, column="method", value=methods)
+    nav_df: DataFrame = DataFrame(data=nav, columns=methods)
+    nav_df.insert(loc=0, column="ts", value=returns.index)
+    drawdown_df: DataFrame = DataFrame(data=drawdown, columns=methods)
+    drawdown_df.insert(loc=0, column="ts", value=returns.index)
+    return {
+        "weights": weights_df,
+        "performance": performance_df,
+        "nav": nav_df,
+        "drawdown": drawdown_df,
+    }
@@ -0,0 +1,185 @@
+import warnings
+
+import numpy as np
+from pandas import DataFrame, MultiIndex, concat
+
+PRICE_COLS: list[str] = ["open", "high", "low", "close"]
+
+# scale of the median absolute deviation to the std of a normal distribution
+MAD_SCALE: float = 1.4826
+
+
+def _gap_length(missing: np.ndarray, sym: np.ndarray) -> np.ndarray:
+    """length of the run of missing rows each row belongs to, 0 if not missing
+
+    Args:
+        missing (np.ndarray): missing flag, rows sorted by sym and ts
+        sym (np.ndarray): symbol
+
+    Returns:
+        np.ndarray: gap length
+    """
+    n: int = len(missing)
+    # a run starts at a new symbol or when the missing flag changes
+    new_run: np.ndarray = np.ones(n, dtype=bool)
+    new_run[1:] = (sym[1:] != sym[:-1]) | (missing[1:] != missing[:-1])
+    run_id: np.ndarray = np.cumsum(new_run) - 1
+    run_len: np.ndarray = np.bincount(run_id)
+    return np.where(missing, run_len[run_id], 0)
+
+
+def _fill(prc: DataFrame, rows: np.ndarray, method: str) -> DataFrame:
+    """fill the price of the rows from the neighbouring bars of the same symbol
+
+    Args:
+        prc (DataFrame): ['sym', 'ts', 'open', 'high', 'low', 'close', 'volume']
+        rows (np.ndarray): rows to fill
+        method (str): 'ffill' repeats the last close, 'interpolate' draws a line
+        between the closes around the gap
+
+    Returns:
+        DataFrame: prc with the rows filled, volume 0 on the filled rows
+    """
+    close = prc["close"].where(~rows)
+    grouped = close.groupby(by=prc["sym"])
+    if method == "interpolate":
+        filled = grouped.transform(
+            lambda x: x.interpolate(method="linear", limit_area="inside")
+        )
+        # gaps at the edges have no line to follow, repeat the nearest close
+        filled = filled.fillna(value=grouped.ffill())
+    elif method == "ffill":
+        filled = grouped.ffill()
+    else:
+        raise ValueError(f"Unknown method {method}, must be ffill or interpolate")
+    # gaps at the start have no previous bar, take the first available one
+    filled = filled.fillna(value=grouped.bfill())
+    # flat bars: open at the previous close, no range
+    prev_close = filled.groupby(by=prc["sym"]).shift().fillna(value=filled)
+    prc = prc.copy()
+    prc.loc[rows, "open"] = prev_close[rows]
+    prc.loc[rows, ["high", "low", "close"]] = np.repeat(
+        np.array(filled[rows])[:, None], 3, axis=1
+    )
+    prc.loc[rows, "high"] = prc.loc[rows, ["open", "high"]].max(axis=1)
+    prc.loc[rows, "low"] = prc.loc[rows, ["open", "low"]].min(axis=1)
+    prc["volume"] = prc["volume"].where(~rows).fillna(value=0.0)
+    return prc
+
+
+def cross_venue_outliers(
+    prices: dict[str, DataFrame],
+    z_threshold: float = 10.0,
+) -> dict[str, np.ndarray]:
+    """flag prints far from the other venues with robust z-scores
+
+    at each ts the log deviation of each venue's close from the median close of all
+    venues, net of the usual basis of the venue, is scaled by the median absolute
+    deviation of the venue from the other venues over the whole period. With two
+    venues both are flagged as it's not possible to tell which one is wrong
+
+    Args:
+        prices (dict[str, DataFrame]): {exchange: ['sym', 'ts', 'close', others]}
+        z_threshold (float, optional): robust z-score above which a print is an
+        outlier. Defaults to 10.0.
+
+    Returns:
+        dict[str, np.ndarray]: {exchange: outlier flag per row of its price}
+    """
+    venues: list[str] = list(prices.keys())
+    if len(venues) < 2:
+        return {k: np.zeros(len(v), dtype=bool) for k, v in prices.items()}
+    # (sym, ts) x venues matrix of log close, aligned on the union of the time grids
+    wide: DataFrame = concat(
+        objs={k: v.set_index(keys=["sym", "ts"])["close"] for k, v in prices.items()},
+        axis=1,
+    )
+    log_close: np.ndarray = np.log(wide.to_numpy(dtype=np.float64))
+    with warnings.catch_warnings():
+        # rows or venues without any data give all NaN slices
+        warnings.simplefilter(action="ignore", category=RuntimeWarning)
+        # the median of all venues is robust to one bad venue out of three or more
+        dev: np.ndarray = log_close - np.nanmedian(log_close, axis=1, keepdims=True)
+        dev -= np.nanmedian(dev, axis=0)
+        # but a venue often is that median, its scale is measured against the others
+        loo: np.ndarray = np.column_stack(
+            [
+                log_close[:, i]
+                - np.nanmedian(np.delete(log_close, obj=i, axis=1), axis=1)
+                for i in range(len(venues))
+            ]
+        )
+        loo -= np.nanmedian(loo, axis=0)
+        mad: np.ndarray = np.nanmedian(np.abs(loo), axis=0)
+        z: np.ndarray = np.abs(dev) / (MAD_SCALE * mad)
+    flags: DataFrame = DataFrame(
+        data=np.nan_to_num(z, nan=0.0) > z_threshold,
+        index=wide.index,
+        columns=wide.columns,
+    )
+    return {
+        k: np.array(flags[k].reindex(index=MultiIndex.from_frame(v[["sym", "ts"]])))
+        for k, v in prices.items()
+    }
+
+
+def repair_prices(
+    prices: dict[str, DataFrame],
+    max_gap: int = 3,
+    method: str = "ffill",
+    z_threshold: float = 10.0,
+) -> tuple[dict[str, DataFrame], dict[str, np.ndarray], DataFrame]:
+    """repair the padded prices of several venues
+
+    1. outlier prints across venues are dropped, so they are filled like gaps
+    2. gaps of at most max_gap bars are filled
+    3. longer gaps are filled flat and marked untradeable
+
+    Args:
+        prices (dict[str, DataFrame]): {exchange: ['sym', 'ts', 'open', 'high', 'low',
+        'close', 'volume']}, padded, NA where data is missing
+        max_gap (int, optional): longest gap in bars filled as tradeable. Defaults to 3.
+        method (str, optional): ffill or interpolate. Defaults to "ffill".
+        z_threshold (float, optional): robust z-score of outliers. Defaults to 10.0.
+
+    Returns:
+        tuple[dict[str, DataFrame], dict[str, np.ndarray], DataFrame]: repaired
+        prices without NA, {exchange: tradeable flag per row}, summary with one row per
+        exchange ['exchange', 'bars', 'outliers', 'filled', 'untradeable']
+    """
+    prices = {
+        k: v.sort_values(by=["sym", "ts"]).reset_index(drop=True)
+        for k, v in prices.items()
+    }
+
+    """
+    1. outliers across the venues
+    """
+    outliers: dict[str, np.ndarray] = cross_venue_outliers(
+        prices=prices, z_threshold=z_threshold
+    )
+
+    """
+    2. fill short gaps, fill and mask long gaps
+    """
+    repaired: dict[str, DataFrame] = {}
+    tradeable: dict[str, np.ndarray] = {}
+    summary: list[dict] = []
+    for exchange, prc in prices.items():
+        missing: np.ndarray = np.array(prc[PRICE_COLS].isnull().any(axis=1))
+        missing |= outliers[exchange]
+        gap_len: np.ndarray = _gap_length(missing=missing, sym=np.array(prc["sym"]))
+        if missing.any():
+            prc = _fill(prc=prc, rows=missing, method=method)
+        repaired[exchange] = prc
+        tradeable[exchange] = gap_len <= max_gap
+        summary.append(
+            {
+                "exchange": exchange,
+                "bars": len(prc),
+                "outliers": int(outliers[exchange].sum()),
+                "filled": int(((gap_len > 0) & (gap_len <= max_gap)).sum()),
+                "untradeable": int((gap_len > max_gap).sum()),
+            }
+        )
+    return repaired, tradeable, DataFrame(data=summary)
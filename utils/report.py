@@ -2,17 +2,20 @@ import os
 from datetime import datetime
 
 import numpy as np
-from matplotlib import pyplot as plt
-from matplotlib.backends.backend_pdf import PdfPages
-from matplotlib.figure import Figure
 from pandas import DataFrame
 
-from utils.plot import plot_dist, plot_line, plot_table
 from utils.valid import check_cols
-from utils.var import REPORT_DIR
+from utils.var import REPORT_DIR, ensure_dir
 
 
 def gen_report(report_data: dict[str, DataFrame]):
+    # matplotlib is slow to import, import it only when a report is generated
+    from matplotlib import pyplot as plt
+    from matplotlib.backends.backend_pdf import PdfPages
+    from matplotlib.figure import Figure
+
+    from utils.plot import plot_dist, plot_line, plot_table
+
     # load data
     cfg_df: DataFrame = report_data["config"]
     performance_df: DataFrame = report_data["performance"]
@@ -26,13 +29,13 @@ def gen_report(report_data: dict[str, DataFrame]):
     check_cols(df=fee_df, cols=["ts", "1bps", "2bps", "3bps"])
 
     # make sure the dir exists
-    if not os.path.exists(path=REPORT_DIR):
-        os.makedirs(name=REPORT_DIR)
+    ensure_dir(fdir=REPORT_DIR)
 
     # define pdf object
     pdf_fn: str = ".".join(
         [
-            f"R{datetime.now().strftime('%Y%m%d.%H%M%S')}",  # runtime
+            # microseconds keep batch runs finishing in the same second apart
+            f"R{datetime.now().strftime('%Y%m%d.%H%M%S%f')}",  # runtime
             f"S{min(ret_df['ts']).strftime('%Y%m%d')}",  # start time
             f"E{max(ret_df['ts']).strftime('%Y%m%d')}",  # end time
             "pdf",
@@ -65,6 +68,23 @@ def gen_report(report_data: dict[str, DataFrame]):
     pdf.savefig(figure=fig)
     plt.close(fig=fig)
 
+    if "repair" in report_data.keys():
+        fig: Figure = plot_table(
+            data=report_data["repair"],
+            title="Data Repair",
+        )
+        pdf.savefig(figure=fig)
+        plt.close(fig=fig)
+
+    if "trade_stats" in report_data.keys():
+        check_cols(df=report_data["trade_stats"], cols=["metrics", "value"])
+        fig: Figure = plot_table(
+            data=report_data["trade_stats"],
+            title="Trades",
+        )
+        pdf.savefig(figure=fig)
+        plt.close(fig=fig)
+
     # cumulative return
     fig: Figure = plot_line(
         _df=ret_df,
@@ -132,6 +152,20 @@ def gen_report(report_data: dict[str, DataFrame]):
     pdf.savefig(figure=fig)
     plt.close(fig=fig)
 
+    if "trades" in report_data.keys():
+        trades_df: DataFrame = report_data["trades"]
+        check_cols(df=trades_df, cols=["net_ret", "bars"], checkRedundancy=False)
+        # trade return distribution
+        fig: Figure = plot_dist(
+            data=np.array(object=trades_df["net_ret"] * 100),
+            bins=100,
+            _x_label="trade return [%]",
+            _y_label="count",
+            _title="Trade Return Distribution",
+        )
+        pdf.savefig(figure=fig)
+        plt.close(fig=fig)
+
     if "signal" in report_data.keys():
         signal_df: DataFrame = report_data["signal"]
         check_cols(df=signal_df, cols=["ts", "signal"])
@@ -146,5 +180,123 @@ def gen_report(report_data: dict[str, DataFrame]):
         pdf.savefig(figure=fig)
         plt.close(fig=fig)
 
+    if "rolling" in report_data.keys():
+        rolling_df: DataFrame = report_data["rolling"]
+        check_cols(df=rolling_df, cols=["ts"], checkRedundancy=False)
+        # one plot per metric, one line per window
+        for metric, y_label, title, to_percentage in [
+            ("sharpe", "sharpe", "Rolling Sharpe", False),
+            ("vol", "volatility [%]", "Rolling Volatility", True),
+            ("drawdown", "drawdown [%]", "Rolling Drawdown", True),
+            ("hit_rate", "hit rate [%]", "Rolling Hit Rate", True),
+        ]:
+            cols: list[str] = [
+                k for k in rolling_df.columns if k.startswith(f"{metric}_")
+            ]
+            fig: Figure = plot_line(
+                _df=rolling_df[["ts"] + cols],
+                _x="ts",
+                _y=cols,
+                _x_label="time",
+                _y_label=y_label,
+                _title=title,
+                _to_percentage=to_percentage,
+            )
+            pdf.savefig(figure=fig)
+            plt.close(fig=fig)
+
+    pdf.close()
+    return
+
+
+def gen_portfolio_report(report_data: dict[str, DataFrame]):
+    # matplotlib is slow to import, import it only when a report is generated
+    from matplotlib import pyplot as plt
+    from matplotlib.backends.backend_pdf import PdfPages
+    from matplotlib.figure import Figure
+
+    from utils.plot import plot_line, plot_table
+
+    # load data, see utils.portfolio.combine_runs
+    weights_df: DataFrame = report_data["weights"]
+    performance_df: DataFrame = report_data["performance"]
+    nav_df: DataFrame = report_data["nav"]
+    drawdown_df: DataFrame = report_data["drawdown"]
+    check_cols(df=weights_df, cols=["run_id"], checkRedundancy=False)
+    check_cols(
+        df=performance_df,
+        cols=[
+            "method",
+            "annual_ret",
+            "annual_std",
+            "annual_sr",
+            "sortino",
+            "calmar",
+            "max_dd",
+            "hit_rate",
+        ],
+    )
+    check_cols(df=nav_df, cols=["ts"], checkRedundancy=False)
+    check_cols(df=drawdown_df, cols=["ts"], checkRedundancy=False)
+    methods: list[str] = list(performance_df["method"])
+
+    # make sure the dir exists
+    ensure_dir(fdir=REPORT_DIR)
+
+    # define pdf object
+    pdf_fn: str = ".".join(
+        [
+            f"P{datetime.now().strftime('%Y%m%d.%H%M%S%f')}",  # runtime
+            f"S{min(nav_df['ts']).strftime('%Y%m%d')}",  # start time
+            f"E{max(nav_df['ts']).strftime('%Y%m%d')}",  # end time
+            "pdf",
+        ]
+    )
+    pdf = PdfPages(filename=os.path.join(REPORT_DIR, pdf_fn))
+
+    # performance of each method
+    table_df: DataFrame = performance_df.copy()
+    for col in ["annual_ret", "annual_std", "max_dd", "hit_rate"]:
+        table_df[col] = (table_df[col] * 100).round(2).astype(str) + "%"
+    for col in ["annual_sr", "sortino", "calmar"]:
+        table_df[col] = table_df[col].round(2)
+    fig: Figure = plot_table(data=table_df, title="Portfolio Performance")
+    pdf.savefig(figure=fig)
+    plt.close(fig=fig)
+
+    # weights, the largest ones if there are many runs
+    weights_df = weights_df.loc[
+        weights_df[methods].max(axis=1).sort_values(ascending=False).index[:30]
+    ]
+    fig = plot_table(
+        data=weights_df.assign(**{k: weights_df[k].round(4) for k in methods}),
+        title="Portfolio Weights",
+    )
+    pdf.savefig(figure=fig)
+    plt.close(fig=fig)
+
+    # nav and drawdown, one line per method
+    fig = plot_line(
+        _df=nav_df,
+        _x="ts",
+        _y=methods,
+        _x_label="time",
+        _y_label="nav",
+        _title="Portfolio Nav",
+    )
+    pdf.savefig(figure=fig)
+    plt.close(fig=fig)
+    fig = plot_line(
+        _df=drawdown_df,
+        _x="ts",
+        _y=methods,
+        _x_label="time",
+        _y_label="drawdown [%]",
+        _title="Portfolio Drawdown",
+        _to_percentage=True,
+    )
+    pdf.savefig(figure=fig)
+    plt.close(fig=fig)
+
     pdf.close()
     return
@@ -0,0 +1,123 @@
+from typing import Iterable
+
+import numpy as np
+import pandas as pd
+from pandas import DataFrame, to_datetime
+
+from utils.valid import check_cols
+from utils.var import INTERVAL_MS_MAP
+
+
+class OhlcvResampler:
+    """streaming aggregation of fine OHLCV bars into a coarser timeframe
+
+    chunks are fed in time order, the bars of each chunk are aggregated in one
+    vectorised groupby and only the last, possibly incomplete, bar of each symbol is
+    carried over to the next chunk, so memory stays flat whatever the history length
+    """
+
+    def __init__(self, timeframe: str):
+        assert timeframe in INTERVAL_MS_MAP.keys(), "Incorrect interval"
+        self.timeframe: str = timeframe
+        self.interval_ms: int = INTERVAL_MS_MAP[timeframe]
+        # partial bar of each symbol, aggregated but not complete yet
+        self._carry: DataFrame | None = None
+
+    def _aggregate(self, df: DataFrame) -> DataFrame:
+        ts_ms: np.ndarray = df["ts"].values.astype("datetime64[ms]").astype(np.int64)
+        grouped = df.assign(bucket=ts_ms - ts_ms % self.interval_ms).groupby(
+            by=["sym", "bucket"], sort=False
+        )
+        agg_df: DataFrame = grouped.agg(
+            open=("open", "first"),
+            high=("high", "max"),
+            low=("low", "min"),
+            close=("close", "last"),
+        )
+        # a bar without any data has NA volume rather than 0
+        agg_df["volume"] = grouped["volume"].sum(min_count=1)
+        agg_df = agg_df.reset_index()
+        agg_df["ts"] = to_datetime(agg_df["bucket"], unit="ms", utc=True)
+        return agg_df
+
+    def update(self, chunk: DataFrame) -> DataFrame:
+        """aggregate a chunk of fine bars
+
+        Args:
+            chunk (DataFrame): ['sym', 'ts', 'open', 'high', 'low', 'close', 'volume'],
+            later than all the previous chunks
+
+        Returns:
+            DataFrame: ['sym', 'ts', 'open', 'high', 'low', 'close', 'volume'] of the
+            completed coarse bars
+        """
+        check_cols(
+            df=chunk,
+            cols=["sym", "ts", "open", "high", "low", "close", "volume"],
+            checkRedundancy=False,
+        )
+        if not len(chunk):
+            return self._empty()
+        df: DataFrame = chunk[["sym", "ts", "open", "high", "low", "close", "volume"]]
+        if self._carry is not None:
+            # partial aggregates combine like bars, first open, max high, etc.
+            df = pd.concat(objs=[self._carry, df], ignore_index=True)
+        agg_df: DataFrame = self._aggregate(df=df)
+        # the latest bar of each symbol may still get data from the next chunk
+        is_last: np.ndarray = np.array(
+            agg_df["bucket"] == agg_df.groupby(by="sym")["bucket"].transform("max")
+        )
+        self._carry = agg_df.loc[
+            is_last, ["sym", "ts", "open", "high", "low", "close", "volume"]
+        ]
+        return agg_df.loc[
+            ~is_last, ["sym", "ts", "open", "high", "low", "close", "volume"]
+        ]
+
+    def flush(self) -> DataFrame:
+        """return the carried bars, to be called after the last chunk
+
+        Returns:
+            DataFrame: ['sym', 'ts', 'open', 'high', 'low', 'close', 'volume']
+        """
+        carry: DataFrame = self._empty() if self._carry is None else self._carry
+        self._carry = None
+        return carry
+
+    @staticmethod
+    def _empty() -> DataFrame:
+        return DataFrame(
+            columns=["sym", "ts", "open", "high", "low", "close", "volume"]
+        )
+
+
+def resample_ohlcv(
+    chunks: Iterable[DataFrame],
+    timeframes: list[str],
+) -> dict[str, DataFrame]:
+    """aggregate a stream of fine bars into many timeframes in one pass
+
+    Args:
+        chunks (Iterable[DataFrame]): ['sym', 'ts', 'open', 'high', 'low', 'close', 'volume'],
+        in time order, e.g. pages of 1m bars
+        timeframes (list[str]): target timeframes
+
+    Returns:
+        dict[str, DataFrame]: {timeframe: ['sym', 'ts', 'open', 'high', 'low', 'close', 'volume']}
+    """
+    resamplers: dict[str, OhlcvResampler] = {
+        k: OhlcvResampler(timeframe=k) for k in timeframes
+    }
+    bars: dict[str, list[DataFrame]] = {k: [] for k in timeframes}
+    for chunk in chunks:
+        for timeframe, resampler in resamplers.items():
+            bars[timeframe].append(resampler.update(chunk=chunk))
+    for timeframe, resampler in resamplers.items():
+        bars[timeframe].append(resampler.flush())
+    return {
+        timeframe: pd.concat(
+            objs=[k for k in bar_list if len(k)] or [OhlcvResampler._empty()],
+            ignore_index=True,
+        )
+        for timeframe, bar_list in bars.items()
+    }
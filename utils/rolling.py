@@ -0,0 +1,114 @@
+import numpy as np
+from pandas import DataFrame
+
+from utils.var import INTERVAL_MS_MAP
+
+DAY_MS: int = 24 * 60 * 60 * 1000
+
+
+def _window_sum(x: np.ndarray, window: int) -> np.ndarray:
+    """sum of x over the trailing window, NaN before the first full window"""
+    cs: np.ndarray = np.concatenate([[0.0], np.cumsum(x)])
+    out: np.ndarray = np.full(len(x), np.nan)
+    out[window - 1 :] = cs[window:] - cs[: len(x) - window + 1]
+    return out
+
+
+def rolling_max(x: np.ndarray, window: int) -> np.ndarray:
+    """max of x over the trailing window in O(n), van Herk/Gil-Werman algorithm
+
+    x is cut into blocks of window elements, any trailing window spans at most two
+    blocks, so its max is the max of a suffix max of one block and a prefix max of
+    the next one
+
+    Args:
+        x (np.ndarray): data without NaN
+        window (int): window length
+
+    Returns:
+        np.ndarray: trailing max, the max of the available data before the first full
+        window
+    """
+    n: int = len(x)
+    n_blocks: int = -(-n // window)
+    padded: np.ndarray = np.full(n_blocks * window, -np.inf)
+    padded[:n] = x
+    blocks: np.ndarray = padded.reshape(n_blocks, window)
+    prefix: np.ndarray = np.maximum.accumulate(blocks, axis=1).ravel()
+    suffix: np.ndarray = np.maximum.accumulate(blocks[:, ::-1], axis=1)[:, ::-1].ravel()
+    out: np.ndarray = np.maximum.accumulate(x[: window - 1]) if n else x
+    # window ending at i starts at i - window + 1
+    i: np.ndarray = np.arange(window - 1, n)
+    return np.concatenate([out, np.maximum(suffix[i - window + 1], prefix[i])])
+
+
+def rolling_metrics(
+    adj_ret: np.ndarray,
+    window: int,
+    scalar: float,
+) -> dict[str, np.ndarray]:
+    """trailing sharpe, volatility, drawdown and hit rate, all O(n)
+
+    sums are differences of cumulative sums and the trailing peak of the nav is a
+    rolling max, no window is ever visited element by element
+
+    Args:
+        adj_ret (np.ndarray): fee adjusted return
+        window (int): window length in periods
+        scalar (float): number of periods per year
+
+    Returns:
+        dict[str, np.ndarray]: {sharpe, vol, drawdown, hit_rate}, annualised sharpe
+        and vol, drawdown of the nav from its peak in the window, share of positive
+        returns, NaN before the first full window except for the drawdown
+    """
+    assert window >= 2, "window must have at least 2 periods"
+    assert not np.isnan(adj_ret).any()
+    # the variance is shift invariant, centring limits the cancellation in s2 - s1^2/w
+    centred: np.ndarray = adj_ret - adj_ret.mean()
+    c1: np.ndarray = _window_sum(x=centred, window=window)
+    c2: np.ndarray = _window_sum(x=centred**2, window=window)
+    std: np.ndarray = np.sqrt(np.maximum(c2 - c1**2 / window, 0) / (window - 1))
+    s1: np.ndarray = c1 + adj_ret.mean() * window
+    with np.errstate(divide="ignore", invalid="ignore"):
+        sharpe: np.ndarray = s1 / window / std * np.sqrt(scalar)
+    nav: np.ndarray = np.cumprod(1 + adj_ret)
+    return {
+        "sharpe": sharpe,
+        "vol": std * np.sqrt(scalar),
+        "drawdown": nav / rolling_max(x=nav, window=window) - 1,
+        "hit_rate": _window_sum(x=(adj_ret > 0).astype(np.float64), window=window)
+        / window,
+    }
+
+
+def rolling_report(
+    ts: np.ndarray,
+    adj_ret: np.ndarray,
+    timeframe: str,
+    scalar: float,
+    windows: list[float],
+) -> DataFrame:
+    """rolling metrics of several windows for the report
+
+    Args:
+        ts (np.ndarray): time
+        adj_ret (np.ndarray): fee adjusted return
+        timeframe (str): timeframe of adj_ret
+        scalar (float): number of periods per year
+        windows (list[float]): window lengths in days, windows longer than the data
+        are skipped
+
+    Returns:
+        DataFrame: ['ts', '{metric}_{window}d' for each metric and window]
+    """
+    rolling_df: DataFrame = DataFrame(data={"ts": ts})
+    for days in windows:
+        window: int = round(days * DAY_MS / INTERVAL_MS_MAP[timeframe])
+        if window < 2 or window > len(adj_ret):
+            continue
+        for metric, values in rolling_metrics(
+            adj_ret=adj_ret, window=window, scalar=scalar
+        ).items():
+            rolling_df[f"{metric}_{days}d"] = values
+    return rolling_df
@@ -0,0 +1,200 @@
+import hashlib
+import json
+import os
+from typing import Any
+
+import numpy as np
+from pandas import Timestamp, to_datetime
+
+from utils.ledger import IGNORED_CFG_KEYS
+from utils.var import STATE_DIR, ensure_dir
+
+# config keys that change from one run to the next of a backtest in append mode
+APPEND_CFG_KEYS: tuple[str, ...] = ("edate",)
+
+
+def _dump(value: Any) -> str:
+    return json.dumps(value, default=str, sort_keys=True)
+
+
+def state_key(cfg: dict, src_fp: str) -> str:
+    """identify a backtest continued across runs, its config without the end date
+    and the source code of its strategy
+
+    Args:
+        cfg (dict): config dict
+        src_fp (str): fingerprint of the strategy code, from
+        utils.cache.fingerprint_source
+
+    Returns:
+        str: hex digest
+    """
+    inputs: dict = {
+        k: v
+        for k, v in cfg.items()
+        if k not in IGNORED_CFG_KEYS and k not in APPEND_CFG_KEYS
+    }
+    return hashlib.sha1(_dump([inputs, src_fp]).encode()).hexdigest()
+
+
+def _state_fp(cfg: dict, src_fp: str, state_dir: str) -> str:
+    return os.path.join(state_dir, f"{state_key(cfg=cfg, src_fp=src_fp)}.json")
+
+
+def new_state(
+    last_ts: Timestamp,
+    adj_ret: np.ndarray,
+    ret: np.ndarray,
+    side: np.ndarray,
+    exec_cost: np.ndarray | None,
+    funding: np.ndarray | None,
+    nav: float,
+    drawdown: dict,
+    data_fp: str,
+    run_id: int,
+) -> dict:
+    """end state of a full backtest
+
+    Args:
+        last_ts (Timestamp): time of the last bar
+        adj_ret (np.ndarray): fee adjusted return
+        ret (np.ndarray): return without fee
+        side (np.ndarray): position of each bar, binance_side
+        exec_cost (np.ndarray | None): execution cost, None without execution model
+        funding (np.ndarray | None): funding cost, None without funding
+        nav (float): nav at the last bar
+        drawdown (dict): state from update_drawdown
+        data_fp (str): fingerprint of the data
+        run_id (int): run_id in the ledger
+
+    Returns:
+        dict: state
+    """
+    return {
+        "last_ts": last_ts,
+        **update_sums(
+            state={
+                "n": 0,
+                "sum": 0.0,
+                "sum_sq": 0.0,
+                "sum_down_sq": 0.0,
+                "sum_fee": 0.0,
+                "n_held": 0,
+                "n_hit": 0,
+                "n_entries": 0,
+                "sum_turnover": 0.0,
+                "last_side": 0.0,
+                "sum_cost": 0.0,
+                "sum_funding": 0.0,
+            },
+            adj_ret=adj_ret,
+            ret=ret,
+            side=side,
+            exec_cost=exec_cost,
+            funding=funding,
+        ),
+        "nav": nav,
+        "drawdown": drawdown,
+        "data_fp": data_fp,
+        "run_id": run_id,
+    }
+
+
+def update_sums(
+    state: dict,
+    adj_ret: np.ndarray,
+    ret: np.ndarray,
+    side: np.ndarray,
+    exec_cost: np.ndarray | None,
+    funding: np.ndarray | None,
+) -> dict:
+    """running sums of the metrics, extended by new bars
+
+    every metric of utils.metrics.batch_metrics but the max drawdown is a ratio of
+    these sums, see utils.metrics.sums_metrics
+
+    Args:
+        state (dict): state with the sums of the previous bars
+        adj_ret (np.ndarray): fee adjusted return of the new bars
+        ret (np.ndarray): return without fee of the new bars
+        side (np.ndarray): position of the new bars
+        exec_cost (np.ndarray | None): execution cost of the new bars
+        funding (np.ndarray | None): funding cost of the new bars
+
+    Returns:
+        dict: {n, sum, sum_sq, sum_down_sq, sum_fee, n_held, n_hit, n_entries,
+        sum_turnover, last_side, sum_cost, sum_funding}
+    """
+    side = np.asarray(side, dtype=np.float64)
+    prev_side: np.ndarray = np.concatenate([[state["last_side"]], side[:-1]])
+    held: np.ndarray = side != 0
+    return {
+        "n": state["n"] + len(adj_ret),
+        "sum": state["sum"] + float(np.sum(adj_ret)),
+        "sum_sq": state["sum_sq"] + float(np.sum(adj_ret**2)),
+        "sum_down_sq": state["sum_down_sq"]
+        + float(np.sum(np.minimum(adj_ret, 0) ** 2)),
+        "sum_fee": state["sum_fee"] + float(np.sum(ret - adj_ret)),
+        "n_held": state["n_held"] + int(held.sum()),
+        "n_hit": state["n_hit"] + int((held & (adj_ret > 0)).sum()),
+        # a trade starts when the side changes to a non zero side
+        "n_entries": state["n_entries"] + int((held & (side != prev_side)).sum()),
+        "sum_turnover": state["sum_turnover"] + float(np.abs(side - prev_side).sum()),
+        "last_side": float(side[-1]) if len(side) else state["last_side"],
+        "sum_cost": (
+            None
+            if exec_cost is None or state["sum_cost"] is None
+            else state["sum_cost"] + float(np.sum(exec_cost))
+        ),
+        "sum_funding": (
+            None
+            if funding is None or state["sum_funding"] is None
+            else state["sum_funding"] + float(np.sum(funding))
+        ),
+    }
+
+
+def save_state(cfg: dict, src_fp: str, state: dict, state_dir: str = STATE_DIR) -> None:
+    """save the end state of a backtest, written atomically
+
+    Args:
+        cfg (dict): config dict
+        src_fp (str): fingerprint of the strategy code
+        state (dict): state
+        state_dir (str, optional): state directory. Defaults to STATE_DIR.
+    """
+    fp: str = _state_fp(cfg=cfg, src_fp=src_fp, state_dir=ensure_dir(fdir=state_dir))
+    tmp_fp: str = f"{fp}.{os.getpid()}.tmp"
+    with open(file=tmp_fp, mode="w") as f:
+        f.write(_dump(state))
+    os.replace(src=tmp_fp, dst=fp)
+
+
+def load_state(cfg: dict, src_fp: str, state_dir: str = STATE_DIR) -> dict | None:
+    """end state of the previous run of the same backtest
+
+    Args:
+        cfg (dict): config dict
+        src_fp (str): fingerprint of the strategy code
+        state_dir (str, optional): state directory. Defaults to STATE_DIR.
+
+    Returns:
+        dict | None: state, None if the backtest never ran in append mode with the
+        same strategy code
+    """
+    fp: str = _state_fp(cfg=cfg, src_fp=src_fp, state_dir=state_dir)
+    if not os.path.exists(path=fp):
+        return None
+    with open(file=fp, mode="r") as f:
+        state: dict = json.load(fp=f)
+    # timestamps are saved as strings
+    state["last_ts"] = Timestamp(state["last_ts"])
+    time_cols: list[str] = ["peak_time", "trough_time", "recovery_time"]
+    for col in time_cols:
+        state["drawdown"]["open"][col] = to_datetime(
+            state["drawdown"]["open"][col], utc=True
+        )
+        state["drawdown"]["top"][col] = list(
+            to_datetime(state["drawdown"]["top"][col], utc=True)
+        )
+    return state
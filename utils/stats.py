@@ -0,0 +1,158 @@
+import math
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+# max number of elements materialised at once when computing block statistics
+CHUNK_SIZE: int = 1 << 22
+
+
+def _block_stats(adj_ret: np.ndarray, size: int) -> list[np.ndarray]:
+    """statistics of the circular blocks adj_ret[s: s + size] for every start s
+
+    Args:
+        adj_ret (np.ndarray): fee adjusted return
+        size (int): block size
+
+    Returns:
+        list[np.ndarray]: [sum of return, sum of squared return, sum of log return,
+        max prefix sum, min prefix sum and max drawdown of log return], one element
+        per start in each array
+    """
+    n: int = len(adj_ret)
+    # separate contiguous arrays, gathering one column is much faster than one row
+    stats: list[np.ndarray] = [np.empty(n) for _ in range(6)]
+    ext: np.ndarray = np.concatenate([adj_ret, adj_ret[: size - 1]])
+    for col, x in enumerate([ext, ext**2]):
+        cs: np.ndarray = np.concatenate([[0.0], np.cumsum(x)])
+        stats[col][:] = cs[size : size + n] - cs[:n]
+    cs = np.concatenate([[0.0], np.cumsum(np.log1p(ext))])
+    stats[2][:] = cs[size : size + n] - cs[:n]
+    # prefix sums of block s are cs[s + 1: s + size + 1] - cs[s]
+    windows: np.ndarray = sliding_window_view(x=cs[1:], window_shape=size)
+    step: int = max(1, CHUNK_SIZE // size)
+    for i in range(0, n, step):
+        j: int = min(i + step, n)
+        prefix: np.ndarray = windows[i:j] - cs[i:j, None]
+        stats[3][i:j] = prefix.max(axis=1)
+        stats[4][i:j] = prefix.min(axis=1)
+        stats[5][i:j] = (np.maximum.accumulate(prefix, axis=1) - prefix).max(axis=1)
+    return stats
+
+
+def bootstrap_metrics(
+    ret: np.ndarray,
+    adj_ret: np.ndarray,
+    scalar: float,
+    n_resamples: int = 10000,
+    block_size: int | None = None,
+    batch_size: int | None = None,
+    alpha: float = 0.05,
+    seed: int = 0,
+) -> dict[str, float]:
+    """confidence intervals of annual return, sharpe and max drawdown by circular
+    block bootstrap, and p-value of sharpe by randomising the side of each block
+
+    nothing is done per resample in python, the statistics of the block starting at
+    every period are computed once and the resamples combine them in batches
+
+    Args:
+        ret (np.ndarray): return without fee
+        adj_ret (np.ndarray): fee adjusted return
+        scalar (float): number of periods per year
+        n_resamples (int, optional): number of resamples. Defaults to 10000.
+        block_size (int | None, optional): block size, cube root of the number of
+        periods if None. Defaults to None.
+        batch_size (int | None, optional): number of resamples combined at once,
+        sized to keep CHUNK_SIZE elements per batch if None. Defaults to None.
+        alpha (float, optional): 1 - confidence level. Defaults to 0.05.
+        seed (int, optional): random seed. Defaults to 0.
+
+    Returns:
+        dict[str, float]: {annual_ret_lo, annual_ret_hi, annual_sr_lo, annual_sr_hi,
+        max_dd_lo, max_dd_hi, sr_pvalue}
+    """
+    assert len(ret) == len(adj_ret)
+    assert not np.isnan(adj_ret).any()
+    n: int = len(adj_ret)
+    size: int = block_size or max(1, round(n ** (1 / 3)))
+    size = min(size, n)
+    n_blocks: int = math.ceil(n / size)
+    # the last block only takes the remaining periods
+    last_size: int = n - (n_blocks - 1) * size
+    batch_size = batch_size or max(1, CHUNK_SIZE // n_blocks)
+    rng: np.random.Generator = np.random.default_rng(seed=seed)
+
+    """
+    1. statistics of every block, full size and last block size
+    """
+    full: list[np.ndarray] = _block_stats(adj_ret=adj_ret, size=size)
+    last: list[np.ndarray] = (
+        full if last_size == size else _block_stats(adj_ret=adj_ret, size=last_size)
+    )
+
+    """
+    2. combine the blocks of each resample, batch by batch
+    """
+    mean: np.ndarray = np.empty(n_resamples)
+    std: np.ndarray = np.empty(n_resamples)
+    max_dd: np.ndarray = np.empty(n_resamples)
+    for i in range(0, n_resamples, batch_size):
+        m: int = min(batch_size, n_resamples - i)
+        starts: np.ndarray = rng.integers(low=0, high=n, size=(m, n_blocks))
+        stats: list[np.ndarray] = []
+        for full_col, last_col in zip(full, last):
+            col: np.ndarray = full_col[starts]
+            col[:, -1] = last_col[starts[:, -1]]
+            stats.append(col)
+        total, sq_total, log_total, max_prefix, min_prefix, block_dd = stats
+        s1: np.ndarray = total.sum(axis=1)
+        s2: np.ndarray = sq_total.sum(axis=1)
+        mean[i : i + m] = s1 / n
+        std[i : i + m] = np.sqrt(np.maximum(s2 - s1**2 / n, 0) / (n - 1))
+        # log nav level before each block, and the peak of the nav up to each block
+        level: np.ndarray = np.cumsum(log_total, axis=1) - log_total
+        peak: np.ndarray = np.maximum.accumulate(level + max_prefix, axis=1)
+        # drawdown from a peak of a previous block, or from a peak inside the block
+        prev_peak: np.ndarray = np.concatenate(
+            [np.full((m, 1), -np.inf), peak[:, :-1]], axis=1
+        )
+        dd: np.ndarray = np.maximum(prev_peak - level - min_prefix, block_dd)
+        max_dd[i : i + m] = np.expm1(-dd.max(axis=1))
+
+    """
+    3. sharpe under the null of no skill, the side of each block is flipped at random
+    """
+    fee: np.ndarray = ret - adj_ret
+    block_id: np.ndarray = np.arange(n) // size
+    g: np.ndarray = np.bincount(block_id, weights=ret)
+    gf: np.ndarray = np.bincount(block_id, weights=ret * fee)
+    const_sq: float = float(np.sum(ret**2) + np.sum(fee**2))
+    null_sr: np.ndarray = np.empty(n_resamples)
+    for i in range(0, n_resamples, batch_size):
+        m = min(batch_size, n_resamples - i)
+        signs: np.ndarray = rng.integers(low=0, high=2, size=(m, n_blocks)) * 2.0 - 1
+        s1 = signs @ g - fee.sum()
+        s2 = const_sq - 2 * (signs @ gf)
+        null_std: np.ndarray = np.sqrt(np.maximum(s2 - s1**2 / n, 0) / (n - 1))
+        null_sr[i : i + m] = s1 / n / null_std * np.sqrt(scalar)
+
+    """
+    4. confidence intervals and p-value
+    """
+    annual_ret: np.ndarray = mean * scalar
+    annual_sr: np.ndarray = mean / std * np.sqrt(scalar)
+    sr: float = float(np.mean(adj_ret) / np.std(adj_ret, ddof=1) * np.sqrt(scalar))
+    q: list[float] = [alpha / 2, 1 - alpha / 2]
+    ret_lo, ret_hi = np.nanquantile(a=annual_ret, q=q)
+    sr_lo, sr_hi = np.nanquantile(a=annual_sr, q=q)
+    dd_lo, dd_hi = np.nanquantile(a=max_dd, q=q)
+    return {
+        "annual_ret_lo": float(ret_lo),
+        "annual_ret_hi": float(ret_hi),
+        "annual_sr_lo": float(sr_lo),
+        "annual_sr_hi": float(sr_hi),
+        "max_dd_lo": float(dd_lo),
+        "max_dd_hi": float(dd_hi),
+        "sr_pvalue": float(np.mean(null_sr >= sr)),
+    }
@@ -0,0 +1,435 @@
+from datetime import timezone
+from typing import Callable, Iterator, Literal
+
+import numpy as np
+import pandas as pd
+from pandas import DataFrame, Timedelta, Timestamp, to_datetime
+
+from utils.barstore import BarStore
+from utils.dframe import padding_id_time
+from utils.exchange import client
+from utils.loader import BAR_STORE
+from utils.log import logger
+from utils.valid import check_cols
+from utils.var import INTERVAL_MS_MAP
+
+TRADE_COLS: list[str] = ["sym", "ts", "price", "amount", "side"]
+TRADE_BAR_COLS: list[str] = ["vwap", "volume", "count", "signed_volume"]
+
+
+def trade_timeframe(timeframe: str) -> str:
+    """name of the trade bars of a timeframe in the bar store, next to the OHLCV bars"""
+    return f"trades_{timeframe}"
+
+
+def _ms(ts: Timestamp) -> int:
+    return int(ts.value // 10**6)
+
+
+def _trade_frame(
+    ts_ms: np.ndarray,
+    price: np.ndarray,
+    amount: np.ndarray,
+    side: np.ndarray,
+    symbol: str,
+) -> DataFrame:
+    return DataFrame(
+        data={
+            "sym": symbol,
+            "ts": to_datetime(ts_ms, unit="ms", utc=True),
+            "price": np.asarray(price, dtype=np.float64),
+            "amount": np.asarray(amount, dtype=np.float64),
+            "side": side,
+        }
+    )
+
+
+def iter_trades(
+    stime: Timestamp,
+    etime: Timestamp,
+    exchange: Literal["okx", "binance", "bybit"],
+    symbol: str = "BTC/USDT:USDT",
+    limit: int = 1000,
+) -> Iterator[DataFrame]:
+    """fetch cex public trades page by page
+
+    each page starts at the last timestamp of the previous one, the trades of that
+    millisecond already yielded are dropped by id. A full page of only those trades
+    means the millisecond may hold more trades than a page, which can't be paged by
+    time, the next page starts at the next millisecond with a warning instead of
+    stopping there. Paging stops only at etime or when the cex has no later trade.
+
+    Args:
+        stime (Timestamp): start time
+        etime (Timestamp): end time, included
+        exchange (Literal[okx, binance, bybit]): cex
+        symbol (str, optional): ccxt symbol. Defaults to "BTC/USDT:USDT".
+        limit (int, optional): trades per api request. Defaults to 1000.
+
+    Yields:
+        Iterator[DataFrame]: ['sym', 'ts', 'price', 'amount', 'side'], one dataframe
+        per api request
+    """
+    since: int = _ms(ts=stime)
+    end: int = _ms(ts=etime)
+    # ids of the trades at the since millisecond, already yielded
+    seen: set = set()
+    while since <= end:
+        with client(exchange=exchange) as cex:
+            response: list[dict] = cex.fetch_trades(
+                symbol=symbol, since=since, limit=limit
+            )
+        ts_ms: np.ndarray = np.array([k["timestamp"] for k in response], dtype=np.int64)
+        ids: np.ndarray = np.array([str(k["id"]) for k in response], dtype=object)
+        new: np.ndarray = (ts_ms >= since) & ~np.isin(ids, list(seen))
+        if not new.any():
+            # no trade after the ones already yielded
+            if len(response) < limit:
+                break
+            logger.warning(
+                msg=f"{exchange} {symbol} trades at {since} ms fill a page of {limit},"
+                " the trades past it may be missing"
+            )
+            since += 1
+            seen = set()
+            continue
+        last: int = int(ts_ms[new].max())
+        seen = set(ids[new & (ts_ms == last)]) | (seen if last == since else set())
+        since = last
+        keep: np.ndarray = new & (ts_ms <= end)
+        yield _trade_frame(
+            ts_ms=ts_ms[keep],
+            price=np.array([k["price"] for k in response])[keep],
+            amount=np.array([k["amount"] for k in response])[keep],
+            side=np.array([k["side"] for k in response], dtype=object)[keep],
+            symbol=symbol,
+        )
+        if last > end:
+            break
+
+
+def iter_trade_file(
+    fp: str,
+    stime: Timestamp,
+    etime: Timestamp,
+    exchange: str = "",
+    symbol: str = "BTC/USDT:USDT",
+    chunk_size: int = 1 << 20,
+) -> Iterator[DataFrame]:
+    """read trades from a local csv or parquet file chunk by chunk, stand-in for
+    iter_trades with dumped or synthetic trades
+
+    Args:
+        fp (str): file with columns ts (int ms), price, amount, side, in time order
+        stime (Timestamp): start time
+        etime (Timestamp): end time, included
+        exchange (str, optional): unused, same signature as iter_trades. Defaults to "".
+        symbol (str, optional): ccxt symbol of the trades. Defaults to "BTC/USDT:USDT".
+        chunk_size (int, optional): max trades per dataframe. Defaults to 1 << 20.
+
+    Yields:
+        Iterator[DataFrame]: ['sym', 'ts', 'price', 'amount', 'side']
+    """
+    if fp.endswith(".parquet"):
+        import pyarrow.parquet as pq
+
+        chunks: Iterator[DataFrame] = (
+            k.to_pandas()
+            for k in pq.ParquetFile(source=fp).iter_batches(batch_size=chunk_size)
+        )
+    else:
+        chunks = pd.read_csv(filepath_or_buffer=fp, chunksize=chunk_size)
+    start, end = _ms(ts=stime), _ms(ts=etime)
+    for chunk in chunks:
+        ts_ms: np.ndarray = np.asarray(chunk["ts"], dtype=np.int64)
+        keep: np.ndarray = (ts_ms >= start) & (ts_ms <= end)
+        if keep.any():
+            yield _trade_frame(
+                ts_ms=ts_ms[keep],
+                price=np.asarray(chunk["price"])[keep],
+                amount=np.asarray(chunk["amount"])[keep],
+                side=np.asarray(chunk["side"], dtype=object)[keep],
+                symbol=symbol,
+            )
+        if ts_ms[-1] > end:
+            break
+
+
+class TradeBarAggregator:
+    """streaming aggregation of trades into bars of a timeframe
+
+    same scheme as OhlcvResampler: each chunk is aggregated in one vectorised
+    groupby into sums of price * amount, amount, trades and signed amount, and only
+    the last bar of each symbol, which may still get trades, is carried over
+    """
+
+    SUM_COLS: list[str] = ["pv", "volume", "count", "signed_volume"]
+
+    def __init__(self, timeframe: str):
+        assert timeframe in INTERVAL_MS_MAP.keys(), "Incorrect interval"
+        self.timeframe: str = timeframe
+        self.interval_ms: int = INTERVAL_MS_MAP[timeframe]
+        # sums of the last bar of each symbol, ['sym', 'bucket', SUM_COLS]
+        self._carry: DataFrame | None = None
+
+    def _bars(self, sums: DataFrame) -> DataFrame:
+        bars: DataFrame = DataFrame(
+            data={
+                "sym": sums["sym"].values,
+                "ts": to_datetime(sums["bucket"].values, unit="ms", utc=True),
+                "vwap": (sums["pv"] / sums["volume"]).values,
+                "volume": sums["volume"].values,
+                "count": sums["count"].values,
+                "signed_volume": sums["signed_volume"].values,
+            }
+        )
+        return bars
+
+    def update(self, chunk: DataFrame) -> DataFrame:
+        """aggregate a chunk of trades
+
+        Args:
+            chunk (DataFrame): ['sym', 'ts', 'price', 'amount', 'side'], later than
+            all the previous chunks
+
+        Returns:
+            DataFrame: ['sym', 'ts', 'vwap', 'volume', 'count', 'signed_volume'] of
+            the completed bars
+        """
+        check_cols(df=chunk, cols=TRADE_COLS, checkRedundancy=False)
+        if not len(chunk):
+            return self._bars(sums=self._empty())
+        ts_ms: np.ndarray = chunk["ts"].values.astype("datetime64[ms]").astype(np.int64)
+        amount: np.ndarray = np.asarray(chunk["amount"], dtype=np.float64)
+        sign: np.ndarray = np.select(
+            condlist=[chunk["side"] == "buy", chunk["side"] == "sell"],
+            choicelist=[1.0, -1.0],
+            default=0.0,
+        )
+        sums: DataFrame = DataFrame(
+            data={
+                "sym": chunk["sym"].values,
+                "bucket": ts_ms - ts_ms % self.interval_ms,
+                "pv": np.asarray(chunk["price"], dtype=np.float64) * amount,
+                "volume": amount,
+                "count": 1.0,
+                "signed_volume": sign * amount,
+            }
+        )
+        if self._carry is not None:
+            # sums of a partial bar combine with the sums of its next trades
+            sums = pd.concat(objs=[self._carry, sums], ignore_index=True)
+        sums = sums.groupby(by=["sym", "bucket"], sort=False)[self.SUM_COLS].sum()
+        sums = sums.reset_index()
+        # the latest bar of each symbol may still get trades from the next chunk
+        is_last: np.ndarray = np.array(
+            sums["bucket"] == sums.groupby(by="sym")["bucket"].transform("max")
+        )
+        self._carry = sums[is_last]
+        return self._bars(sums=sums[~is_last])
+
+    def flush(self) -> DataFrame:
+        """return the carried bars, to be called after the last chunk
+
+        Returns:
+            DataFrame: ['sym', 'ts', 'vwap', 'volume', 'count', 'signed_volume']
+        """
+        carry: DataFrame = self._empty() if self._carry is None else self._carry
+        self._carry = None
+        return self._bars(sums=carry)
+
+    @classmethod
+    def _empty(cls) -> DataFrame:
+        return DataFrame(columns=["sym", "bucket"] + cls.SUM_COLS)
+
+
+def _pad_bars(
+    bars: DataFrame, start_ms: int, end_ms: int, interval_ms: int
+) -> DataFrame:
+    """bars of one symbol on the full grid [start_ms, end_ms), no trades gives a bar
+    with 0 volume and count and NA vwap"""
+    grid: np.ndarray = np.arange(start_ms, end_ms, interval_ms, dtype=np.int64)
+    padded: DataFrame = (
+        bars.assign(bucket=bars["ts"].values.astype("datetime64[ms]").astype(np.int64))
+        .set_index(keys="bucket")[TRADE_BAR_COLS]
+        .reindex(index=grid)
+    )
+    padded[["volume", "count", "signed_volume"]] = padded[
+        ["volume", "count", "signed_volume"]
+    ].fillna(value=0.0)
+    padded.insert(loc=0, column="ts", value=to_datetime(grid, unit="ms", utc=True))
+    return padded.reset_index(drop=True)
+
+
+def _iter_trade_bars(
+    start_ms: int,
+    end_ms: int,
+    timeframe: str,
+    exchange: Literal["okx", "binance", "bybit"],
+    symbol: str,
+    trades: Callable[..., Iterator[DataFrame]],
+) -> Iterator[DataFrame]:
+    """bars of [start_ms, end_ms) on the full time grid, streamed from the trades
+    through a TradeBarAggregator, one dataframe per chunk of trades
+
+    Yields:
+        Iterator[DataFrame]: ['sym', 'ts', 'vwap', 'volume', 'count', 'signed_volume']
+    """
+    interval_ms: int = INTERVAL_MS_MAP[timeframe]
+    aggregator: TradeBarAggregator = TradeBarAggregator(timeframe=timeframe)
+    # start of the first bar not yielded yet
+    next_ms: int = start_ms
+
+    def emit(bars: DataFrame, until_ms: int) -> DataFrame:
+        padded: DataFrame = _pad_bars(
+            bars=bars, start_ms=next_ms, end_ms=until_ms, interval_ms=interval_ms
+        )
+        padded.insert(loc=0, column="sym", value=symbol)
+        return padded
+
+    for chunk in trades(
+        stime=to_datetime(start_ms, unit="ms", utc=True),
+        etime=to_datetime(end_ms - 1, unit="ms", utc=True),
+        exchange=exchange,
+        symbol=symbol,
+    ):
+        bars: DataFrame = aggregator.update(chunk=chunk)
+        if not len(bars):
+            continue
+        until_ms: int = _ms(ts=bars["ts"].iloc[-1]) + interval_ms
+        yield emit(bars=bars, until_ms=until_ms)
+        next_ms = until_ms
+    yield emit(bars=aggregator.flush(), until_ms=end_ms)
+
+
+def iter_stored_trade_bars(
+    stime: Timestamp,
+    etime: Timestamp,
+    exchange: Literal["okx", "binance", "bybit"],
+    symbol: str = "BTC/USDT:USDT",
+    timeframe: str = "15m",
+    trades: Callable[..., Iterator[DataFrame]] = iter_trades,
+    store: BarStore = BAR_STORE,
+) -> Iterator[DataFrame]:
+    """trade bars through the bar store
+
+    bars in the ranges the store covers are read from it, the trades of the ranges
+    it doesn't cover, before, between or after the stored ones, are streamed through
+    a TradeBarAggregator, and the complete bars are written to the store on the full
+    time grid, so a bar without trades is still known to be covered. Only one bar
+    per symbol is held in memory besides the current chunk of trades.
+
+    Args:
+        stime (Timestamp): start time
+        etime (Timestamp): end time, ts of the last bar
+        exchange (Literal[okx, binance, bybit]): cex
+        symbol (str, optional): ccxt symbol. Defaults to "BTC/USDT:USDT".
+        timeframe (str, optional): timeframe. Defaults to "15m".
+        trades (Callable[..., Iterator[DataFrame]], optional): trade source,
+        func(stime, etime, exchange, symbol), e.g. iter_trade_file with its fp bound.
+        Defaults to iter_trades.
+        store (BarStore, optional): bar store. Defaults to BAR_STORE.
+
+    Yields:
+        Iterator[DataFrame]: ['sym', 'ts', 'vwap', 'volume', 'count', 'signed_volume']
+    """
+    interval_ms: int = INTERVAL_MS_MAP[timeframe]
+    now_ms: int = _ms(ts=Timestamp.now(tz=timezone.utc))
+    yield from store.iter_through(
+        exchange=exchange,
+        symbol=symbol,
+        timeframe=trade_timeframe(timeframe=timeframe),
+        stime=stime,
+        etime=etime,
+        # s and e are the first and last bar of a missing range
+        fetch=lambda s, e: _iter_trade_bars(
+            start_ms=_ms(ts=s),
+            end_ms=_ms(ts=e) + interval_ms,
+            timeframe=timeframe,
+            exchange=exchange,
+            symbol=symbol,
+            trades=trades,
+        ),
+        # bars ending after now are still changing, they are returned but not stored
+        complete=to_datetime(
+            now_ms - now_ms % interval_ms - interval_ms, unit="ms", utc=True
+        ),
+        step_ms=interval_ms,
+    )
+
+
+def load_trade_bars(
+    stime: Timestamp,
+    etime: Timestamp,
+    exchange: Literal["okx", "binance", "bybit"],
+    symbols: list[str] = ["BTC/USDT:USDT"],
+    timeframe: str = "15m",
+    trades: Callable[..., Iterator[DataFrame]] = iter_trades,
+    store: BarStore | None = BAR_STORE,
+) -> DataFrame:
+    """get VWAP, volume, trade count and signed volume bars from the public trades
+
+    Args:
+        stime (Timestamp): start time
+        etime (Timestamp): end time
+        exchange (Literal[okx, binance, bybit]): cex
+        symbols (list[str], optional): ccxt symbols. Defaults to ["BTC/USDT:USDT"].
+        timeframe (str, optional): timeframe. Defaults to "15m".
+        trades (Callable[..., Iterator[DataFrame]], optional): trade source. Defaults
+        to iter_trades.
+        store (BarStore | None, optional): bar store, trades are aggregated without
+        storing the bars if None. Defaults to BAR_STORE.
+
+    Returns:
+        DataFrame: ['sym', 'ts', 'vwap', 'volume', 'count', 'signed_volume'], vwap is
+        NA for bars without trades
+    """
+    interval_ts: Timedelta = Timedelta(
+        value=INTERVAL_MS_MAP[timeframe], unit="millisecond"
+    )
+    bar_list: list[DataFrame] = []
+    for symbol in symbols:
+        if store is None:
+            aggregator: TradeBarAggregator = TradeBarAggregator(timeframe=timeframe)
+            chunks: list[DataFrame] = [
+                aggregator.update(chunk=k)
+                for k in trades(
+                    stime=stime,
+                    # the last bar gets the trades up to its end
+                    etime=etime + interval_ts - Timedelta(value=1, unit="millisecond"),
+                    exchange=exchange,
+                    symbol=symbol,
+                )
+            ] + [aggregator.flush()]
+        else:
+            chunks = list(
+                iter_stored_trade_bars(
+                    stime=stime,
+                    etime=etime,
+                    exchange=exchange,
+                    symbol=symbol,
+                    timeframe=timeframe,
+                    trades=trades,
+                    store=store,
+                )
+            )
+        sym_bars: DataFrame = pd.concat(
+            objs=[k for k in chunks if len(k)]
+            or [DataFrame(columns=["sym", "ts"] + TRADE_BAR_COLS)],
+            ignore_index=True,
+        )
+        # bars without trades are not missing data
+        sym_bars = padding_id_time(
+            df=sym_bars.assign(sym=symbol),
+            freq=interval_ts,
+            s_ts=stime,
+            e_ts=etime,
+            check_missing_data=False,
+        )
+        bar_list.append(sym_bars)
+
+    bars: DataFrame = pd.concat(objs=bar_list, ignore_index=True)
+    bars[["volume", "count", "signed_volume"]] = bars[
+        ["volume", "count", "signed_volume"]
+    ].fillna(value=0.0)
+    return bars[(bars["ts"] >= stime) & (bars["ts"] <= etime)].reset_index(drop=True)
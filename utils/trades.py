@@ -0,0 +1,158 @@
+import os
+
+import numpy as np
+from pandas import NaT, DataFrame, Series, read_parquet
+
+from utils.var import TRADES_DIR, ensure_dir
+
+TRADE_COLS: list[str] = [
+    "entry_ts",
+    "exit_ts",
+    "direction",
+    "side",
+    "bars",
+    "gross_ret",
+    "fee",
+    "net_ret",
+]
+
+
+def build_trades(
+    ts: Series,
+    side: np.ndarray,
+    ret: np.ndarray,
+    adj_ret: np.ndarray,
+) -> DataFrame:
+    """trade ledger of a backtest, one row per run of the same non zero side
+
+    the side series is run length encoded, every run of equal non zero sides is a
+    trade entered at its first bar and exited at the first bar after it. The fee of a
+    bar where the side changes, ret - adj_ret, is split between the trade closed and
+    the trade opened in proportion to the size of each, the fees of the other bars go
+    to the trade holding them. Everything is a reduction over the run boundaries, no
+    python loop over the bars or the trades.
+
+    Args:
+        ts (Series): time of each bar
+        side (np.ndarray): position of each bar, binance_side
+        ret (np.ndarray): return of each bar without fee
+        adj_ret (np.ndarray): fee adjusted return of each bar
+
+    Returns:
+        DataFrame: TRADE_COLS, exit_ts is NA for a trade still open at the last bar,
+        gross_ret, fee and net_ret are sums of the returns of the bars
+    """
+    side = np.asarray(side, dtype=np.float64)
+    ret = np.asarray(ret, dtype=np.float64)
+    n: int = len(side)
+    assert len(ts) == n and len(ret) == n and len(adj_ret) == n
+    if n == 0 or not side.any():
+        return DataFrame(columns=TRADE_COLS)
+
+    """
+    1. run length encoding of the side
+    """
+    prev_side: np.ndarray = np.concatenate([[0.0], side[:-1]])
+    change: np.ndarray = side != prev_side
+    change[0] = True
+    run_starts: np.ndarray = np.flatnonzero(change)
+    run_ends: np.ndarray = np.append(run_starts[1:], n)
+    run_side: np.ndarray = side[run_starts]
+
+    """
+    2. fees of the bars, the closing part of a side change goes to the previous run
+    """
+    fee: np.ndarray = ret - np.asarray(adj_ret, dtype=np.float64)
+    size: np.ndarray = np.abs(side) + np.abs(prev_side)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        close_share: np.ndarray = np.where(
+            change & (size > 0), np.abs(prev_side) / size, 0.0
+        )
+    close_fee: np.ndarray = fee * close_share
+    run_fee: np.ndarray = np.add.reduceat(fee - close_fee, run_starts)
+    run_fee[:-1] += close_fee[run_starts[1:]]
+    run_ret: np.ndarray = np.add.reduceat(ret, run_starts)
+
+    """
+    3. keep the runs in position
+    """
+    held: np.ndarray = run_side != 0
+    starts: np.ndarray = run_starts[held]
+    ends: np.ndarray = run_ends[held]
+    time: Series = ts.reset_index(drop=True)
+    trades_df: DataFrame = DataFrame(
+        data={
+            "entry_ts": time.iloc[starts].reset_index(drop=True),
+            # the bar after the trade, NA while still open
+            "exit_ts": time.iloc[np.minimum(ends, n - 1)]
+            .where(cond=np.array(ends < n), other=NaT)
+            .reset_index(drop=True),
+            "direction": np.sign(run_side[held]).astype(np.int8),
+            "side": run_side[held],
+            "bars": ends - starts,
+            "gross_ret": run_ret[held],
+            "fee": run_fee[held],
+        }
+    )
+    trades_df["net_ret"] = trades_df["gross_ret"] - trades_df["fee"]
+    return trades_df
+
+
+def trade_stats(trades_df: DataFrame) -> dict[str, float]:
+    """summary statistics of a trade ledger
+
+    Args:
+        trades_df (DataFrame): from build_trades
+
+    Returns:
+        dict[str, float]: {stat: value}, NA without any trade
+    """
+    net_ret: np.ndarray = np.array(trades_df["net_ret"], dtype=np.float64)
+    wins: np.ndarray = net_ret[net_ret > 0]
+    losses: np.ndarray = net_ret[net_ret < 0]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return {
+            "n_trades": float(len(net_ret)),
+            "n_long": float((trades_df["direction"] > 0).sum()),
+            "n_short": float((trades_df["direction"] < 0).sum()),
+            "win_rate": len(wins) / len(net_ret) if len(net_ret) else np.nan,
+            "avg_trade_ret": float(net_ret.mean()) if len(net_ret) else np.nan,
+            "avg_win": float(wins.mean()) if len(wins) else np.nan,
+            "avg_loss": float(losses.mean()) if len(losses) else np.nan,
+            "profit_factor": float(wins.sum() / np.abs(losses.sum())),
+            "avg_bars": float(trades_df["bars"].mean()) if len(net_ret) else np.nan,
+            "max_bars": float(trades_df["bars"].max()) if len(net_ret) else np.nan,
+            "avg_trade_fee": float(trades_df["fee"].mean()) if len(net_ret) else np.nan,
+        }
+
+
+def save_trades(
+    run_id: int, trades_df: DataFrame, trades_dir: str = TRADES_DIR
+) -> None:
+    """save the trade ledger of a run as {run_id}.parquet
+
+    Args:
+        run_id (int): run_id in the ledger
+        trades_df (DataFrame): from build_trades
+        trades_dir (str, optional): trades directory. Defaults to TRADES_DIR.
+    """
+    fp: str = os.path.join(ensure_dir(fdir=trades_dir), f"{run_id}.parquet")
+    tmp_fp: str = f"{fp}.{os.getpid()}.tmp"
+    trades_df.to_parquet(path=tmp_fp, index=False)
+    os.replace(src=tmp_fp, dst=fp)
+
+
+def load_trades(run_id: int, trades_dir: str = TRADES_DIR) -> DataFrame | None:
+    """trade ledger of a run saved by save_trades
+
+    Args:
+        run_id (int): run_id in the ledger
+        trades_dir (str, optional): trades directory. Defaults to TRADES_DIR.
+
+    Returns:
+        DataFrame | None: TRADE_COLS, None if the run saved no trade ledger
+    """
+    fp: str = os.path.join(trades_dir, f"{run_id}.parquet")
+    if not os.path.exists(path=fp):
+        return None
+    return read_parquet(path=fp)
@@ -23,9 +23,38 @@ CFG_DIR: str = os.path.join(REPO_DIR, "config")
 DATA_DIR: str = os.path.join(REPO_DIR, "output")
 REPORT_DIR: str = os.path.join(DATA_DIR, "report")
 LOG_DIR: str = os.path.join(DATA_DIR, "logs")
-MISSING_DATA_DIR: str = os.path.join(DATA_DIR, "missing")
+MISSING_DATA_FP: str = os.path.join(DATA_DIR, "missing.sqlite")
 DEBUG_DIR: str = os.path.join(DATA_DIR, "debug")
+CACHE_DIR: str = os.path.join(DATA_DIR, "cache")
+CALLBACK_CACHE_DIR: str = os.path.join(CACHE_DIR, "callback")
+FEATURE_CACHE_DIR: str = os.path.join(CACHE_DIR, "feature")
+MARKETS_CACHE_DIR: str = os.path.join(CACHE_DIR, "markets")
+BAR_STORE_DIR: str = os.path.join(DATA_DIR, "bars")
+STATE_DIR: str = os.path.join(DATA_DIR, "state")
+LEDGER_FP: str = os.path.join(DATA_DIR, "ledger.sqlite")
+RETURNS_DIR: str = os.path.join(DATA_DIR, "returns")
+TRADES_DIR: str = os.path.join(DATA_DIR, "trades")
+DAEMON_SOCKET_FP: str = os.path.join(DATA_DIR, "daemon.sock")
+QUEUE_DIR: str = os.path.join(DATA_DIR, "queue")
 
-for fdir in (DATA_DIR, REPORT_DIR, LOG_DIR, MISSING_DATA_DIR, DEBUG_DIR):
-    if not os.path.exists(path=fdir):
-        os.makedirs(name=fdir)
+# default size cap of the callback output cache, in megabytes
+CALLBACK_CACHE_MB: int = 1024
+# default size cap of the feature store, in megabytes
+FEATURE_CACHE_MB: int = 1024
+# max age of the cached exchange markets, in seconds
+MARKETS_CACHE_TTL: int = 60 * 60 * 24
+
+
+def ensure_dir(fdir: str) -> str:
+    """create the directory if it doesn't exist
+
+    output directories are created on first use rather than at import time
+
+    Args:
+        fdir (str): directory
+
+    Returns:
+        str: fdir
+    """
+    os.makedirs(name=fdir, exist_ok=True)
+    return fdir
@@ -0,0 +1,356 @@
+import hashlib
+import json
+import os
+import socket
+import threading
+import time
+import traceback
+from contextlib import contextmanager
+from typing import Any, Iterator
+
+import pandas as pd
+import yaml
+from pandas import DataFrame
+
+from utils.log import logger
+from utils.var import QUEUE_DIR, ensure_dir
+
+# states of a work unit, one directory each
+STATES: list[str] = ["pending", "claimed", "done", "failed"]
+
+# seconds without heartbeat after which a claimed unit is given to another worker
+LEASE_SECONDS: float = 60.0
+
+# runs of a unit before it is moved to failed
+MAX_ATTEMPTS: int = 3
+
+# seconds between two looks at an empty queue
+POLL_INTERVAL: float = 1.0
+
+
+def unit_id(cfg: dict) -> str:
+    """id of a work unit, the same config always gets the same id
+
+    Args:
+        cfg (dict): config dict
+
+    Returns:
+        str: hex digest
+    """
+    return hashlib.sha1(
+        json.dumps(cfg, sort_keys=True, default=str).encode()
+    ).hexdigest()
+
+
+class WorkQueue:
+    """queue of backtests shared through a directory
+
+    a unit is one yaml file, {state}/{id}.yml, moved between the state directories by
+    os.rename, which is atomic, so of many workers claiming the same unit exactly one
+    succeeds. Workers on other hosts only need the directory, e.g. on a network file
+    system. A claimed unit is kept alive by touching its file, a unit whose worker
+    stopped touching it for lease seconds goes back to pending, a failed run is
+    retried until max_attempts. Units are keyed by the hash of their config, a config
+    submitted again while queued or done is not run twice.
+    """
+
+    def __init__(
+        self,
+        queue_dir: str = QUEUE_DIR,
+        lease: float = LEASE_SECONDS,
+        max_attempts: int = MAX_ATTEMPTS,
+    ):
+        self.queue_dir: str = queue_dir
+        self.lease: float = lease
+        self.max_attempts: int = max_attempts
+        for state in STATES:
+            ensure_dir(fdir=os.path.join(queue_dir, state))
+        # series of the units done, so the results are compared on any host
+        ensure_dir(fdir=os.path.join(queue_dir, "series"))
+
+    def _fp(self, state: str, uid: str) -> str:
+        return os.path.join(self.queue_dir, state, f"{uid}.yml")
+
+    def _ids(self, state: str) -> list[str]:
+        """ids of the units in a state, oldest first"""
+        fps: list[tuple[float, str]] = []
+        for entry in os.scandir(os.path.join(self.queue_dir, state)):
+            if entry.name.endswith(".yml"):
+                try:
+                    fps.append((entry.stat().st_mtime, entry.name[:-4]))
+                except FileNotFoundError:
+                    # moved by another worker meanwhile
+                    continue
+        return [uid for _, uid in sorted(fps)]
+
+    @staticmethod
+    def _write(fp: str, unit: dict) -> None:
+        """write a unit file, through a temp file so it's never read half written"""
+        tmp_fp: str = f"{fp}.{socket.gethostname()}.{os.getpid()}.tmp"
+        with open(file=tmp_fp, mode="w") as f:
+            yaml.safe_dump(data=unit, stream=f, sort_keys=False)
+        os.replace(src=tmp_fp, dst=fp)
+
+    def _read(self, state: str, uid: str) -> dict:
+        with open(file=self._fp(state=state, uid=uid), mode="r") as f:
+            return yaml.safe_load(stream=f)
+
+    def state(self, uid: str) -> str | None:
+        """state of a unit, None if unknown"""
+        for state in STATES:
+            if os.path.exists(path=self._fp(state=state, uid=uid)):
+                return state
+        return None
+
+    def submit(self, cfgs: dict[str, dict], retry_failed: bool = False) -> list[str]:
+        """add backtests to the queue
+
+        Args:
+            cfgs (dict[str, dict]): {name: config dict}, name is only informative, e.g.
+            the config file path
+            retry_failed (bool, optional): queue again the units that failed before.
+            Defaults to False.
+
+        Returns:
+            list[str]: ids of the units added, the others are already queued or done
+        """
+        added: list[str] = []
+        for name, cfg in cfgs.items():
+            uid: str = unit_id(cfg=cfg)
+            state: str | None = self.state(uid=uid)
+            if state == "failed" and retry_failed:
+                os.remove(path=self._fp(state="failed", uid=uid))
+            elif state is not None:
+                continue
+            self._write(
+                fp=self._fp(state="pending", uid=uid),
+                unit={"name": name, "attempts": 0, "cfg": cfg},
+            )
+            added.append(uid)
+        return added
+
+    def claim(self) -> tuple[str, dict] | None:
+        """take the oldest pending unit
+
+        Returns:
+            tuple[str, dict] | None: id and unit, None if nothing is pending
+        """
+        for uid in self._ids(state="pending"):
+            try:
+                # the lease starts now, not when the unit was queued, set before the
+                # rename so a claimed file never shows the time it was queued
+                os.utime(path=self._fp(state="pending", uid=uid))
+                os.rename(
+                    src=self._fp(state="pending", uid=uid),
+                    dst=self._fp(state="claimed", uid=uid),
+                )
+            except FileNotFoundError:
+                # claimed by another worker first
+                continue
+            if os.path.exists(path=self._fp(state="done", uid=uid)):
+                # finished by a worker whose lease had expired, don't run it again
+                os.remove(path=self._fp(state="claimed", uid=uid))
+                continue
+            return uid, self._read(state="claimed", uid=uid)
+        return None
+
+    @contextmanager
+    def heartbeat(self, uid: str) -> Iterator[None]:
+        """keep the lease of a claimed unit alive while the block runs
+
+        Args:
+            uid (str): unit id
+        """
+        stopped: threading.Event = threading.Event()
+
+        def beat() -> None:
+            while not stopped.wait(timeout=self.lease / 3):
+                try:
+                    os.utime(path=self._fp(state="claimed", uid=uid))
+                except FileNotFoundError:
+                    return
+
+        thread: threading.Thread = threading.Thread(target=beat, daemon=True)
+        thread.start()
+        try:
+            yield
+        finally:
+            stopped.set()
+            thread.join()
+
+    def complete(self, uid: str, unit: dict, result: dict[str, Any]) -> None:
+        """move a claimed unit to done with its result
+
+        Args:
+            uid (str): unit id
+            unit (dict): unit from claim
+            result (dict[str, Any]): result of the run
+        """
+        self._write(fp=self._fp(state="done", uid=uid), unit={**unit, "result": result})
+        try:
+            os.remove(path=self._fp(state="claimed", uid=uid))
+        except FileNotFoundError:
+            pass
+
+    def fail(self, uid: str, unit: dict, error: str, src_fp: str | None = None) -> None:
+        """give a failed unit back to pending, or move it to failed after
+        max_attempts
+
+        Args:
+            uid (str): unit id
+            unit (dict): unit from claim
+            error (str): traceback of the failure
+            src_fp (str | None, optional): file of the unit, its claimed file if None.
+            Defaults to None.
+        """
+        src_fp = src_fp or self._fp(state="claimed", uid=uid)
+        if not os.path.exists(path=src_fp):
+            # lease expired meanwhile, already requeued by another worker
+            return
+        unit = {**unit, "attempts": unit["attempts"] + 1, "error": error}
+        state: str = "failed" if unit["attempts"] >= self.max_attempts else "pending"
+        # update the file in place then move it, it's never in two states at once
+        self._write(fp=src_fp, unit=unit)
+        os.rename(src=src_fp, dst=self._fp(state=state, uid=uid))
+
+    def requeue_expired(self) -> list[str]:
+        """give the claimed units of workers that stopped heartbeating to the others
+
+        Returns:
+            list[str]: ids of the units requeued
+        """
+        requeued: list[str] = []
+        for uid in self._ids(state="claimed"):
+            fp: str = self._fp(state="claimed", uid=uid)
+            try:
+                if time.time() - os.path.getmtime(filename=fp) < self.lease:
+                    continue
+                unit: dict = self._read(state="claimed", uid=uid)
+                # the rename decides which worker requeues it
+                os.rename(src=fp, dst=f"{fp}.expired")
+            except FileNotFoundError:
+                continue
+            self.fail(uid=uid, unit=unit, error="lease expired", src_fp=f"{fp}.expired")
+            logger.warning(msg=f"Lease of unit {uid} expired, requeued")
+            requeued.append(uid)
+        return requeued
+
+    def _series_fp(self, uid: str) -> str:
+        return os.path.join(self.queue_dir, "series", f"{uid}.parquet")
+
+    def save_series(self, uid: str, series_df: DataFrame) -> None:
+        """save the series of a unit next to its result, written atomically
+
+        Args:
+            uid (str): unit id
+            series_df (DataFrame): from utils.ledger.load_run_series
+        """
+        fp: str = self._series_fp(uid=uid)
+        tmp_fp: str = f"{fp}.{socket.gethostname()}.{os.getpid()}.tmp"
+        series_df.to_parquet(path=tmp_fp, index=False)
+        os.replace(src=tmp_fp, dst=fp)
+
+    def load_series(self, uid: str) -> DataFrame | None:
+        """series of a unit done, None if it wasn't saved"""
+        fp: str = self._series_fp(uid=uid)
+        return pd.read_parquet(path=fp) if os.path.exists(path=fp) else None
+
+    def status(self) -> dict[str, int]:
+        """number of units in each state"""
+        return {state: len(self._ids(state=state)) for state in STATES}
+
+    def results(self) -> list[dict]:
+        """units done, with their result, oldest first"""
+        units: list[dict] = []
+        for uid in self._ids(state="done"):
+            try:
+                units.append({"id": uid, **self._read(state="done", uid=uid)})
+            except FileNotFoundError:
+                continue
+        return units
+
+
+def run_worker(
+    queue_dir: str = QUEUE_DIR,
+    lease: float = LEASE_SECONDS,
+    max_attempts: int = MAX_ATTEMPTS,
+    poll: float = POLL_INTERVAL,
+    exit_when_empty: bool = True,
+) -> tuple[int, int]:
+    """claim and backtest units until the queue is drained
+
+    the loaded data of the last dataset is kept, so consecutive units of the same
+    dataset only load it once. The run is recorded in the ledger of the worker, the
+    result written back to the queue has its run_id, host and metrics, and its
+    series are saved in the queue for the comparison of the results.
+
+    Args:
+        queue_dir (str, optional): queue directory. Defaults to QUEUE_DIR.
+        lease (float, optional): see WorkQueue. Defaults to LEASE_SECONDS.
+        max_attempts (int, optional): see WorkQueue. Defaults to MAX_ATTEMPTS.
+        poll (float, optional): seconds between two looks at an empty queue. Defaults
+        to POLL_INTERVAL.
+        exit_when_empty (bool, optional): return once nothing is pending or claimed,
+        else wait for new units. Defaults to True.
+
+    Returns:
+        tuple[int, int]: number of units completed, number of units failed
+    """
+    # the backtest stack is only imported by the workers
+    from main import dataset_key, load_data, main
+    from utils.context import cfg_venues
+    from utils.ledger import load_run_series, query_runs
+
+    queue: WorkQueue = WorkQueue(
+        queue_dir=queue_dir, lease=lease, max_attempts=max_attempts
+    )
+    host: str = socket.gethostname()
+    # (dataset_key, loaded data) of the last unit
+    loaded: tuple | None = None
+    n_done: int = 0
+    n_failed: int = 0
+    while True:
+        queue.requeue_expired()
+        claimed: tuple[str, dict] | None = queue.claim()
+        if claimed is None:
+            status: dict[str, int] = queue.status()
+            if exit_when_empty and status["pending"] + status["claimed"] == 0:
+                return n_done, n_failed
+            time.sleep(poll)
+            continue
+        uid, unit = claimed
+        cfg: dict = unit["cfg"]
+        logger.info(msg=f"Worker {host}:{os.getpid()} running {unit['name']} ({uid})")
+        t0: float = time.perf_counter()
+        with queue.heartbeat(uid=uid):
+            try:
+                key: tuple = dataset_key(cfg=cfg)
+                if loaded is None or loaded[0] != key:
+                    loaded = (key, load_data(cfg=cfg, venues=cfg_venues(cfg=cfg)))
+                loaded[1].load(venues=cfg_venues(cfg=cfg))
+                run_id: int = main(cfg=cfg, ctx=loaded[1])
+                row: dict = (
+                    query_runs(where="run_id = ?", params=(run_id,)).iloc[0].to_dict()
+                )
+                queue.save_series(uid=uid, series_df=load_run_series(run_id=run_id))
+                queue.complete(
+                    uid=uid,
+                    unit=unit,
+                    result={
+                        "run_id": int(run_id),
+                        "host": host,
+                        "seconds": time.perf_counter() - t0,
+                        "metrics": {
+                            k: float(v)
+                            for k, v in row.items()
+                            if isinstance(v, float) and v == v
+                        },
+                    },
+                )
+                n_done += 1
+            except Exception:
+                logger.exception(msg=f"Unit {unit['name']} ({uid}) failed")
+                queue.fail(uid=uid, unit=unit, error=traceback.format_exc())
+                # the data may be what failed, load it again for the next unit
+                loaded = None
+                n_failed += 1